@@ -1,26 +1,267 @@
-import google.generativeai as genai
-from utils import GEMINI_API_KEY
+# advisor.py
+"""
+LLM financial advice. The prompt is built from the latest few expenses and headlines,
+kept within ADVICE_MAX_PROMPT_CHARS, and answered by a pluggable model backend.
+Answers are cached by a hash of the normalized prompt inputs (TTL + LRU, persisted in
+SQLite), so an unchanged situation never pays for a second model call.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import metrics
 from finance_tools import get_expenses, get_finance_news
+from utils import (GEMINI_API_KEY, GEMINI_MODEL, ADVISOR_BACKEND, ADVICE_CACHE_DB, ADVICE_CACHE_TTL,
+                   ADVICE_CACHE_MAX_ENTRIES, ADVICE_MAX_PROMPT_CHARS, ADVICE_NEWS_TTL)
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel("gemini-1.5-flash")
+RECENT_EXPENSES = 5
+MAX_HEADLINE_CHARS = 200
+# bump when the prompt wording changes so old answers are not served for the new prompt
+PROMPT_VERSION = 1
 
-def get_financial_advice():
-    expenses = get_expenses()
-    news = get_finance_news()
+PROMPT_TEMPLATE = """
+I am a personal finance coach. Here are the recent expenses:
+{expenses}
 
-    expense_text = "\n".join([f"{e[1]} - {e[2]} USD ({e[3]})" for e in expenses[-5:]])
-    news_text = "\n".join(news)
+And here is the latest market news:
+{news}
 
-    prompt = f"""
-    I am a personal finance coach. Here are the recent expenses:
-    {expense_text}
+Please analyze the expenses and give financial tips, along with market investment advice in simple terms.
+"""
 
-    And here is the latest market news:
-    {news_text}
 
-    Please analyze the expenses and give financial tips, along with market investment advice in simple terms.
-    """
+# ---------------- model backends ----------------
+class GeminiBackend:
+    """google-generativeai model, configured on first use rather than at import."""
+
+    def __init__(self, model_name=GEMINI_MODEL, api_key=GEMINI_API_KEY):
+        self.name = f"gemini:{model_name}"
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=self.api_key)
+            self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def generate(self, prompt):
+        return self._get_model().generate_content(prompt).text
+
+    def stream(self, prompt):
+        for chunk in self._get_model().generate_content(prompt, stream=True):
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend:
+    """Local stand-in with configurable latency, for offline runs and latency tests."""
+
+    def __init__(self, latency=0.5, chunk_latency=0.02, chunks=10):
+        self.name = "fake"
+        self.latency = latency            # time to first token
+        self.chunk_latency = chunk_latency
+        self.chunks = chunks
+        self.calls = 0
+
+    def _reply(self, prompt):
+        digest = hashlib.sha1(prompt.encode()).hexdigest()[:8]
+        return [f"[fake advice {digest} part {i + 1}] " for i in range(self.chunks)]
+
+    def generate(self, prompt):
+        return "".join(self.stream(prompt))
+
+    def stream(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        for i, part in enumerate(self._reply(prompt)):
+            if i:
+                time.sleep(self.chunk_latency)
+            yield part
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = FakeBackend() if ADVISOR_BACKEND == "fake" else GeminiBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """Swap the model backend (anything with name, generate(prompt) and stream(prompt)). Returns the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+# ---------------- response cache ----------------
+class ResponseCache:
+    """Content-addressed answers in SQLite with a TTL and least-recently-used eviction."""
+
+    def __init__(self, path=ADVICE_CACHE_DB, ttl=ADVICE_CACHE_TTL, max_entries=ADVICE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            backend TEXT,
+            response TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_accessed ON responses (accessed_at)")
+        self.conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self.conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                self.conn.commit()
+                self.hits += 1
+                metrics.cache_access("advice", True)
+                return row[0]
+            if row:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+            self.misses += 1
+            metrics.cache_access("advice", False)
+            return None
+
+    def put(self, key, response, backend=None):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                              (key, backend, response, now, now))
+            self.conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+            self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.conn.commit()
+
 
-    response = model.generate_content(prompt)
-    return response.text
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResponseCache()
+    return _cache
+
+
+def set_response_cache(cache):
+    global _cache
+    previous, _cache = _cache, cache
+    return previous
+
+
+# ---------------- prompt ----------------
+def _clean(text):
+    return " ".join(str(text or "").split())
+
+
+def normalize_inputs(expenses, news):
+    """Canonical form of the prompt inputs; equal situations hash to the same cache key."""
+    return {
+        "expenses": [[_clean(e[1]), round(float(e[2]), 2), _clean(e[3])] for e in expenses],
+        "news": [_clean(title)[:MAX_HEADLINE_CHARS] for title in news],
+    }
+
+
+def build_prompt(inputs, max_chars=ADVICE_MAX_PROMPT_CHARS):
+    """Render the prompt, dropping the oldest headlines, then expenses, until it fits max_chars."""
+    expenses, news = list(inputs["expenses"]), list(inputs["news"])
+    while True:
+        prompt = PROMPT_TEMPLATE.format(
+            expenses="\n".join(f"{category} - {amount} USD ({description})"
+                               for category, amount, description in expenses),
+            news="\n".join(news))
+        if len(prompt) <= max_chars or not (news or expenses):
+            return prompt
+        if news:
+            news.pop()
+        else:
+            expenses.pop()
+
+
+def cache_key(inputs, backend_name):
+    payload = json.dumps({"v": PROMPT_VERSION, "backend": backend_name, **inputs}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+_news = {"at": 0.0, "titles": []}
+_news_lock = threading.Lock()
+
+
+def recent_news():
+    """Headlines, reused for ADVICE_NEWS_TTL seconds instead of one API call per prompt."""
+    with _news_lock:
+        if time.time() - _news["at"] > ADVICE_NEWS_TTL:
+            _news["titles"] = get_finance_news()
+            _news["at"] = time.time()
+        return list(_news["titles"])
+
+
+def _prepare(limit, backend):
+    inputs = normalize_inputs(get_expenses(limit=limit), recent_news())
+    return build_prompt(inputs), cache_key(inputs, backend.name)
+
+
+# ---------------- public API ----------------
+def get_financial_advice(limit=RECENT_EXPENSES, use_cache=True, backend=None):
+    backend = backend or get_backend()
+    prompt, key = _prepare(limit, backend)
+    cache = get_response_cache() if use_cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    text = backend.generate(prompt)
+    if cache:
+        cache.put(key, text, backend.name)
+    return text
+
+
+def stream_financial_advice(limit=RECENT_EXPENSES, use_cache=True, backend=None):
+    """
+    Yield the advice as it is generated (a cached answer arrives as one chunk).
+    The full answer is cached only once the stream completes.
+    """
+    backend = backend or get_backend()
+    prompt, key = _prepare(limit, backend)
+    cache = get_response_cache() if use_cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    parts = []
+    for chunk in backend.stream(prompt):
+        parts.append(chunk)
+        yield chunk
+    if cache:
+        cache.put(key, "".join(parts), backend.name)
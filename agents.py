@@ -2,13 +2,17 @@
 """
 Crew-style agents implemented as small classes with a uniform handle_task interface.
 These use your existing data_fetchers, portfolio, and memory modules.
+Market data, the optimizer, goal projections and analytics (yfinance, pandas, numpy,
+pyarrow) are imported inside the methods that need them, so a process that only
+records expenses never loads them.
 """
 
-from data_fetchers import fetch_stock_history, fetch_current_price, fetch_crypto_price, fetch_news
-from portfolio import mean_variance_optimization, simple_rebalance_suggestion
-from memory import Transaction, Portfolio, User
-import pandas as pd
-import numpy as np
+from importer import import_transactions
+import categorize
+import ledger
+import repository
+import snapshots
+from utils import USE_MONTH_ROLLUP, GOAL_ANNUAL_RETURN
 import json
 import datetime
 
@@ -16,54 +20,89 @@ import datetime
 class ExpenseAgent:
     name = "expense"
 
-    def __init__(self, session, user):
+    def __init__(self, session, user, use_rollup=USE_MONTH_ROLLUP):
         self.session = session
         self.user = user
+        self.use_rollup = use_rollup
 
     # core helpers (kept similar to original)
-    def add_transaction(self, category, amount):
-        t = Transaction(user_id=self.user.id, category=category, amount=amount)
-        self.session.add(t)
+    def add_transaction(self, category, amount, description=None):
+        t, verdict = repository.add_transaction(self.session, self.user.id, category, amount, description)
+        self.session.commit()
+        return {"status": "ok", "added": {"category": t.category, "amount": amount}, "anomaly": verdict}
+
+    def add_category_rule(self, category, pattern=None, kind="keyword", min_amount=None, max_amount=None,
+                          priority=0):
+        rule = categorize.add_rule(self.session, self.user.id, category, pattern, kind, min_amount, max_amount,
+                                   priority)
         self.session.commit()
-        return {"status": "ok", "added": {"category": category, "amount": amount}}
+        return {"status": "ok", "rule_id": rule.id, "category": rule.category}
+
+    def category_rules(self):
+        return categorize.rules(self.session, self.user.id)
+
+    def categorize(self, descriptions, amounts=None):
+        categorizer = categorize.for_user(self.session, self.user.id)
+        return {"categories": categorizer.categorize_many(list(descriptions), amounts)}
+
+    def flagged_transactions(self, limit=10):
+        return [{"id": i, "category": c, "amount": a, "description": d, "date": date, "score": score}
+                for i, c, a, d, date, score in repository.flagged_expenses(self.session, self.user.id, limit)]
 
     def monthly_summary(self):
-        now = datetime.datetime.utcnow()
-        start = datetime.datetime(now.year, now.month, 1)
-        txs = self.session.query(Transaction).filter(
-            Transaction.user_id == self.user.id,
-            Transaction.timestamp >= start
-        ).all()
-        cats = {}
-        for t in txs:
-            cats[t.category] = cats.get(t.category, 0) + t.amount
-        return cats
-
-    def monthly_savings(self):
-        total_expense = sum(self.monthly_summary().values())
-        income = self.user.income or 0
-        return max(0, income - total_expense)
+        return repository.monthly_summary(self.session, self.user.id, use_rollup=self.use_rollup)
 
-    def expense_report(self):
-        summary = self.monthly_summary()
-        savings = self.monthly_savings()
+    def monthly_savings(self, summary=None):
+        if summary is None:
+            summary = self.monthly_summary()
+        income = self.user.income or 0
+        return max(0, income - sum(summary.values()))
+
+    def expense_report(self, summary=None):
+        if summary is None:
+            # the nightly snapshot, unless an expense or the income changed since
+            report = snapshots.load(self.session, self.user, snapshots.EXPENSE_REPORT,
+                                    snapshots.inputs_key(self.user, snapshots.EXPENSE_REPORT))
+            if report is not None:
+                return report
+            summary = self.monthly_summary()
         report = {
             "categories": summary,
             "total_expense": sum(summary.values()),
-            "monthly_savings": savings
+            "monthly_savings": self.monthly_savings(summary)
         }
         return report
 
+    def import_transactions(self, source, fmt=None, chunk_size=None, category_map=None, debits_negative=None):
+        kwargs = {"chunk_size": int(chunk_size)} if chunk_size else {}
+        return import_transactions(self.session, self.user, source, fmt=fmt, category_map=category_map,
+                                   debits_negative=debits_negative, **kwargs)
+
     # uniform agent entry
     def handle_task(self, task_name, payload):
         if task_name == "add_transaction":
-            return self.add_transaction(payload.get("category"), float(payload.get("amount", 0)))
+            return self.add_transaction(payload.get("category"), float(payload.get("amount", 0)),
+                                        payload.get("description"))
+        if task_name == "add_category_rule":
+            return self.add_category_rule(payload.get("category"), payload.get("pattern"),
+                                          payload.get("kind", "keyword"), payload.get("min_amount"),
+                                          payload.get("max_amount"), payload.get("priority", 0))
+        if task_name == "category_rules":
+            return self.category_rules()
+        if task_name == "categorize":
+            return self.categorize(payload.get("descriptions") or [], payload.get("amounts"))
+        if task_name == "import_transactions":
+            return self.import_transactions(payload.get("file") or payload.get("path"), payload.get("format"),
+                                            payload.get("chunk_size"), payload.get("category_map"),
+                                            payload.get("debits_negative"))
+        if task_name == "flagged_transactions":
+            return self.flagged_transactions(payload.get("limit", 10))
         if task_name == "monthly_summary":
             return self.monthly_summary()
         if task_name == "expense_report":
-            return self.expense_report()
+            return self.expense_report(payload.get("summary"))
         if task_name == "monthly_savings":
-            return {"monthly_savings": self.monthly_savings()}
+            return {"monthly_savings": self.monthly_savings(payload.get("summary"))}
         raise ValueError(f"Unknown task {task_name} for ExpenseAgent")
 
 
@@ -75,19 +114,18 @@ class MarketAgent:
         self.user = user
 
     def get_stock_prices(self, tickers):
-        prices = {}
-        for t in tickers:
-            price = fetch_current_price(t)
-            if price is not None:
-                prices[t] = price
-        return prices
-
-    def fetch_price_dataframe(self, tickers, period="1y"):
-        dfs = {}
-        for t in tickers:
-            hist = fetch_stock_history(t, period=period)
-            if hist is not None and not hist.empty:
-                dfs[t] = hist['Close']
+        from data_fetchers import fetch_current_prices
+        return fetch_current_prices(tickers)
+
+    def fetch_histories(self, tickers, period="1y"):
+        from data_fetchers import fetch_stock_histories
+        return fetch_stock_histories(tickers, period=period)
+
+    def fetch_price_dataframe(self, tickers, period="1y", histories=None):
+        import pandas as pd
+        if histories is None:
+            histories = self.fetch_histories(tickers, period=period)
+        dfs = {t: h['Close'] for t, h in histories.items() if h is not None and not h.empty}
         if not dfs:
             return pd.DataFrame()
         df = pd.concat(dfs.values(), axis=1)
@@ -95,9 +133,15 @@ class MarketAgent:
         return df.ffill().dropna()
 
     def get_crypto_price(self, coin_id):
+        from data_fetchers import fetch_crypto_price
         return fetch_crypto_price(coin_id)
 
+    def get_crypto_prices(self, coin_ids):
+        from data_fetchers import fetch_crypto_prices
+        return fetch_crypto_prices(coin_ids)
+
     def get_news(self, query):
+        from data_fetchers import fetch_news
         return fetch_news(query)
 
     def handle_task(self, task_name, payload):
@@ -107,6 +151,8 @@ class MarketAgent:
             return self.fetch_price_dataframe(payload.get("tickers", []), payload.get("period", "1y"))
         if task_name == "get_crypto_price":
             return {"price": self.get_crypto_price(payload.get("coin_id", "bitcoin"))}
+        if task_name == "get_crypto_prices":
+            return self.get_crypto_prices(payload.get("coin_ids", ["bitcoin"]))
         if task_name == "get_news":
             return self.get_news(payload.get("query", "finance"))
         raise ValueError(f"Unknown task {task_name} for MarketAgent")
@@ -121,38 +167,114 @@ class InvestmentAgent:
         self.market = MarketAgent(session, user)
 
     def suggest_portfolio(self, tickers, current_holdings=None):
-        # fetch historical price dataframe
-        price_df = self.market.fetch_price_dataframe(tickers)
+        from data_fetchers import latest_prices
+        from portfolio import EfficientFrontier, simple_rebalance_suggestion
+        # fetch history once; spot prices come from the same download
+        histories = self.market.fetch_histories(tickers)
+        price_df = self.market.fetch_price_dataframe(tickers, histories=histories)
         if price_df.empty:
             return {"error": "No price data for selected tickers."}
 
-        # compute optimal weights
-        weights = mean_variance_optimization(price_df)
-        prices = self.market.get_stock_prices(tickers)
-
-        # load or create portfolio record
-        portfolio_record = self.session.query(Portfolio).filter_by(user_id=self.user.id).first()
-        suggestions = {}
-        current_holdings = current_holdings or {}
-        if portfolio_record:
-            current_holdings = portfolio_record.holdings or {}
-            suggestions = simple_rebalance_suggestion(current_holdings, weights, prices)
+        # pick the frontier point matching the user's risk tolerance
+        frontier = EfficientFrontier.from_prices(price_df, returns_period="1y")
+        weights = frontier.for_risk_tolerance(self.user.risk_tolerance)
+        expected_return, volatility = frontier.performance(weights.values)
+        prices = latest_prices(histories)
 
-        if not portfolio_record:
-            portfolio_record = Portfolio(user_id=self.user.id, holdings={})
-            self.session.add(portfolio_record)
-            self.session.commit()
+        # size from the ledger's positions at these prices; without any, from holdings passed in by the caller
+        if ledger.holdings(self.session, self.user.id):
+            suggestions = ledger.rebalance(self.session, self.user.id, weights.to_dict(), prices)
+        else:
+            suggestions = simple_rebalance_suggestion(current_holdings or {}, weights, prices)
 
         return {
             "weights": weights.to_dict(),
+            "expected_return": float(expected_return),
+            "volatility": float(volatility),
             "prices": prices,
             "rebalance_suggestions": suggestions
         }
 
+    def record_trade(self, symbol, quantity, price=None, fees=0.0):
+        """Book a buy (quantity > 0) or sell; price defaults to the latest close."""
+        symbol = str(symbol or "").strip().upper()
+        if price is None:
+            from data_fetchers import latest_prices
+            price = latest_prices(self.market.fetch_histories([symbol], period="5d")).get(symbol)
+            if price is None:
+                return {"error": f"No price for {symbol}."}
+        trade = ledger.record_trade(self.session, self.user.id, symbol, quantity, price, fees)
+        self.session.commit()
+        return {"status": "ok", "trade": {"symbol": trade.symbol, "quantity": trade.quantity, "price": trade.price,
+                                          "fees": trade.fees, "realized_pnl": round(trade.realized_pnl, 2)},
+                "book": ledger.book(self.session, self.user.id)}
+
+    def positions(self):
+        return {"positions": ledger.positions(self.session, self.user.id),
+                "book": ledger.book(self.session, self.user.id)}
+
+    def nav_history(self, since=None):
+        return {"nav": ledger.nav_series(self.session, self.user.id, since)}
+
+    def portfolio_risk(self, tickers, weights=None, period="2y", horizons=None, n_paths=None,
+                       method="montecarlo", initial_value=None, goal_value=None, block_size=1):
+        """VaR/CVaR, drawdown and goal-hit odds for weights (default: the risk-tolerance frontier point)."""
+        from portfolio import EfficientFrontier
+        from risk import risk_report, DEFAULT_PATHS
+        if n_paths is None:
+            n_paths = DEFAULT_PATHS
+        price_df = self.market.fetch_price_dataframe(tickers, period=period)
+        if price_df.empty:
+            return {"error": "No price data for selected tickers."}
+        if not weights:
+            weights = EfficientFrontier.from_prices(price_df, returns_period="1y").for_risk_tolerance(
+                self.user.risk_tolerance).to_dict()
+        report = risk_report(price_df, weights, initial_value=initial_value, goal_value=goal_value,
+                             horizons=horizons, n_paths=int(n_paths), method=method, block_size=block_size)
+        report["weights"] = {t: float(w) for t, w in weights.items()}
+        return report
+
+    def backtest_portfolio(self, tickers, strategy=None, period="5y", window=None, rebalance_every=None,
+                           cost_bps=None, initial_value=10_000.0):
+        """Walk-forward backtest on cached history; strategy defaults to the user's risk tolerance."""
+        from backtest import backtest, DEFAULT_WINDOW, DEFAULT_REBALANCE_EVERY, DEFAULT_COST_BPS
+        window = DEFAULT_WINDOW if window is None else window
+        rebalance_every = DEFAULT_REBALANCE_EVERY if rebalance_every is None else rebalance_every
+        cost_bps = DEFAULT_COST_BPS if cost_bps is None else cost_bps
+        price_df = self.market.fetch_price_dataframe(tickers, period=period)
+        if price_df.empty:
+            return {"error": "No price data for selected tickers."}
+        result = backtest(price_df, strategy or self.user.risk_tolerance or "medium", int(window),
+                          int(rebalance_every), float(cost_bps), float(initial_value))
+        return {
+            "stats": result["stats"],
+            "equity_curve": {d.strftime("%Y-%m-%d"): round(float(v), 2) for d, v in result["equity"].items()},
+            "turnover": {d.strftime("%Y-%m-%d"): round(float(v), 4) for d, v in result["turnover"].items()},
+            "final_weights": result["weights"].iloc[-1].to_dict(),
+        }
+
     def handle_task(self, task_name, payload):
         if task_name == "suggest_portfolio":
             tickers = payload.get("tickers", [])
             return self.suggest_portfolio(tickers, payload.get("current_holdings"))
+        if task_name == "portfolio_risk":
+            return self.portfolio_risk(payload.get("tickers", []), payload.get("weights"),
+                                       payload.get("period", "2y"), payload.get("horizons"),
+                                       payload.get("n_paths"), payload.get("method", "montecarlo"),
+                                       payload.get("initial_value"), payload.get("goal_value"),
+                                       payload.get("block_size", 1))
+        if task_name == "backtest_portfolio":
+            return self.backtest_portfolio(payload.get("tickers", []), payload.get("strategy"),
+                                           payload.get("period", "5y"), payload.get("window"),
+                                           payload.get("rebalance_every"), payload.get("cost_bps"),
+                                           payload.get("initial_value", 10_000.0))
+        if task_name == "record_trade":
+            return self.record_trade(payload.get("symbol"), payload.get("quantity"), payload.get("price"),
+                                     payload.get("fees", 0.0))
+        if task_name == "positions":
+            return self.positions()
+        if task_name == "nav_history":
+            return self.nav_history(payload.get("since"))
         raise ValueError(f"Unknown task {task_name} for InvestmentAgent")
 
 
@@ -169,63 +291,53 @@ class GoalAgent:
             "name": name,
             "target": float(target_amount),
             "deadline": deadline,
-            "created": str(pd.Timestamp.utcnow())
+            "created": str(datetime.datetime.now(datetime.timezone.utc))
         })
         self.user.goals = json.dumps(goals)
         self.session.commit()
         return {"status": "ok", "goal": {"name": name, "target": target_amount, "deadline": deadline}}
 
-    def progress(self):
-        et = ExpenseAgent(self.session, self.user)
-        monthly_savings = et.monthly_savings()
-        expense_summary = et.monthly_summary()
-        goals = json.loads(self.user.goals) if self.user.goals else []
-
-        for g in goals:
-            g['monthly_savings'] = monthly_savings
-            if monthly_savings > 0:
-                g['months_to_goal'] = round(g['target'] / monthly_savings, 1)
-                g['achievable'] = g['months_to_goal'] <= self._months_until(g['deadline'])
-            else:
-                g['months_to_goal'] = None
-                g['achievable'] = False
-
-            # Suggestions if not achievable
-            if not g['achievable']:
-                suggestions = []
-                months_left = self._months_until(g['deadline'])
-                if months_left > 0:
-                    required_savings = g['target'] / months_left
-                    extra_needed = required_savings - monthly_savings
-                    # Suggest cutting from biggest categories first
-                    sorted_expenses = sorted(expense_summary.items(), key=lambda x: x[1], reverse=True)
-                    for cat, amt in sorted_expenses:
-                        if extra_needed <= 0:
-                            break
-                        cut = min(amt * 0.2, extra_needed)  # suggest cutting up to 20% per category
-                        if cut > 0:
-                            suggestions.append(f"Reduce {cat} expenses by ₹{cut:.2f}")
-                            extra_needed -= cut
-                    if extra_needed > 0:
-                        suggestions.append(f"Still need extra savings of ₹{extra_needed:.2f} or extend the deadline.")
-                    g['suggestions'] = suggestions
-                else:
-                    g['suggestions'] = ["Deadline already passed or invalid."]
-
-        return goals
-
-    def _months_until(self, deadline_str):
-        try:
-            deadline = pd.to_datetime(deadline_str)
-            now = datetime.datetime.utcnow()
-            delta = (deadline.year - now.year) * 12 + (deadline.month - now.month)
-            return max(delta, 0)
-        except Exception:
-            return 0
+    def progress(self, expense_summary=None, annual_return=None):
+        if annual_return is None:
+            annual_return = GOAL_ANNUAL_RETURN
+        if expense_summary is None:
+            progress = snapshots.load(self.session, self.user, snapshots.GOAL_PROGRESS,
+                                      snapshots.inputs_key(self.user, snapshots.GOAL_PROGRESS, annual_return))
+            if progress is not None:
+                return progress
+            expense_summary = ExpenseAgent(self.session, self.user).monthly_summary()
+        from goals import cached_projection
+        return cached_projection(self.user.id, self.user.goals, expense_summary, self.user.income,
+                                 annual_return)
 
     def handle_task(self, task_name, payload):
         if task_name == "add_goal":
             return self.add_goal(payload.get("name"), payload.get("target_amount"), payload.get("deadline"))
         if task_name == "progress":
-            return self.progress()
+            return self.progress(payload.get("summary"), payload.get("annual_return"))
         raise ValueError(f"Unknown task {task_name} for GoalAgent")
+
+
+class AnalyticsAgent:
+    name = "analytics"
+
+    def __init__(self, session, user):
+        self.session = session
+        self.user = user
+
+    def export_transactions(self, fmt="arrow", force=False):
+        import analytics
+        return analytics.export_transactions(self.session, self.user.id, fmt=fmt, force=force)
+
+    def spending_trends(self, window=3, n_movers=5):
+        """Refreshes the Arrow export only if transactions changed, then queries it."""
+        export = self.export_transactions()
+        import analytics
+        return analytics.spending_trends(export["path"], int(window), int(n_movers))
+
+    def handle_task(self, task_name, payload):
+        if task_name == "export_transactions":
+            return self.export_transactions(payload.get("fmt", "arrow"), payload.get("force", False))
+        if task_name == "spending_trends":
+            return self.spending_trends(payload.get("window", 3), payload.get("n_movers", 5))
+        raise ValueError(f"Unknown task {task_name} for AnalyticsAgent")
@@ -0,0 +1,244 @@
+# analytics.py
+"""
+Historical spending analysis over columnar exports.
+A user's transactions are streamed out of the database into an Arrow IPC file
+(or Parquet for sharing), refreshed only when the table has changed. Queries read
+the Arrow file through a memory map, so a multi-year history loads without copying,
+and aggregate with NumPy on the columns: month-by-category totals, month over month,
+rolling averages, seasonality and top movers.
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+from sqlalchemy import select, func, cast, String
+from memory import Transaction, User
+from utils import ANALYTICS_DIR
+import metrics
+
+EXPORT_BATCH_ROWS = 50_000
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("timestamp", pa.timestamp("us")),
+    ("category", pa.dictionary(pa.int32(), pa.string())),
+    ("amount", pa.float64()),
+    ("description", pa.string()),
+])
+MONTHLY_CACHE_SIZE = 32
+UNCATEGORIZED = "Uncategorized"
+
+
+_export_locks = {}  # path -> lock serializing refreshes of that export in this process
+_export_locks_guard = threading.Lock()
+
+
+def export_path(user_id, fmt="arrow", directory=None):
+    ext = "parquet" if fmt == "parquet" else "arrow"
+    return os.path.join(directory or ANALYTICS_DIR, f"transactions_user{user_id}.{ext}")
+
+
+_STATE_KEYS = (b"rows", b"max_id", b"data_version")
+
+
+def _table_state(session, user_id):
+    # data_version catches rewrites in place (a categorize backfill) that leave count and max id alone
+    version = select(User.data_version).where(User.id == user_id).scalar_subquery()
+    rows, max_id, data_version = session.execute(
+        select(func.count(Transaction.id), func.max(Transaction.id), version)
+        .where(Transaction.user_id == user_id)).one()
+    return {b"rows": str(rows).encode(), b"max_id": str(max_id or 0).encode(),
+            b"data_version": str(data_version or 0).encode()}
+
+
+def _categories(session, user_id):
+    # one dictionary for the whole file: the IPC file format can't replace it between batches
+    rows = session.execute(select(Transaction.category).where(Transaction.user_id == user_id).distinct())
+    return sorted({c or UNCATEGORIZED for (c,) in rows})
+
+
+def _batches(session, user_id):
+    names = _categories(session, user_id)
+    dictionary = pa.array(names, pa.string())
+    codes = {name: i for i, name in enumerate(names)}
+    # timestamps come back as text and are parsed by Arrow in one cast instead of row by row;
+    # id order scans the table, timestamp order would seek the index once per row
+    query = (select(Transaction.id, cast(Transaction.timestamp, String), Transaction.category,
+                    Transaction.amount, Transaction.description)
+             .where(Transaction.user_id == user_id)
+             .order_by(Transaction.id))
+    result = session.connection().execution_options(yield_per=EXPORT_BATCH_ROWS).execute(query)
+    for chunk in result.partitions():
+        ids, ts, cats, amounts, descs = zip(*chunk)
+        category = pa.DictionaryArray.from_arrays(
+            pa.array([codes[c or UNCATEGORIZED] for c in cats], pa.int32()), dictionary)
+        yield pa.record_batch([
+            pa.array(ids, pa.int64()),
+            pa.array(ts, pa.string()).cast(pa.timestamp("us")),
+            category,
+            pa.array(amounts, pa.float64()),
+            pa.array(descs, pa.string()),
+        ], schema=SCHEMA)
+
+
+def export_transactions(session, user_id, fmt="arrow", path=None, force=False):
+    """
+    Stream the user's transactions into an Arrow IPC file (fmt="arrow") or Parquet
+    (fmt="parquet") in batches of EXPORT_BATCH_ROWS. An existing export whose recorded row
+    count, max id and user data_version still match is reused unless force is set.
+    Returns {"path", "rows", "refreshed"}.
+    """
+    path = path or export_path(user_id, fmt)
+    state = _table_state(session, user_id)
+    if not force and os.path.exists(path) and _file_state(path) == state:
+        return {"path": path, "rows": int(state[b"rows"]), "refreshed": False}
+
+    with _export_locks_guard:
+        lock = _export_locks.setdefault(path, threading.Lock())
+    with lock:
+        # a concurrent refresh may have written this state while we waited
+        if not force and os.path.exists(path) and _file_state(path) == state:
+            return {"path": path, "rows": int(state[b"rows"]), "refreshed": False}
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        schema = SCHEMA.with_metadata(state)
+        # a temp file of its own: other processes may be refreshing the same export
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+        os.close(fd)
+        try:
+            if fmt == "parquet":
+                writer = pq.ParquetWriter(tmp, schema)
+            else:
+                writer = ipc.new_file(tmp, schema)
+            try:
+                for batch in _batches(session, user_id):
+                    writer.write_batch(batch)
+            finally:
+                writer.close()
+            os.replace(tmp, path)  # readers never see a half-written file
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    return {"path": path, "rows": int(state[b"rows"]), "refreshed": True}
+
+
+def _file_state(path):
+    if path.endswith(".parquet"):
+        metadata = pq.read_schema(path).metadata or {}
+    else:
+        with pa.memory_map(path) as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+    return {k: v for k, v in metadata.items() if k in _STATE_KEYS}
+
+
+def load_transactions(path):
+    """pyarrow Table for an export; Arrow files are memory-mapped (zero copy)."""
+    if path.endswith(".parquet"):
+        return pq.read_table(path, memory_map=True)
+    return ipc.open_file(pa.memory_map(path)).read_all()
+
+
+# ---------------- queries ----------------
+_monthly = OrderedDict()
+_monthly_lock = threading.Lock()
+
+
+def monthly_by_category(path):
+    """DataFrame of spend, one row per month ("YYYY-MM", gaps filled with 0), one column per category."""
+    key = (path, os.path.getmtime(path))
+    with _monthly_lock:
+        if key in _monthly:
+            _monthly.move_to_end(key)
+            metrics.cache_access("analytics_monthly", True)
+            return _monthly[key]
+    metrics.cache_access("analytics_monthly", False)
+
+    table = load_transactions(path)
+    if table.num_rows == 0:
+        frame = pd.DataFrame()
+    else:
+        months = table.column("timestamp").to_numpy().astype("datetime64[M]").astype(np.int64)
+        chunks = table.column("category").chunks
+        codes = np.concatenate([c.indices.to_numpy() for c in chunks])
+        names = chunks[0].dictionary.to_pylist()
+        amounts = table.column("amount").to_numpy()
+        first, n_months, n_cats = months.min(), months.max() - months.min() + 1, len(names)
+        # one bincount over (month, category) cells instead of a Python group-by
+        totals = np.bincount((months - first) * n_cats + codes, weights=amounts, minlength=n_months * n_cats)
+        index = pd.period_range(pd.Period(np.datetime64(int(first), "M"), "M"), periods=n_months, freq="M")
+        frame = pd.DataFrame(totals.reshape(n_months, n_cats), index=index.strftime("%Y-%m"), columns=names)
+        frame.index.name = "month"
+
+    with _monthly_lock:
+        _monthly[key] = frame
+        while len(_monthly) > MONTHLY_CACHE_SIZE:
+            _monthly.popitem(last=False)
+    return frame
+
+
+def month_over_month(monthly, month=None):
+    """Per category: this month, the previous month, absolute and percentage change."""
+    if monthly.empty:
+        return pd.DataFrame(columns=["current", "previous", "change", "pct_change"])
+    pos = monthly.index.get_loc(month) if month else len(monthly) - 1
+    current = monthly.iloc[pos]
+    previous = monthly.iloc[pos - 1] if pos > 0 else current * 0
+    out = pd.DataFrame({"current": current, "previous": previous, "change": current - previous})
+    out["pct_change"] = np.where(previous > 0, out["change"] / previous.where(previous > 0, 1), np.nan)
+    return out.sort_values("change", ascending=False)
+
+
+def rolling_average(monthly, window=3):
+    """Trailing window-month mean per category (and a "Total" column)."""
+    frame = monthly.assign(Total=monthly.sum(axis=1))
+    return frame.rolling(window, min_periods=1).mean()
+
+
+def seasonality(monthly):
+    """
+    Average spend per calendar month relative to the overall monthly average
+    (1.2 = 20% above a typical month), for the total and for each category.
+    """
+    if monthly.empty:
+        return pd.DataFrame()
+    frame = monthly.assign(Total=monthly.sum(axis=1))
+    calendar = pd.PeriodIndex(frame.index, freq="M").month
+    by_month = frame.groupby(calendar).mean()
+    overall = frame.mean().replace(0, np.nan)
+    index = by_month / overall
+    index.index.name = "calendar_month"
+    return index
+
+
+def top_movers(monthly, n=5, baseline_months=3):
+    """Categories whose latest month moved most against their trailing baseline_months average."""
+    if len(monthly) < 2:
+        return pd.DataFrame(columns=["current", "baseline", "change", "pct_change"])
+    current = monthly.iloc[-1]
+    baseline = monthly.iloc[-1 - baseline_months:-1].mean()
+    out = pd.DataFrame({"current": current, "baseline": baseline, "change": current - baseline})
+    out["pct_change"] = np.where(baseline > 0, out["change"] / baseline.where(baseline > 0, 1), np.nan)
+    return out.reindex(out["change"].abs().sort_values(ascending=False).index).head(n)
+
+
+def spending_trends(path, window=3, n_movers=5):
+    """Everything the trend view needs, as JSON-friendly dicts."""
+    monthly = monthly_by_category(path)
+    if monthly.empty:
+        return {"months": [], "monthly_totals": {}, "by_category": {}, "month_over_month": {},
+                "rolling_average": {}, "seasonality": {}, "top_movers": {}}
+    return {
+        "months": list(monthly.index),
+        "monthly_totals": monthly.sum(axis=1).round(2).to_dict(),
+        "by_category": monthly.round(2).to_dict(orient="index"),
+        "month_over_month": month_over_month(monthly).round(4).to_dict(orient="index"),
+        "rolling_average": rolling_average(monthly, window)["Total"].round(2).to_dict(),
+        "seasonality": seasonality(monthly)["Total"].round(3).to_dict(),
+        "top_movers": top_movers(monthly, n_movers).round(4).to_dict(orient="index"),
+    }
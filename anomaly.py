@@ -0,0 +1,177 @@
+# anomaly.py
+"""
+Online detection of unusual expenses.
+Each user/category keeps a small CategoryStats row: Welford count/mean/M2, an
+exponentially weighted mean and variance (recent behaviour), and a P-square sketch of
+the ANOMALY_QUANTILE of amounts. A new expense is scored against that state and then
+folded into it, O(1) per transaction with no history scan. Only the high side is
+flagged: spending far above normal, not unusually small purchases.
+"""
+
+import math
+from bisect import bisect_right, insort
+from memory import CategoryStats, Transaction
+from utils import ANOMALY_Z_THRESHOLD, ANOMALY_MIN_HISTORY, ANOMALY_EWMA_ALPHA, ANOMALY_QUANTILE
+
+REBUILD_BATCH_ROWS = 50_000
+# deviations below 1% of the mean are noise (e.g. a rent that never changed)
+MIN_RELATIVE_STD = 0.01
+
+
+# ---------------- P-square quantile sketch (Jain & Chlamtac) ----------------
+def p2_update(sketch, x, p=ANOMALY_QUANTILE):
+    """Fold x into {"h": marker heights, "n": marker positions}, in place."""
+    h, n = sketch["h"], sketch["n"]
+    if len(h) < 5:
+        insort(h, x)
+        n[:] = range(1, len(h) + 1)
+        return
+    if x < h[0]:
+        h[0], k = x, 0
+    elif x >= h[4]:
+        h[4], k = x, 3
+    else:
+        k = min(bisect_right(h, x) - 1, 3)
+    for i in range(k + 1, 5):
+        n[i] += 1
+    total = n[4]
+    desired = (1, 1 + (total - 1) * p / 2, 1 + (total - 1) * p, 1 + (total - 1) * (1 + p) / 2, total)
+    for i in (1, 2, 3):
+        d = desired[i] - n[i]
+        if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+            parabolic = h[i] + d / (n[i + 1] - n[i - 1]) * (
+                (n[i] - n[i - 1] + d) * (h[i + 1] - h[i]) / (n[i + 1] - n[i])
+                + (n[i + 1] - n[i] - d) * (h[i] - h[i - 1]) / (n[i] - n[i - 1]))
+            if not h[i - 1] < parabolic < h[i + 1]:
+                parabolic = h[i] + d * (h[i + d] - h[i]) / (n[i + d] - n[i])
+            h[i] = parabolic
+            n[i] += d
+
+
+def p2_quantile(sketch, p=ANOMALY_QUANTILE):
+    h = sketch["h"]
+    if not h:
+        return None
+    if len(h) < 5:
+        return h[min(len(h) - 1, int(p * len(h)))]
+    return h[2]
+
+
+# ---------------- running statistics ----------------
+# scoring works on plain dicts; CategoryStats rows are read and written once per batch,
+# not once per transaction (ORM attribute events dominate otherwise)
+FIELDS = ("count", "mean", "m2", "ewma", "ewm_var")
+
+
+def new_state():
+    return {"count": 0, "mean": 0.0, "m2": 0.0, "ewma": 0.0, "ewm_var": 0.0, "sketch": {"h": [], "n": []}}
+
+
+def _read(row):
+    state = {f: getattr(row, f) or 0 for f in FIELDS}
+    sketch = row.sketch or {}
+    state["sketch"] = {"h": list(sketch.get("h", [])), "n": list(sketch.get("n", []))}
+    return state
+
+
+def _write(row, state):
+    for f in FIELDS:
+        setattr(row, f, state[f])
+    row.sketch = {"h": list(state["sketch"]["h"]), "n": list(state["sketch"]["n"])}
+
+
+def _deviations(x, center, variance):
+    std = max(math.sqrt(max(variance, 0.0)), MIN_RELATIVE_STD * abs(center), 1e-9)
+    return (x - center) / std
+
+
+def score(state, amount):
+    """Verdict for amount against the category's state before it is added."""
+    count = state["count"]
+    if count < max(2, ANOMALY_MIN_HISTORY):  # a sample variance needs two expenses
+        return {"flagged": False, "score": None, "reasons": ["new category"] if count == 0 else [],
+                "history": count}
+    z = _deviations(amount, state["mean"], state["m2"] / (count - 1))
+    recent_z = _deviations(amount, state["ewma"], state["ewm_var"])
+    typical_max = p2_quantile(state["sketch"])
+    # both views must agree: the long-run mean alone keeps flagging after a lasting shift in spending,
+    # the EWMA alone is jumpy; the quantile gate spares categories with naturally wide spreads
+    flagged = (z >= ANOMALY_Z_THRESHOLD and recent_z >= ANOMALY_Z_THRESHOLD
+               and (typical_max is None or amount > typical_max))
+    reasons = [f"{z:.1f} std above the category average", f"{recent_z:.1f} std above recent spending",
+               f"above the usual maximum of {typical_max:.2f}"] if flagged else []
+    return {"flagged": flagged, "score": round(min(z, recent_z), 2), "reasons": reasons,
+            "mean": round(state["mean"], 2),
+            "typical_max": round(typical_max, 2) if typical_max is not None else None, "history": count}
+
+
+def update(state, amount):
+    """Fold amount into the running state (Welford, EWMA, quantile sketch), in place."""
+    count = state["count"] + 1
+    delta = amount - state["mean"]
+    mean = state["mean"] + delta / count
+    state["m2"] += delta * (amount - mean)
+    state["mean"], state["count"] = mean, count
+    if count == 1:
+        state["ewma"], state["ewm_var"] = amount, 0.0
+    else:
+        diff = amount - state["ewma"]
+        step = ANOMALY_EWMA_ALPHA * diff
+        state["ewma"] += step
+        state["ewm_var"] = (1 - ANOMALY_EWMA_ALPHA) * (state["ewm_var"] + diff * step)
+    p2_update(state["sketch"], amount)
+
+
+def observe(session, user_id, category, amount):
+    """Score one expense, then add it to its category's state. Does not commit."""
+    return observe_many(session, user_id, [{"category": category, "amount": amount}])[0]
+
+
+def observe_many(session, user_id, rows):
+    """
+    Score a batch of {"category", "amount"} dicts in order with one state lookup, setting
+    row["anomaly_score"] (None unless flagged) ready for a bulk insert. Returns the verdicts.
+    Does not commit.
+    """
+    # autoflush here, so stats added earlier in the same transaction are found
+    stored = {s.category: s for s in session.query(CategoryStats).filter(
+        CategoryStats.user_id == user_id, CategoryStats.category.in_({r["category"] for r in rows}))}
+    states = {category: _read(row) for category, row in stored.items()}
+    verdicts = []
+    for r in rows:
+        state = states.get(r["category"])
+        if state is None:
+            state = states[r["category"]] = new_state()
+        verdict = score(state, r["amount"])
+        r["anomaly_score"] = verdict["score"] if verdict["flagged"] else None
+        update(state, r["amount"])
+        verdicts.append(verdict)
+    for category, state in states.items():
+        row = stored.get(category)
+        if row is None:
+            row = CategoryStats(user_id=user_id, category=category)
+            session.add(row)
+        _write(row, state)
+    return verdicts
+
+
+def rebuild_category_stats(session, user_id=None):
+    """Recompute the state from stored transactions in insertion order (all users, or one)."""
+    query = session.query(Transaction.user_id, Transaction.category, Transaction.amount).order_by(Transaction.id)
+    existing = session.query(CategoryStats)
+    if user_id is not None:
+        query = query.filter(Transaction.user_id == user_id)
+        existing = existing.filter(CategoryStats.user_id == user_id)
+    existing.delete(synchronize_session=False)
+    states = {}
+    for u, category, amount in query.yield_per(REBUILD_BATCH_ROWS):
+        state = states.get((u, category))
+        if state is None:
+            state = states[(u, category)] = new_state()
+        update(state, float(amount or 0.0))
+    for (u, category), state in states.items():
+        row = CategoryStats(user_id=u, category=category)
+        _write(row, state)
+        session.add(row)
+    session.commit()
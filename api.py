@@ -0,0 +1,358 @@
+# api.py
+"""
+Headless HTTP API over Crew, for other services and the mobile client.
+
+  GET  /health
+  GET  /metrics                              Prometheus text (metrics.py)
+  GET  /v1/tasks                             actions with their agent and JSON schema (tasks.TASK_SCHEMAS)
+  POST /v1/users                             {"name"} -> {"id", ...}, created if missing
+  POST /v1/users/<id>/tasks/<action>         body: the action's kickoff inputs -> Crew.kickoff
+  POST /v1/users/<id>/batch                  {"requests": [{"action", ...}, ...]} run concurrently,
+                                             or {"workflow": [...steps]} -> Crew.run_workflow
+  GET  /v1/users/<id>/reports/<action>       read-only reports; query args are the inputs.
+                                             Sends an ETag; If-None-Match answers 304 without
+                                             running the report.
+
+Agent work is blocking (SQLAlchemy, pandas, downloads), so it runs on a bounded thread
+pool of API_THREADS per process; beyond API_MAX_PENDING queued calls requests get 503
+with Retry-After instead of piling up. API_PROCESSES > 1 forks workers sharing one
+listening socket; each opens its own connections after the fork.
+Run: python api.py [--port N] [--processes N]
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import jsonschema
+import tornado.httpserver
+import tornado.netutil
+import tornado.process
+import tornado.web
+from crew import Crew, ACTION_AGENTS
+from memory import User, get_session_factory, get_or_create_user, session_scope
+import metrics
+import snapshots
+import tasks
+from utils import (API_HOST, API_PORT, API_PROCESSES, API_THREADS, API_MAX_PENDING, API_MAX_BATCH, API_TOKEN,
+                   GOAL_ANNUAL_RETURN)
+
+# import_transactions reads a path on the server's disk; it stays a local (Streamlit/CLI) action
+API_ACTIONS = {a: agent for a, agent in ACTION_AGENTS.items() if a != tasks.IMPORT_TRANSACTIONS}
+# side-effect free actions served by GET with ETags; their inputs are covered by the ETag key
+REPORT_ACTIONS = {tasks.MONTHLY_SUMMARY, tasks.EXPENSE_REPORT, tasks.MONTHLY_SAVINGS, tasks.GOAL_PROGRESS,
+                  tasks.FLAGGED_TRANSACTIONS, tasks.SPENDING_TRENDS}
+RETRY_AFTER = 1  # seconds suggested to clients turned away with 503
+
+_validators = {action: jsonschema.Draft202012Validator(schema) for action, schema in tasks.TASK_SCHEMAS.items()}
+
+
+def validate(action, inputs):
+    """Error messages for inputs against the action's schema; empty when valid."""
+    if action not in API_ACTIONS:
+        return [f"Unknown action {action}"]
+    if not isinstance(inputs, dict):
+        return ["Request body must be a JSON object"]
+    return [f"{'/'.join(map(str, e.path)) or 'body'}: {e.message}" for e in _validators[action].iter_errors(inputs)]
+
+
+def coerce_query(action, args):
+    """Query-string values typed by the action's schema (?limit=5 -> 5, ?tickers=A,B -> ["A", "B"])."""
+    properties = tasks.TASK_SCHEMAS.get(action, {}).get("properties", {})
+    inputs = {}
+    for key, values in args.items():
+        value = values[-1].decode()
+        kind = properties.get(key, {}).get("type")
+        try:
+            if kind == "integer":
+                value = int(value)
+            elif kind == "number":
+                value = float(value)
+            elif kind == "boolean":
+                value = value.lower() in ("1", "true", "yes")
+            elif kind in ("array", "object"):
+                value = json.loads(value) if value[:1] in "[{" else [v for v in value.split(",") if v]
+        except ValueError:
+            pass  # left as a string, so validation reports it
+        inputs[key] = value
+    return inputs
+
+
+def _default(value):
+    # pandas/numpy values can only exist once an agent has imported them; looked up, not imported,
+    # so workers start without them
+    pd, np = sys.modules.get("pandas"), sys.modules.get("numpy")
+    if pd is not None and isinstance(value, pd.DataFrame):
+        return {"columns": [str(c) for c in value.columns], "index": [_default(i) for i in value.index],
+                "data": value.to_numpy().tolist()}
+    if pd is not None and isinstance(value, pd.Series):
+        return {str(_default(k)): v for k, v in value.items()}
+    if isinstance(value, (datetime.date, datetime.datetime)):  # includes pd.Timestamp
+        return value.isoformat()
+    if np is not None and isinstance(value, np.generic):
+        return value.item()
+    if np is not None and isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, str):
+        return value
+    return str(value)
+
+
+def _finite(value):
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {k: _finite(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_finite(v) for v in value]
+    return value
+
+
+def to_json(value):
+    """Strict JSON: NaN and infinities (a gap in a statistic) are sent as null, never as bare NaN."""
+    try:
+        return json.dumps(value, default=_default, allow_nan=False)
+    except ValueError:
+        return json.dumps(_finite(json.loads(json.dumps(value, default=_default))), allow_nan=False)
+
+
+def _reject_constant(name):
+    raise ValueError(f"{name} is not a JSON number")
+
+
+def _status(res):
+    """HTTP status for a Crew result dict."""
+    error = res.get("error")
+    if error is None:
+        return 200
+    if str(error).startswith("Unknown user"):
+        return 404
+    return 422
+
+
+def report_etag(factory, user_id, action, inputs):
+    """
+    Validator for a report: changes whenever an expense is written (data_version), the income or
+    goals change, the month rolls over or the inputs differ. None for an unknown user.
+    """
+    with session_scope(factory) as session:
+        user = session.get(User, user_id)
+        if user is None:
+            return None
+        key = snapshots.inputs_key(user, snapshots.GOAL_PROGRESS, GOAL_ANNUAL_RETURN)
+    digest = hashlib.sha1(json.dumps([action, inputs, key], sort_keys=True, default=str).encode()).hexdigest()
+    return f'W/"{digest[:32]}"'
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, state):
+        self.state = state
+
+    def prepare(self):
+        if API_TOKEN and self.request.headers.get("Authorization") != f"Bearer {API_TOKEN}":
+            raise tornado.web.HTTPError(401)
+
+    def send_json(self, body, status=200):
+        self.set_status(status)
+        self.set_header("Content-Type", "application/json")
+        self.finish(to_json(body))
+
+    def write_error(self, status_code, **kwargs):
+        if status_code == 503:
+            self.set_header("Retry-After", str(RETRY_AFTER))
+        self.finish(to_json({"error": self._reason}))
+
+    def body(self):
+        """The request's JSON object; 400 for invalid JSON, NaN/Infinity or a body that is not an object."""
+        try:
+            body = json.loads(self.request.body or b"{}", parse_constant=_reject_constant)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason="Request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Request body must be a JSON object")
+        return body
+
+    def crew(self, user_id):
+        return Crew(user=int(user_id), session_factory=self.state["factory"])
+
+    async def call(self, fn, *args, slots=1):
+        """Run blocking fn on the bounded pool; 503 when the queue is already full."""
+        if self.state["pending"] + slots > API_MAX_PENDING:
+            metrics.inc("api_rejected_total")
+            raise tornado.web.HTTPError(503, reason="Server busy")
+        self.state["pending"] += slots
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.state["executor"], fn, *args)
+        finally:
+            self.state["pending"] -= slots
+
+    def on_finish(self):
+        route = type(self).__name__
+        metrics.inc("api_requests_total", route=route, status=self.get_status())
+        metrics.observe("api_request_seconds", self.request.request_time(), route=route)
+
+
+class HealthHandler(BaseHandler):
+    def prepare(self):
+        pass  # load balancers probe without a token
+
+    def get(self):
+        self.send_json({"status": "ok", "pending": self.state["pending"]})
+
+
+class MetricsHandler(BaseHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(metrics.to_prometheus())
+
+
+class TasksHandler(BaseHandler):
+    def get(self):
+        self.send_json({action: {"agent": agent, "schema": tasks.TASK_SCHEMAS[action],
+                                 "report": action in REPORT_ACTIONS} for action, agent in API_ACTIONS.items()})
+
+
+class UsersHandler(BaseHandler):
+    async def post(self):
+        name = self.body().get("name")
+        if not isinstance(name, str) or not name.strip():
+            raise tornado.web.HTTPError(400, reason="name is required")
+
+        def create():
+            with session_scope(self.state["factory"]) as session:
+                user = get_or_create_user(session, name=name.strip())
+                return {"id": user.id, "name": user.name, "income": user.income,
+                        "risk_tolerance": user.risk_tolerance}
+        self.send_json(await self.call(create))
+
+
+class TaskHandler(BaseHandler):
+    async def post(self, user_id, action):
+        inputs = self.body()
+        errors = validate(action, inputs)
+        if errors:
+            self.send_json({"error": "Invalid request", "details": errors}, 404 if action not in API_ACTIONS else 400)
+            return
+        res = await self.call(self.crew(user_id).kickoff, dict(inputs, action=action))
+        self.send_json(res, _status(res))
+
+
+class BatchHandler(BaseHandler):
+    async def post(self, user_id):
+        body = self.body()
+        if "workflow" in body:
+            await self.workflow(user_id, body["workflow"])
+            return
+        requests = body.get("requests")
+        if not isinstance(requests, list) or not requests:
+            raise tornado.web.HTTPError(400, reason="requests must be a non-empty list")
+        if len(requests) > API_MAX_BATCH:
+            raise tornado.web.HTTPError(400, reason=f"At most {API_MAX_BATCH} requests per batch")
+        problems = {i: validate(r.get("action") if isinstance(r, dict) else None,
+                                {k: v for k, v in r.items() if k != "action"} if isinstance(r, dict) else r)
+                    for i, r in enumerate(requests)}
+        problems = {i: e for i, e in problems.items() if e}
+        if problems:
+            self.send_json({"error": "Invalid request", "details": problems}, 400)
+            return
+        crew = self.crew(user_id)
+        if self.state["pending"] + len(requests) > API_MAX_PENDING:
+            metrics.inc("api_rejected_total")
+            raise tornado.web.HTTPError(503, reason="Server busy")
+        results = await asyncio.gather(*(self.call(crew.kickoff, r) for r in requests))
+        self.send_json({"results": [dict(r, status=_status(r)) for r in results]})
+
+    async def workflow(self, user_id, steps):
+        if not isinstance(steps, list) or not steps or len(steps) > API_MAX_BATCH:
+            raise tornado.web.HTTPError(400, reason=f"workflow must list 1 to {API_MAX_BATCH} steps")
+        problems = {}
+        for i, step in enumerate(steps):
+            if not isinstance(step, dict):
+                problems[i] = ["Step must be a JSON object"]
+                continue
+            errors = validate(step.get("action"), {k: v for k, v in step.items()
+                                                   if k not in ("action", "id", "depends_on")})
+            if errors:
+                problems[i] = errors
+        if problems:
+            self.send_json({"error": "Invalid request", "details": problems}, 400)
+            return
+        res = await self.call(self.crew(user_id).run_workflow, steps, slots=min(len(steps), API_THREADS))
+        self.send_json(res, 400 if "error" in res else 200)
+
+
+class ReportHandler(BaseHandler):
+    async def get(self, user_id, action):
+        if action not in REPORT_ACTIONS:
+            raise tornado.web.HTTPError(404, reason=f"Unknown report {action}")
+        inputs = coerce_query(action, self.request.query_arguments)
+        errors = validate(action, inputs)
+        if errors:
+            self.send_json({"error": "Invalid request", "details": errors}, 400)
+            return
+        etag = await self.call(report_etag, self.state["factory"], int(user_id), action, inputs)
+        if etag is None:
+            self.send_json({"error": f"Unknown user {user_id}"}, 404)
+            return
+        self.set_header("ETag", etag)
+        self.set_header("Cache-Control", "private, no-cache")
+        if etag in [t.strip() for t in self.request.headers.get("If-None-Match", "").split(",")]:
+            metrics.cache_access("api_report_etag", True)
+            self.set_status(304)
+            self.finish()
+            return
+        metrics.cache_access("api_report_etag", False)
+        res = await self.call(self.crew(user_id).kickoff, dict(inputs, action=action))
+        if "error" in res:
+            self.clear_header("ETag")
+        self.send_json(res, _status(res))
+
+    def compute_etag(self):
+        return None  # set explicitly above, before any work is done
+
+
+def make_app(factory=None, threads=API_THREADS):
+    state = {"factory": factory or get_session_factory(), "pending": 0,
+             "executor": ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api")}
+    routes = [
+        (r"/health", HealthHandler),
+        (r"/metrics", MetricsHandler),
+        (r"/v1/tasks", TasksHandler),
+        (r"/v1/users", UsersHandler),
+        (r"/v1/users/(\d{1,18})/tasks/(\w+)", TaskHandler),
+        (r"/v1/users/(\d{1,18})/batch", BatchHandler),
+        (r"/v1/users/(\d{1,18})/reports/(\w+)", ReportHandler),
+    ]
+    return tornado.web.Application([(path, handler, {"state": state}) for path, handler in routes])
+
+
+async def _serve(sockets):
+    server = tornado.httpserver.HTTPServer(make_app(), xheaders=True)
+    server.add_sockets(sockets)
+    await asyncio.Event().wait()
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    port, processes = API_PORT, API_PROCESSES
+    if "--port" in argv:
+        port = int(argv[argv.index("--port") + 1])
+    if "--processes" in argv:
+        processes = int(argv[argv.index("--processes") + 1])
+    sockets = tornado.netutil.bind_sockets(port, API_HOST)
+    print(f"api listening on {API_HOST}:{port} ({processes or 'one per CPU'} process(es))")
+    if processes != 1:
+        # the schema is created/upgraded once here, not raced by every worker; the pool is emptied
+        # so no connection crosses the fork, and each worker opens its own
+        get_session_factory().kw["bind"].dispose()
+        tornado.process.fork_processes(processes)
+    asyncio.run(_serve(sockets))
+
+
+if __name__ == "__main__":
+    main()
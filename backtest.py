@@ -0,0 +1,198 @@
+# backtest.py
+"""
+Walk-forward backtests of the mean-variance strategies in portfolio.py.
+Every rebalance_every trading days the strategy is re-optimised on the trailing window
+of returns and the book is traded to the new weights (simple_rebalance_suggestion
+style, fractional shares) paying cost_bps on the traded value. Window moments are
+kept as running sums, so moving the window costs O(step x n^2) instead of
+O(window x n^2). Parameter sweeps run in a process pool.
+"""
+
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from portfolio import EfficientFrontier, RISK_PROFILES, TRADING_DAYS
+
+DEFAULT_WINDOW = 252
+DEFAULT_REBALANCE_EVERY = 21
+DEFAULT_COST_BPS = 10.0
+STRATEGIES = ("max_sharpe", "min_variance", "equal_weight") + tuple(RISK_PROFILES)
+# recompute the running sums from scratch this often to stop floating point drift
+REANCHOR_EVERY = 50
+
+
+class RollingMoments:
+    """Mean and covariance of a sliding window of return rows, updated by adding and dropping rows."""
+
+    def __init__(self, n_assets):
+        self.count = 0
+        self.s1 = np.zeros(n_assets)
+        self.s2 = np.zeros((n_assets, n_assets))
+
+    def reset(self, rows):
+        self.count = len(rows)
+        self.s1 = rows.sum(axis=0)
+        self.s2 = rows.T @ rows
+
+    def shift(self, new_rows, old_rows):
+        """Slide the window: add new_rows and drop old_rows with a single rank-k update."""
+        rows = np.vstack([new_rows, old_rows])
+        signs = np.repeat([1.0, -1.0], [len(new_rows), len(old_rows)])
+        self.count += len(new_rows) - len(old_rows)
+        self.s1 += signs @ rows
+        self.s2 += rows.T @ (rows * signs[:, None])
+
+    def mean(self):
+        return self.s1 / self.count
+
+    def cov(self):
+        m = self.mean()
+        cov = self.s2 - self.count * np.outer(m, m)
+        cov /= self.count - 1
+        return cov
+
+
+def target_weights(strategy, mean_returns, cov_matrix, risk_free_rate=0.02):
+    """Weights (ndarray) for one rebalance from annualised moments."""
+    n = len(mean_returns)
+    if strategy == "equal_weight":
+        return np.full(n, 1.0 / n)
+    frontier = EfficientFrontier(pd.Series(mean_returns), cov_matrix, risk_free_rate)
+    if strategy == "max_sharpe":
+        return frontier.max_sharpe().values
+    if strategy == "min_variance":
+        return frontier.min_variance().values
+    if strategy in RISK_PROFILES:
+        return frontier.for_risk_tolerance(strategy).values
+    raise ValueError(f"Unknown strategy {strategy}")
+
+
+def _trade(shares, cash, prices, weights, cost_rate):
+    """Trade the book (shares + cash) to weights, fully invested; costs come out of the book."""
+    value = cash + shares @ prices
+    net = value
+    for _ in range(3):
+        # the cost depends on the trade size, which depends on what is left after the cost
+        traded = np.abs(weights * net - shares * prices).sum()
+        net = value - cost_rate * traded
+    return weights * net / prices, traded, value - net, value
+
+
+def performance_stats(equity, risk_free_rate=0.02):
+    returns = equity.pct_change().dropna()
+    years = len(returns) / TRADING_DAYS
+    total = equity.iloc[-1] / equity.iloc[0] - 1
+    vol = returns.std() * np.sqrt(TRADING_DAYS)
+    cagr = (1 + total) ** (1 / years) - 1 if years > 0 else 0.0
+    drawdown = 1 - equity / equity.cummax()
+    return {
+        "total_return": float(total),
+        "cagr": float(cagr),
+        "volatility": float(vol),
+        "sharpe": float((cagr - risk_free_rate) / vol) if vol > 0 else None,
+        "max_drawdown": float(drawdown.max()),
+    }
+
+
+def backtest(price_df, strategy="max_sharpe", window=DEFAULT_WINDOW, rebalance_every=DEFAULT_REBALANCE_EVERY,
+             cost_bps=DEFAULT_COST_BPS, initial_value=10_000.0, risk_free_rate=0.02, incremental=True):
+    """
+    Walk forward over price_df (dates x tickers, no gaps). Returns a dict with the daily
+    equity curve, the weights and turnover at each rebalance, costs paid and summary stats.
+    incremental=False recomputes each window's covariance from scratch (for comparison).
+    """
+    prices = price_df.values.astype(float)
+    returns = prices[1:] / prices[:-1] - 1
+    n_days, n_assets = prices.shape
+    if n_days <= window + 1:
+        raise ValueError(f"Need more than {window + 1} days of prices for a {window}-day window")
+    cost_rate = cost_bps / 1e4
+
+    moments = RollingMoments(n_assets)
+    shares = np.zeros(n_assets)
+    cash = initial_value
+    equity = np.empty(n_days - window)
+    rebalances, weight_rows, turnover, costs = [], [], [], []
+    lo = 0  # returns[lo:lo + window] is the window of the previous rebalance
+    for step, day in enumerate(range(window, n_days)):
+        if step % rebalance_every == 0:
+            hi = day  # returns through today's close
+            if not incremental:
+                window_returns = returns[hi - window:hi]
+                mean, cov = window_returns.mean(axis=0), np.cov(window_returns, rowvar=False)
+            else:
+                if moments.count == 0 or rebalance_every >= window or len(rebalances) % REANCHOR_EVERY == 0:
+                    moments.reset(returns[hi - window:hi])
+                else:
+                    moments.shift(returns[lo + window:hi], returns[lo:hi - window])
+                mean, cov = moments.mean(), moments.cov()
+            lo = hi - window
+            weights = target_weights(strategy, mean * TRADING_DAYS, cov * TRADING_DAYS, risk_free_rate)
+            shares, traded, cost, value = _trade(shares, cash, prices[day], weights, cost_rate)
+            cash = 0.0
+            rebalances.append(price_df.index[day])
+            weight_rows.append(weights)
+            turnover.append(traded / value if value else 0.0)
+            costs.append(cost)
+        equity[step] = cash + shares @ prices[day]
+
+    equity = pd.Series(equity, index=price_df.index[window:], name="equity")
+    stats = performance_stats(equity, risk_free_rate)
+    stats.update({
+        "rebalances": len(rebalances),
+        "avg_turnover": float(np.mean(turnover[1:])) if len(turnover) > 1 else 0.0,
+        "total_costs": float(np.sum(costs)),
+    })
+    return {
+        "equity": equity,
+        "weights": pd.DataFrame(weight_rows, index=pd.Index(rebalances, name="date"), columns=price_df.columns),
+        "turnover": pd.Series(turnover, index=rebalances, name="turnover"),
+        "costs": pd.Series(costs, index=rebalances, name="costs"),
+        "stats": stats,
+    }
+
+
+_sweep_prices = None
+
+
+def _init_sweep(price_df):
+    global _sweep_prices
+    _sweep_prices = price_df
+
+
+def _run_sweep_case(params):
+    started = time.perf_counter()
+    try:
+        stats = backtest(_sweep_prices, **params)["stats"]
+    except Exception as e:
+        stats = {"error": str(e)}
+    return dict(params, **stats, seconds=time.perf_counter() - started)
+
+
+def expand_grid(grid):
+    """{"window": [126, 252], "strategy": [...]} -> list of parameter dicts (lists pass through)."""
+    if isinstance(grid, dict):
+        keys = list(grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+    return list(grid)
+
+
+def sweep(price_df, grid, workers=None):
+    """
+    Backtest every parameter combination in grid; one row of params + stats per case,
+    best Sharpe first. Cases are independent, so workers > 1 runs them in a process
+    pool (the price frame is sent to each worker once).
+    """
+    cases = expand_grid(grid)
+    if workers and workers > 1 and len(cases) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep, initargs=(price_df,)) as pool:
+            rows = list(pool.map(_run_sweep_case, cases))
+    else:
+        _init_sweep(price_df)
+        rows = [_run_sweep_case(case) for case in cases]
+    table = pd.DataFrame(rows)
+    if "sharpe" in table:
+        table = table.sort_values("sharpe", ascending=False, na_position="last").reset_index(drop=True)
+    return table
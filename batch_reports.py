@@ -0,0 +1,161 @@
+# batch_reports.py
+"""
+This month's expense report, savings and goal feasibility for every user in one pass,
+instead of an ExpenseAgent and a GoalAgent per user.
+Users are streamed in id-ordered chunks. Each chunk is one grouped query for the month's
+category totals (the rollup, or a GROUP BY over transactions) into a DataFrame; totals and
+savings are column operations and every goal of every user in the chunk is projected in
+one NumPy pass (goals.project_many).
+Results are written as ReportSnapshot rows under the same inputs keys the agents check,
+so ExpenseAgent.expense_report and GoalAgent.progress serve them as-is. With only_changed,
+users whose stored keys still match are skipped.
+With workers > 1 the chunks are computed on a process pool; the parent does every write,
+so SQLite keeps a single writer.
+
+Run: python batch_reports.py [--workers N] [--chunk-size N] [--all]
+"""
+
+import datetime
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from sqlalchemy import select, func
+from memory import User, Transaction, MonthlyCategoryTotal, get_session_factory, session_scope, month_key
+from goals import project_many
+import snapshots
+import metrics
+from utils import USE_MONTH_ROLLUP, GOAL_ANNUAL_RETURN, BATCH_REPORT_CHUNK_SIZE, BATCH_REPORT_WORKERS
+
+
+def _month_totals(session, lo, hi, now, use_rollup):
+    """(user_id, category, total) of users lo..hi for now's month, one grouped query."""
+    if use_rollup:
+        query = (select(MonthlyCategoryTotal.user_id, MonthlyCategoryTotal.category, MonthlyCategoryTotal.total)
+                 .where(MonthlyCategoryTotal.user_id.between(lo, hi),
+                        MonthlyCategoryTotal.month == month_key(now)))
+    else:
+        query = (select(Transaction.user_id, Transaction.category, func.sum(Transaction.amount))
+                 .where(Transaction.user_id.between(lo, hi),
+                        Transaction.timestamp >= datetime.datetime(now.year, now.month, 1))
+                 .group_by(Transaction.user_id, Transaction.category))
+    return pd.DataFrame(session.execute(query).all(), columns=["user_id", "category", "total"])
+
+
+def compute_chunk(session, lo, hi, now=None, annual_return=None, use_rollup=USE_MONTH_ROLLUP,
+                  only_changed=False):
+    """(user_id, kind, inputs key, payload) snapshot rows for users with ids lo..hi, plus the number skipped."""
+    now = now or datetime.datetime.utcnow()
+    if annual_return is None:
+        annual_return = GOAL_ANNUAL_RETURN
+    users = session.execute(select(User.id, User.income, User.goals, User.data_version)
+                            .where(User.id.between(lo, hi)).order_by(User.id)).all()
+    if not users:
+        return [], 0
+    expense_keys = [snapshots.inputs_key(u, snapshots.EXPENSE_REPORT, now=now) for u in users]
+    goal_keys = [snapshots.inputs_key(u, snapshots.GOAL_PROGRESS, annual_return, now) for u in users]
+    skipped = 0
+    if only_changed:
+        stored = snapshots.keys(session, [u.id for u in users])
+        keep = [i for i, u in enumerate(users)
+                if stored.get((u.id, snapshots.EXPENSE_REPORT)) != expense_keys[i]
+                or stored.get((u.id, snapshots.GOAL_PROGRESS)) != goal_keys[i]]
+        skipped = len(users) - len(keep)
+        users = [users[i] for i in keep]
+        expense_keys = [expense_keys[i] for i in keep]
+        goal_keys = [goal_keys[i] for i in keep]
+        if not users:
+            return [], skipped
+
+    ids = np.array([u.id for u in users])
+    totals = _month_totals(session, lo, hi, now, use_rollup)
+    totals = totals[totals["user_id"].isin(ids)]
+    summaries = {u.id: {} for u in users}
+    for user_id, category, total in totals.itertuples(index=False):
+        summaries[user_id][category] = total
+    spent = totals.groupby("user_id")["total"].sum().reindex(ids, fill_value=0.0).to_numpy()
+    income = np.array([u.income or 0.0 for u in users], dtype=float)
+    savings = np.maximum(income - spent, 0.0)
+
+    user_goals = [json.loads(u.goals or "[]") if isinstance(u.goals, str) else u.goals or [] for u in users]
+    progress = project_many(user_goals, savings.tolist(), [summaries[u.id] for u in users], annual_return, now)
+
+    rows = []
+    for i, u in enumerate(users):
+        report = {"categories": summaries[u.id], "total_expense": float(spent[i]),
+                  "monthly_savings": float(savings[i])}
+        rows.append((u.id, snapshots.EXPENSE_REPORT, expense_keys[i], report))
+        rows.append((u.id, snapshots.GOAL_PROGRESS, goal_keys[i], progress[i]))
+    return rows, skipped
+
+
+def _init_worker(db_uri):
+    # a forked worker inherits the parent's pooled connections; drop them without closing the parent's
+    get_session_factory(db_uri).kw["bind"].dispose(close=False)
+
+
+def _compute_job(job):
+    # process pool entry point: each worker opens its own pooled engine on the same database
+    db_uri, lo, hi, now, annual_return, use_rollup, only_changed = job
+    with session_scope(get_session_factory(db_uri)) as session:
+        return compute_chunk(session, lo, hi, now, annual_return, use_rollup, only_changed)
+
+
+def _id_ranges(session, chunk_size):
+    ids = [i for (i,) in session.execute(select(User.id).order_by(User.id))]
+    return [(ids[s], ids[min(s + chunk_size, len(ids)) - 1]) for s in range(0, len(ids), chunk_size)], len(ids)
+
+
+def generate(factory=None, chunk_size=BATCH_REPORT_CHUNK_SIZE, workers=BATCH_REPORT_WORKERS, annual_return=None,
+             use_rollup=USE_MONTH_ROLLUP, only_changed=False, now=None):
+    """
+    Compute and store every user's expense report and goal progress snapshots.
+    Returns {"users", "written", "skipped", "seconds", "users_per_second"}.
+    """
+    factory = factory or get_session_factory()
+    now = now or datetime.datetime.utcnow()
+    if annual_return is None:
+        annual_return = GOAL_ANNUAL_RETURN
+    started = time.perf_counter()
+    with session_scope(factory) as session:
+        ranges, n_users = _id_ranges(session, chunk_size)
+
+    written = skipped = 0
+
+    def write(rows, n_skipped):
+        nonlocal written, skipped
+        with session_scope(factory) as session:
+            snapshots.store_many(session, rows)
+        written += len(rows) // 2
+        skipped += n_skipped
+
+    with metrics.timer("batch_reports_seconds"):
+        if workers and workers > 1 and len(ranges) > 1:
+            db_uri = factory.kw["bind"].url.render_as_string(hide_password=False)
+            jobs = [(db_uri, lo, hi, now, annual_return, use_rollup, only_changed) for lo, hi in ranges]
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db_uri,)) as pool:
+                for rows, n_skipped in pool.map(_compute_job, jobs):
+                    write(rows, n_skipped)
+        else:
+            for lo, hi in ranges:
+                with session_scope(factory) as session:
+                    rows, n_skipped = compute_chunk(session, lo, hi, now, annual_return, use_rollup, only_changed)
+                write(rows, n_skipped)
+
+    seconds = time.perf_counter() - started
+    metrics.inc("batch_reports_users_total", written)
+    return {"users": n_users, "written": written, "skipped": skipped, "seconds": round(seconds, 3),
+            "users_per_second": round(n_users / seconds, 1) if seconds else None}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+
+    def option(name, default):
+        return int(args[args.index(name) + 1]) if name in args else default
+
+    print(json.dumps(generate(chunk_size=option("--chunk-size", BATCH_REPORT_CHUNK_SIZE),
+                              workers=option("--workers", BATCH_REPORT_WORKERS),
+                              only_changed="--all" not in args), indent=2))
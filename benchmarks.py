@@ -0,0 +1,1233 @@
+# benchmarks.py
+"""
+Offline benchmarks. Nothing here touches the network: market data comes from
+local stand-ins that are swapped into data_fetchers, or from a fixture directory
+(see fixtures.py) for the scenario benchmarks.
+Run: python benchmarks.py [name ...] [--fixtures DIR] [--save results.json] [--compare baseline.json]
+"""
+
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+import data_fetchers
+import price_store
+import fixtures
+from fixtures import SyntheticPriceSource, synthetic_prices, synthetic_response
+
+
+class StubMarketServer:
+    """
+    Local stand-in for CoinGecko and NewsAPI on 127.0.0.1 (HTTP/1.1 keep-alive).
+    Point COINGECKO_API_URL at f"{url}/api/v3" and NEWSAPI_URL at f"{url}/v2".
+    """
+
+    def __init__(self, latency=0.0):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import urlsplit, parse_qs
+
+        stub = self
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests += 1
+                time.sleep(stub.latency)
+                parts = urlsplit(self.path)
+                query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+                body = synthetic_response(parts.path, query)
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _timeit(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_price_fetch(n_tickers=30, latency=0.05):
+    tickers = [f"T{i:03d}" for i in range(n_tickers)]
+    source = SyntheticPriceSource(latency=latency)
+    previous = data_fetchers.set_price_source(source)
+    previous_store = price_store.set_price_store(None)
+    try:
+        serial = _timeit(lambda: [data_fetchers.fetch_stock_history(t) for t in tickers], repeat=1)
+        bulk = _timeit(lambda: data_fetchers.fetch_stock_histories(tickers))
+
+        # a source without a bulk endpoint falls back to the bounded thread pool
+        data_fetchers.set_price_source(_HistoryOnly(source))
+        pooled = _timeit(lambda: data_fetchers.fetch_stock_histories(tickers))
+    finally:
+        data_fetchers.set_price_source(previous)
+        price_store.set_price_store(previous_store)
+
+    print(f"price_fetch tickers={n_tickers} latency={latency * 1000:.0f}ms "
+          f"serial={serial:.3f}s bulk={bulk:.3f}s thread_pool={pooled:.3f}s")
+    return {"serial": serial, "bulk": bulk, "thread_pool": pooled}
+
+
+class _HistoryOnly:
+    def __init__(self, source):
+        self.source = source
+
+    def history(self, ticker, period="1y", interval="1d", start=None):
+        return self.source.history(ticker, period=period, interval=interval, start=start)
+
+
+def bench_price_store(n_tickers=30, latency=0.05):
+    tickers = [f"T{i:03d}" for i in range(n_tickers)]
+    source = SyntheticPriceSource(latency=latency)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = price_store.PriceStore(os.path.join(tmp, "prices.db"))
+        previous = data_fetchers.set_price_source(source)
+        previous_store = price_store.set_price_store(store)
+        try:
+            cold = _timeit(lambda: data_fetchers.fetch_stock_histories(tickers), repeat=1)
+            bars_cold = source.bars
+            warm = _timeit(lambda: data_fetchers.fetch_stock_histories(tickers))
+            store.ttl, store.market_hours = -1, False  # everything stale: only the newest bars are asked for
+            incremental = _timeit(lambda: data_fetchers.fetch_stock_histories(tickers), repeat=1)
+            bars_incremental = source.bars - bars_cold
+        finally:
+            data_fetchers.set_price_source(previous)
+            price_store.set_price_store(previous_store)
+            store.conn.close()
+
+    print(f"price_store tickers={n_tickers} cold={cold:.3f}s ({bars_cold} bars) warm={warm:.3f}s "
+          f"incremental={incremental:.3f}s ({bars_incremental} bars)")
+    return {"cold": cold, "warm": warm, "incremental": incremental}
+
+
+def bench_expense_report(n_transactions=1_000_000, n_categories=12):
+    from sqlalchemy import insert
+    from memory import init_db, get_or_create_user, Transaction, rebuild_month_rollup
+    from agents import ExpenseAgent
+
+    session = init_db("sqlite://")
+    user = get_or_create_user(session)
+    start = datetime.datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    rng = np.random.default_rng(0)
+    seconds = rng.integers(0, 27 * 86400, n_transactions)
+    amounts = rng.gamma(2.0, 20.0, n_transactions)
+    categories = [f"Category {i}" for i in range(n_categories)]
+    chunk = 100_000
+    for lo in range(0, n_transactions, chunk):
+        session.execute(insert(Transaction), [
+            {"user_id": user.id, "category": categories[i % n_categories], "amount": float(amounts[i]),
+             "timestamp": start + datetime.timedelta(seconds=int(seconds[i]))}
+            for i in range(lo, min(lo + chunk, n_transactions))])
+    session.commit()
+    rebuild_month_rollup(session)
+
+    def orm_loop():
+        # the original implementation: load every row and sum in Python
+        cats = {}
+        for t in session.query(Transaction).filter(Transaction.user_id == user.id,
+                                                   Transaction.timestamp >= start).all():
+            cats[t.category] = cats.get(t.category, 0) + t.amount
+        session.expunge_all()
+        return cats
+
+    group_by = _timeit(lambda: ExpenseAgent(session, user, use_rollup=False).expense_report())
+    rollup = _timeit(lambda: ExpenseAgent(session, user, use_rollup=True).expense_report())
+    orm = _timeit(orm_loop, repeat=1)
+    session.close()
+
+    print(f"expense_report transactions={n_transactions} orm_loop={orm:.3f}s "
+          f"group_by={group_by:.3f}s rollup={rollup * 1000:.2f}ms")
+    return {"orm_loop": orm, "group_by": group_by, "rollup": rollup}
+
+
+def write_statement_csv(path, n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    start = datetime.date.today() - datetime.timedelta(days=365)
+    merchants = ["Big Bazaar", "Uber", "Swiggy", "Amazon", "Electricity Board", "Starbucks", "Shell"]
+    categories = ["groceries", "Transport", "food ", "Shopping", "Utilities", "Food", "transport"]
+    with open(path, "w", newline="") as f:
+        f.write("Date,Description,Amount,Category\n")
+        for i in range(n_rows):
+            m = i % len(merchants)
+            day = start + datetime.timedelta(days=int(rng.integers(0, 365)))
+            f.write(f"{day.isoformat()},{merchants[m]} #{i},{rng.gamma(2.0, 20.0):.2f},{categories[m]}\n")
+
+
+def bench_import(sizes=(50_000, 200_000)):
+    import tracemalloc
+    from memory import init_db, get_or_create_user
+    from importer import import_transactions
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in sizes:
+            path = os.path.join(tmp, f"statement_{n}.csv")
+            write_statement_csv(path, n)
+
+            session = init_db("sqlite:///" + os.path.join(tmp, f"import_{n}.db"))
+            user = get_or_create_user(session)
+            report = import_transactions(session, user, path)
+            again = import_transactions(session, user, path)
+            session.close()
+
+            # separate run under tracemalloc (which slows it down) to show memory stays flat
+            session = init_db("sqlite:///" + os.path.join(tmp, f"import_{n}_traced.db"))
+            tracemalloc.start()
+            import_transactions(session, get_or_create_user(session), path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            session.close()
+
+            print(f"import rows={n} {report['rows_per_second']:.0f} rows/s peak_mem={peak / 2 ** 20:.1f}MiB "
+                  f"reimport duplicates={again['duplicates']}")
+            results[n] = {"rows_per_second": report["rows_per_second"], "peak_bytes": peak}
+    return results
+
+
+def _legacy_max_sharpe(price_df, risk_free_rate=0.02):
+    # the pre-frontier implementation: SLSQP with numerical gradients over closures
+    from scipy.optimize import minimize
+    returns = price_df.pct_change().dropna()
+    mean_returns = returns.mean() * 252
+    cov_matrix = returns.cov() * 252
+    n = len(mean_returns)
+
+    def neg_sharpe(w):
+        return -(np.dot(w, mean_returns) - risk_free_rate) / np.sqrt(np.dot(w.T, np.dot(cov_matrix, w)))
+
+    return minimize(neg_sharpe, np.full(n, 1.0 / n), method="SLSQP", bounds=tuple((0, 1) for _ in range(n)),
+                    constraints=({"type": "eq", "fun": lambda x: np.sum(x) - 1},))
+
+
+def bench_frontier(sizes=(10, 100, 500), n_points=20, legacy_max_assets=100):
+    from scipy.optimize import minimize  # noqa: F401  (keep scipy's import time out of the legacy timing)
+    from portfolio import EfficientFrontier
+
+    results = {}
+    for n in sizes:
+        prices = synthetic_prices(n)
+        row = {}
+        if n <= legacy_max_assets:
+            row["legacy_max_sharpe"] = _timeit(lambda: _legacy_max_sharpe(prices), repeat=1)
+        ef = EfficientFrontier.from_prices(prices)
+        row["max_sharpe"] = _timeit(lambda: EfficientFrontier.from_prices(prices).max_sharpe(), repeat=1)
+        # once the critical line has been walked, every query is closed form on its segments
+        row["frontier_and_profiles"] = _timeit(
+            lambda: (ef.frontier(n_points), [ef.for_risk_tolerance(r) for r in ("low", "medium", "high")]))
+        row["max_sharpe_shrunk"] = _timeit(
+            lambda: EfficientFrontier.from_prices(prices, shrinkage=True).max_sharpe(), repeat=1)
+        row["closed_form"] = _timeit(
+            lambda: EfficientFrontier.from_prices(prices, long_only=False).frontier(n_points))
+        results[n] = row
+        print(f"frontier assets={n} " + " ".join(f"{k}={v:.3f}s" for k, v in row.items()))
+    return results
+
+
+def bench_http(n_coins=50, latency=0.005):
+    import requests
+    import http_client
+
+    coins = [f"coin-{i}" for i in range(n_coins)]
+    with StubMarketServer(latency=latency) as stub:
+        base = f"{stub.url}/api/v3"
+        previous_url, data_fetchers.COINGECKO_API_URL = data_fetchers.COINGECKO_API_URL, base
+        client = http_client.HttpClient(rate_limits={})
+        previous_client = http_client.set_http_client(client)
+        try:
+            stub.connections = 0
+            bare = _timeit(lambda: [requests.get(f"{base}/simple/price?ids={c}&vs_currencies=usd").json()
+                                    for c in coins], repeat=1)
+            bare_connections = stub.connections
+
+            stub.connections = 0
+            pooled = _timeit(lambda: [data_fetchers.fetch_crypto_price(c) for c in coins], repeat=1)
+            pooled_connections = stub.connections
+
+            batched = _timeit(lambda: data_fetchers.fetch_crypto_prices(coins))
+            assert len(data_fetchers.fetch_crypto_prices(coins)) == n_coins
+        finally:
+            data_fetchers.COINGECKO_API_URL = previous_url
+            http_client.set_http_client(previous_client)
+            client.close()
+
+    print(f"http coins={n_coins} bare_requests={bare:.3f}s ({bare_connections} connections) "
+          f"pooled={pooled:.3f}s ({pooled_connections} connections) batched={batched * 1000:.1f}ms")
+    return {"bare": bare, "pooled": pooled, "batched": batched}
+
+
+def bench_workflow(latency=0.1, n_transactions=20_000):
+    """Dashboard fan-out: one kickoff per step in sequence vs Crew.run_workflow."""
+    import http_client
+    import tasks
+    from crew import Crew
+    from memory import get_session_factory, session_scope, get_or_create_user, rebuild_month_rollup, Transaction
+
+    with tempfile.TemporaryDirectory() as tmp, StubMarketServer(latency=latency) as stub:
+        factory = get_session_factory("sqlite:///" + os.path.join(tmp, "workflow.db"))
+        rng = np.random.default_rng(0)
+        now = datetime.datetime.utcnow()
+        with session_scope(factory) as session:
+            user = get_or_create_user(session, "bench")
+            user.income = 50_000.0
+            user.goals = '[{"name": "Car", "target": 500000, "deadline": "2030-01-01"}]'
+            session.flush()
+            session.execute(Transaction.__table__.insert(), [
+                {"user_id": user.id, "category": f"cat{i % 12}", "amount": float(a), "timestamp": now}
+                for i, a in enumerate(rng.uniform(1, 100, n_transactions))])
+            rebuild_month_rollup(session)
+
+        previous = data_fetchers.set_price_source(SyntheticPriceSource(latency=latency))
+        previous_store = price_store.set_price_store(None)
+        previous_news = data_fetchers.NEWSAPI_URL, data_fetchers.NEWSAPI_KEY
+        data_fetchers.NEWSAPI_URL, data_fetchers.NEWSAPI_KEY = f"{stub.url}/v2", "bench"
+        client = http_client.HttpClient(rate_limits={})
+        previous_client = http_client.set_http_client(client)
+        try:
+            crew = Crew(user=user.id, session_factory=factory)
+            steps = [{k: v for k, v in step.items() if k != "depends_on"} for step in tasks.DASHBOARD_WORKFLOW]
+            sequential = _timeit(lambda: [crew.kickoff(step) for step in steps], repeat=1)
+            out = crew.run_workflow(tasks.DASHBOARD_WORKFLOW)
+            assert not out["errors"], out["errors"]
+            parallel = _timeit(lambda: crew.run_workflow(tasks.DASHBOARD_WORKFLOW), repeat=1)
+        finally:
+            data_fetchers.set_price_source(previous)
+            price_store.set_price_store(previous_store)
+            data_fetchers.NEWSAPI_URL, data_fetchers.NEWSAPI_KEY = previous_news
+            http_client.set_http_client(previous_client)
+            client.close()
+
+    slowest = max(out["timings"], key=out["timings"].get)
+    print(f"workflow steps={len(steps)} latency={latency * 1000:.0f}ms sequential={sequential:.3f}s "
+          f"run_workflow={parallel:.3f}s (slowest step {slowest} {out['timings'][slowest]:.3f}s)")
+    return {"sequential": sequential, "workflow": parallel}
+
+
+def bench_goals(n_goals=200, repeat=200):
+    """GoalAgent.progress: projection from scratch vs a memoised repeat render."""
+    import json
+    import goals
+    from agents import GoalAgent
+    from memory import init_db, get_or_create_user
+
+    session = init_db("sqlite://")
+    user = get_or_create_user(session, "goals-bench")
+    user.income = 80_000.0
+    rng = np.random.default_rng(0)
+    today = datetime.date.today()
+    user.goals = json.dumps([{"name": f"goal{i}", "target": float(t),
+                              "deadline": str(today + datetime.timedelta(days=int(d)))}
+                             for i, (t, d) in enumerate(zip(rng.uniform(1e4, 1e6, n_goals),
+                                                            rng.integers(-30, 3650, n_goals)))])
+    session.commit()
+    agent = GoalAgent(session, user)
+    summary = {f"cat{i}": float(a) for i, a in enumerate(rng.uniform(1000, 5000, 12))}
+
+    def cold():
+        goals.clear_cache()
+        goals.deadline_month.cache_clear()
+        agent.progress(summary)
+
+    cold_s = _timeit(cold, repeat=5)
+    agent.progress(summary)
+    warm_s = _timeit(lambda: [agent.progress(summary) for _ in range(repeat)], repeat=1) / repeat
+    print(f"goals n={n_goals} cold={cold_s * 1000:.2f}ms cached={warm_s * 1e6:.0f}us {goals.cache_info()}")
+    return {"cold": cold_s, "cached": warm_s}
+
+
+def bench_risk(n_paths=100_000, n_assets=10, workers=(1, 4)):
+    """Paths per second for both simulation methods, in-process and on a process pool."""
+    import risk
+
+    prices = synthetic_prices(n_assets)
+    daily = risk.portfolio_returns(prices, {t: 1.0 for t in prices.columns})
+    out = {}
+    for method in risk.METHODS:
+        for w in workers:
+            sim = risk.simulate(daily, n_paths=n_paths, method=method, workers=w)
+            out[(method, w)] = sim.n_paths / sim.seconds
+            print(f"risk {method} workers={w} paths={n_paths} horizons={list(sim.horizons)} "
+                  f"{sim.seconds:.2f}s {out[(method, w)]:,.0f} paths/s "
+                  f"1y VaR95={sim.var('1y'):.3f} CVaR95={sim.cvar('1y'):.3f}")
+    return out
+
+
+def bench_backtest(n_assets=200, n_days=1500, windows=(252, 756), workers=4):
+    """Rolling vs per-window covariance, one full backtest, and a parameter sweep serial vs pooled."""
+    import backtest
+
+    prices = synthetic_prices(n_assets, n_days)
+    returns = prices.pct_change().dropna().values
+    out = {}
+    for window in windows:
+        def rolling():
+            m = backtest.RollingMoments(n_assets)
+            m.reset(returns[:window])
+            for hi in range(window + 1, len(returns)):
+                m.shift(returns[hi - 1:hi], returns[hi - 1 - window:hi - window])
+                m.cov()
+
+        def recompute():
+            for hi in range(window + 1, len(returns)):
+                np.cov(returns[hi - window:hi], rowvar=False)
+
+        out[("rolling", window)] = _timeit(rolling, repeat=1)
+        out[("recompute", window)] = _timeit(recompute, repeat=1)
+        print(f"backtest assets={n_assets} window={window} daily covariance updates: "
+              f"rolling={out[('rolling', window)]:.2f}s recompute={out[('recompute', window)]:.2f}s")
+
+    out["backtest"] = _timeit(lambda: backtest.backtest(prices), repeat=1)
+    small = prices.iloc[-800:, :30]
+    grid = {"window": [126, 252], "rebalance_every": [10, 21], "strategy": ["max_sharpe", "min_variance"]}
+    out["sweep_serial"] = _timeit(lambda: backtest.sweep(small, grid), repeat=1)
+    out["sweep_pooled"] = _timeit(lambda: backtest.sweep(small, grid, workers=workers), repeat=1)
+    print(f"backtest monthly rebalanced, {n_assets} assets: {out['backtest']:.2f}s | sweep of "
+          f"{len(backtest.expand_grid(grid))} cases (30 assets): serial={out['sweep_serial']:.2f}s "
+          f"workers={workers} {out['sweep_pooled']:.2f}s (cpus={os.cpu_count()})")
+    return out
+
+
+def write_legacy_finance_db(path, n_expenses, n_investments=0):
+    """A finance.db in the pre-unification raw sqlite3 schema, for the migration path."""
+    import sqlite3
+
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE expenses (id INTEGER PRIMARY KEY AUTOINCREMENT, category TEXT NOT NULL, amount REAL NOT NULL,
+                           description TEXT, date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    CREATE TABLE investments (id INTEGER PRIMARY KEY AUTOINCREMENT, type TEXT NOT NULL, symbol TEXT NOT NULL,
+                              amount REAL NOT NULL, date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+    """)
+    start = datetime.datetime(2024, 1, 1)
+    conn.executemany("INSERT INTO expenses (category, amount, description, date) VALUES (?, ?, ?, ?)",
+                     ((f"cat{i % 12}", float(i % 500), f"item {i}",
+                       (start + datetime.timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"))
+                      for i in range(n_expenses)))
+    conn.executemany("INSERT INTO investments (type, symbol, amount, date) VALUES (?, ?, ?, ?)",
+                     (("stock", f"SYM{i % 50}", float(i % 1000),
+                       (start + datetime.timedelta(hours=i)).strftime("%Y-%m-%d %H:%M:%S"))
+                      for i in range(n_investments)))
+    conn.commit()
+    conn.close()
+
+
+def bench_migration(n_expenses=200_000, n_investments=20_000):
+    """Streaming finance.db migration, an idempotent re-run, and legacy vs unified reads."""
+    import sqlite3
+    import finance_tools
+    import repository
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "finance.db")
+        write_legacy_finance_db(legacy, n_expenses, n_investments)
+        uri = "sqlite:///" + os.path.join(tmp, "app.db")
+        first = repository.migrate_legacy(legacy, uri)
+        again = repository.migrate_legacy(legacy, uri)
+        assert first["expenses"] == n_expenses and first["investments"] == n_investments, first
+        assert again["skipped"] == n_expenses + n_investments, again
+
+        def legacy_recent():
+            conn = sqlite3.connect(legacy)
+            rows = conn.execute("SELECT * FROM expenses ORDER BY date DESC").fetchall()
+            conn.close()
+            return rows[:5]
+
+        previous_uri, finance_tools.DB_URI = finance_tools.DB_URI, uri
+        try:
+            legacy_read = _timeit(legacy_recent)
+            unified_read = _timeit(lambda: finance_tools.get_expenses(limit=5))
+            assert [r[1:4] for r in legacy_recent()] == [r[1:4] for r in finance_tools.get_expenses(limit=5)]
+        finally:
+            finance_tools.DB_URI = previous_uri
+
+    rows = n_expenses + n_investments
+    print(f"migration rows={rows} first={first['seconds']:.2f}s ({rows / first['seconds']:,.0f} rows/s) "
+          f"re-run={again['seconds']:.2f}s | latest 5 expenses: legacy={legacy_read * 1000:.1f}ms "
+          f"unified={unified_read * 1000:.2f}ms")
+    return {"migrate": first["seconds"], "rerun": again["seconds"], "legacy_read": legacy_read,
+            "unified_read": unified_read}
+
+
+def bench_advice(n_expenses=200_000, latency=0.5):
+    """Advisor: full-table vs LIMIT expense read, cold vs cached advice, time to first streamed chunk."""
+    import advisor
+    import finance_tools
+    import repository
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "finance.db")
+        write_legacy_finance_db(legacy, n_expenses)
+        uri = "sqlite:///" + os.path.join(tmp, "app.db")
+        repository.migrate_legacy(legacy, uri)
+        previous_uri, finance_tools.DB_URI = finance_tools.DB_URI, uri
+        previous_get_news = advisor.get_finance_news
+        advisor.get_finance_news = lambda: [f"Headline {i}" for i in range(5)]
+        backend = advisor.FakeBackend(latency=latency)
+        previous_backend = advisor.set_backend(backend)
+        previous_cache = advisor.set_response_cache(advisor.ResponseCache(os.path.join(tmp, "advice.db")))
+        try:
+            full = _timeit(lambda: finance_tools.get_expenses()[:5])
+            limited = _timeit(lambda: finance_tools.get_expenses(limit=5))
+            assert finance_tools.get_expenses()[:5] == finance_tools.get_expenses(limit=5)
+
+            cold = _timeit(advisor.get_financial_advice, repeat=1)
+            warm = _timeit(advisor.get_financial_advice)
+            advisor.get_response_cache().clear()
+            t0 = time.perf_counter()
+            stream = advisor.stream_financial_advice()
+            next(stream)
+            first_chunk = time.perf_counter() - t0
+            list(stream)
+            streamed = time.perf_counter() - t0
+        finally:
+            finance_tools.DB_URI = previous_uri
+            advisor.get_finance_news = previous_get_news
+            advisor.set_backend(previous_backend)
+            advisor.set_response_cache(previous_cache).conn.close()
+
+    print(f"advice expenses={n_expenses} read: full={full * 1000:.1f}ms limit={limited * 1000:.2f}ms | "
+          f"model latency={latency * 1000:.0f}ms cold={cold * 1000:.0f}ms cached={warm * 1000:.2f}ms | "
+          f"stream first chunk={first_chunk * 1000:.0f}ms complete={streamed * 1000:.0f}ms "
+          f"(model calls={backend.calls})")
+    return {"full_read": full, "limit_read": limited, "cold": cold, "cached": warm, "first_chunk": first_chunk}
+
+
+def bench_analytics(n_transactions=500_000, years=3):
+    """Arrow export throughput, and month x category totals from the memory map vs a pandas read_sql."""
+    import analytics
+    from memory import get_session_factory, session_scope, Transaction
+
+    start = datetime.datetime(2022, 1, 1)
+    step = years * 365 * 24 * 3600 / n_transactions
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = "sqlite:///" + os.path.join(tmp, "app.db")
+        with session_scope(get_session_factory(uri)) as session:
+            session.connection().execute(Transaction.__table__.insert(), [
+                {"user_id": 1, "category": f"cat{i % 15}", "amount": float(i % 500), "description": f"item {i}",
+                 "timestamp": start + datetime.timedelta(seconds=i * step)} for i in range(n_transactions)])
+        with session_scope(get_session_factory(uri)) as session:
+            path = os.path.join(tmp, "tx.arrow")
+            t0 = time.perf_counter()
+            analytics.export_transactions(session, 1, path=path)
+            export = time.perf_counter() - t0
+            reuse = _timeit(lambda: analytics.export_transactions(session, 1, path=path))
+            parquet = _timeit(lambda: analytics.export_transactions(session, 1, path=path + ".parquet",
+                                                                    force=True), repeat=1)
+
+            def pandas_monthly():
+                frame = pd.read_sql(session.query(Transaction.timestamp, Transaction.category, Transaction.amount)
+                                    .filter(Transaction.user_id == 1).statement, session.connection())
+                month = pd.to_datetime(frame["timestamp"]).dt.strftime("%Y-%m")
+                return frame.groupby([month, "category"])["amount"].sum().unstack(fill_value=0)
+
+            def arrow_monthly():
+                analytics._monthly.clear()
+                return analytics.monthly_by_category(path)
+
+            baseline = _timeit(pandas_monthly, repeat=1)
+            columnar = _timeit(arrow_monthly)
+            assert np.allclose(pandas_monthly().sort_index(axis=1).values, arrow_monthly().values)
+            trends = _timeit(lambda: analytics.spending_trends(path))
+
+    print(f"analytics rows={n_transactions} export={export:.2f}s ({n_transactions / export:,.0f} rows/s) "
+          f"unchanged={reuse * 1000:.1f}ms parquet={parquet:.2f}s | monthly by category: "
+          f"pandas read_sql={baseline:.2f}s arrow mmap={columnar * 1000:.1f}ms | trends={trends * 1000:.1f}ms")
+    return {"export": export, "reuse": reuse, "pandas_monthly": baseline, "arrow_monthly": columnar,
+            "trends": trends}
+
+
+def bench_anomaly(n_history=200_000, n_inserts=200, n_batch=100_000):
+    """Per-insert scoring from CategoryStats vs rescanning the category's history, and batch scoring."""
+    import random
+    import anomaly
+    import repository
+    from memory import get_session_factory, session_scope, get_or_create_user, Transaction
+
+    rng = random.Random(0)
+    start = datetime.datetime(2023, 1, 1)
+    with tempfile.TemporaryDirectory() as tmp:
+        uri = "sqlite:///" + os.path.join(tmp, "app.db")
+        with session_scope(get_session_factory(uri)) as session:
+            user_id = get_or_create_user(session).id
+            session.connection().execute(Transaction.__table__.insert(), [
+                {"user_id": user_id, "category": f"cat{i % 10}", "amount": rng.lognormvariate(3, 0.5),
+                 "timestamp": start + datetime.timedelta(minutes=i)} for i in range(n_history)])
+        with session_scope(get_session_factory(uri)) as session:
+            t0 = time.perf_counter()
+            anomaly.rebuild_category_stats(session, user_id)
+            rebuild = time.perf_counter() - t0
+
+            def rescan(category, amount):
+                amounts = np.array([a for (a,) in session.query(Transaction.amount).filter(
+                    Transaction.user_id == user_id, Transaction.category == category)])
+                return (amount - amounts.mean()) / amounts.std() >= anomaly.ANOMALY_Z_THRESHOLD
+
+            amounts = [rng.lognormvariate(3, 0.5) for _ in range(n_inserts)]
+            t0 = time.perf_counter()
+            for i, amount in enumerate(amounts):
+                rescan(f"cat{i % 10}", amount)
+            scan = (time.perf_counter() - t0) / n_inserts
+            t0 = time.perf_counter()
+            for i, amount in enumerate(amounts):
+                repository.add_transaction(session, user_id, f"cat{i % 10}", amount)
+                session.commit()
+            online = (time.perf_counter() - t0) / n_inserts
+
+            rows = [{"category": f"cat{i % 10}", "amount": rng.lognormvariate(3, 0.5)} for i in range(n_batch)]
+            t0 = time.perf_counter()
+            verdicts = anomaly.observe_many(session, user_id, rows)
+            batch = time.perf_counter() - t0
+            session.rollback()
+
+    flagged = sum(v["flagged"] for v in verdicts)
+    print(f"anomaly history={n_history} rebuild={rebuild:.2f}s | per insert: rescan score={scan * 1000:.1f}ms "
+          f"online insert+score+commit={online * 1000:.2f}ms | batch {n_batch / batch:,.0f} rows/s "
+          f"flagged={flagged / n_batch:.2%}")
+    return {"rebuild": rebuild, "rescan": scan, "online": online, "batch_rows_per_second": n_batch / batch}
+
+
+def bench_metrics(n_tasks=2000):
+    """Cost of the instrumentation: Crew kickoffs with metrics on vs off, and export time."""
+    import metrics
+    import tasks
+    from crew import Crew
+    from memory import get_session_factory, session_scope, get_or_create_user
+
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = get_session_factory("sqlite:///" + os.path.join(tmp, "app.db"))
+        with session_scope(factory) as session:
+            user_id = get_or_create_user(session).id
+        crew = Crew(user=user_id, session_factory=factory)
+        crew.kickoff({"action": tasks.ADD_TRANSACTION, "category": "Food", "amount": 10.0})
+
+        def run():
+            for _ in range(n_tasks):
+                crew.kickoff({"action": tasks.MONTHLY_SUMMARY})
+
+        previous = metrics.enabled
+        try:
+            metrics.enabled = False
+            off = _timeit(run)
+            metrics.enabled = True
+            on = _timeit(run)
+        finally:
+            metrics.enabled = previous
+        prometheus = _timeit(metrics.to_prometheus)
+        snapshot = _timeit(metrics.snapshot)
+
+    print(f"metrics {n_tasks} kickoffs: off={off / n_tasks * 1e6:.0f}us on={on / n_tasks * 1e6:.0f}us per task "
+          f"(+{(on - off) / off:.1%}) | prometheus export={prometheus * 1000:.2f}ms "
+          f"snapshot={snapshot * 1000:.2f}ms")
+    return {"off": off, "on": on, "prometheus": prometheus, "snapshot": snapshot}
+
+
+SCENARIO_ACTIONS = [
+    {"action": "monthly_summary"},
+    {"action": "expense_report"},
+    {"action": "progress"},
+    {"action": "flagged_transactions"},
+    {"action": "spending_trends"},
+    {"action": "get_stock_prices", "tickers": fixtures.SCENARIO_TICKERS},
+    {"action": "fetch_price_dataframe", "tickers": fixtures.SCENARIO_TICKERS, "period": "5y"},
+    {"action": "get_crypto_prices", "coin_ids": fixtures.SCENARIO_COINS},
+    {"action": "get_news", "query": fixtures.SCENARIO_NEWS_QUERIES[0]},
+    {"action": "suggest_portfolio", "tickers": fixtures.SCENARIO_TICKERS},
+    {"action": "portfolio_risk", "tickers": fixtures.SCENARIO_TICKERS, "n_paths": 20_000},
+    {"action": "backtest_portfolio", "tickers": fixtures.SCENARIO_TICKERS},
+]
+
+
+def bench_scenarios(fixtures_dir=None, n_transactions=50_000, asset_counts=(10, 50, 200, 500),
+                    report_rows=(10_000, 100_000)):
+    """
+    Crew.kickoff for each SCENARIO_ACTIONS entry against replayed market data, mean_variance_optimization
+    by asset count, and report generation by transaction count. Synthetic fixtures are generated
+    when no fixtures_dir is given.
+    """
+    import analytics
+    from crew import Crew
+    from memory import get_session_factory
+    from portfolio import mean_variance_optimization
+
+    out = {"kickoff": {}, "mean_variance_optimization": {}, "reports": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures_dir = fixtures_dir or fixtures.write_synthetic_fixtures(os.path.join(tmp, "fixtures"))
+        previous_dir, analytics.ANALYTICS_DIR = analytics.ANALYTICS_DIR, os.path.join(tmp, "analytics")
+        try:
+            with fixtures.replay(fixtures_dir) as (source, client):
+                factory = get_session_factory("sqlite:///" + os.path.join(tmp, "scenario.db"))
+                with factory() as session:
+                    user_id = fixtures.generate_users(session, 1, n_transactions)[0]
+                crew = Crew(user=user_id, session_factory=factory)
+                for inputs in SCENARIO_ACTIONS:
+                    res = crew.kickoff(inputs)
+                    assert "result" in res, (inputs["action"], res.get("error"))
+                    out["kickoff"][inputs["action"]] = _timeit(lambda: crew.kickoff(inputs))
+                assert not source.misses and not client.misses, (source.misses, client.misses)
+
+            for n in asset_counts:
+                prices = fixtures.synthetic_prices(n)
+                out["mean_variance_optimization"][n] = _timeit(lambda: mean_variance_optimization(prices))
+
+            for n in report_rows:
+                factory = get_session_factory("sqlite:///" + os.path.join(tmp, f"reports_{n}.db"))
+                with factory() as session:
+                    user_id = fixtures.generate_users(session, 1, n, months=24)[0]
+                crew = Crew(user=user_id, session_factory=factory)
+                t0 = time.perf_counter()
+                crew.kickoff({"action": "spending_trends"})
+                first_trends = time.perf_counter() - t0
+                out["reports"][n] = {
+                    "expense_report": _timeit(lambda: crew.kickoff({"action": "expense_report"})),
+                    "spending_trends_first": first_trends,
+                    "spending_trends": _timeit(lambda: crew.kickoff({"action": "spending_trends"})),
+                }
+        finally:
+            analytics.ANALYTICS_DIR = previous_dir
+
+    for action, seconds in out["kickoff"].items():
+        print(f"scenario kickoff {action:<24} {seconds * 1000:9.2f}ms")
+    print("scenario mean_variance_optimization " + " ".join(
+        f"n={n}:{seconds * 1000:.1f}ms" for n, seconds in out["mean_variance_optimization"].items()))
+    for n, report in out["reports"].items():
+        print(f"scenario reports rows={n} expense_report={report['expense_report'] * 1000:.2f}ms "
+              f"spending_trends first={report['spending_trends_first'] * 1000:.0f}ms "
+              f"repeat={report['spending_trends'] * 1000:.1f}ms")
+    return out
+
+
+def bench_scheduler(n_tickers=20, latency=0.05, n_users=200, transactions_per_user=500):
+    """First suggest_portfolio cold vs after a price prewarm; reports computed vs read from snapshots."""
+    import goals
+    import scheduler
+    import tasks
+    from crew import Crew
+    from memory import get_session_factory, session_scope, User, Portfolio
+
+    tickers = [f"T{i:03d}" for i in range(n_tickers)]
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = get_session_factory("sqlite:///" + os.path.join(tmp, "scheduler.db"))
+        with session_scope(factory) as session:
+            user_ids = fixtures.generate_users(session, n_users, transactions_per_user, months=2)
+            for i, user in enumerate(session.query(User)):
+                user.goals = json.dumps([{"name": "Car", "target": 500_000, "deadline": "2030-01-01"}])
+                user.watchlist = json.dumps(tickers[:n_tickers // 2] if i == 0 else [])
+            session.add(Portfolio(user_id=user_ids[0], holdings={t: 1 for t in tickers[n_tickers // 2:]}))
+
+        store = price_store.PriceStore(os.path.join(tmp, "prices.db"))
+        previous = data_fetchers.set_price_source(SyntheticPriceSource(latency=latency))
+        previous_store = price_store.set_price_store(store)
+        try:
+            crew = Crew(user=user_ids[0], session_factory=factory)
+            suggest = {"action": tasks.SUGGEST_PORTFOLIO, "tickers": tickers}
+            cold = _timeit(lambda: crew.kickoff(suggest), repeat=1)
+            store.clear()
+            prewarm = _timeit(lambda: scheduler.prewarm_prices(factory), repeat=1)
+            warm = _timeit(lambda: crew.kickoff(suggest))
+        finally:
+            data_fetchers.set_price_source(previous)
+            price_store.set_price_store(previous_store)
+            store.conn.close()
+
+        def reports():
+            goals.clear_cache()
+            for user_id in user_ids[:50]:
+                crew = Crew(user=user_id, session_factory=factory)
+                crew.kickoff({"action": tasks.EXPENSE_REPORT})
+                crew.kickoff({"action": tasks.GOAL_PROGRESS})
+
+        computed = _timeit(reports, repeat=1)
+        nightly = _timeit(lambda: scheduler.prewarm_reports(factory), repeat=1)
+        rerun = _timeit(lambda: scheduler.prewarm_reports(factory), repeat=1)
+        snapshot = _timeit(reports, repeat=1)
+
+    print(f"scheduler tickers={n_tickers} suggest cold={cold:.3f}s prewarm={prewarm:.3f}s warm={warm:.3f}s | "
+          f"reports x50 computed={computed:.3f}s snapshot={snapshot:.3f}s nightly users={n_users} "
+          f"{nightly:.3f}s (unchanged rerun {rerun:.3f}s)")
+    return {"suggest_cold": cold, "prewarm_prices": prewarm, "suggest_warm": warm, "reports_computed": computed,
+            "reports_snapshot": snapshot, "nightly_reports": nightly, "nightly_rerun": rerun}
+
+
+def bench_batch_reports(n_users=100_000, n_categories=8, per_user_sample=500, workers=2):
+    """Monthly reports for every user: per-user agents (sampled) vs batch_reports in-process and pooled."""
+    from sqlalchemy import insert
+    import batch_reports
+    import goals
+    from agents import ExpenseAgent, GoalAgent
+    from memory import get_session_factory, session_scope, User, MonthlyCategoryTotal, month_key
+
+    rng = np.random.default_rng(0)
+    month = month_key(datetime.datetime.utcnow())
+    categories = fixtures.CATEGORIES[:n_categories]
+    deadlines = [f"{2027 + i // 12}-{i % 12 + 1:02d}-01" for i in range(36)]
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = get_session_factory("sqlite:///" + os.path.join(tmp, "batch.db"))
+        with session_scope(factory) as session:
+            chunk = 20_000
+            for lo in range(0, n_users, chunk):
+                ids = range(lo + 1, min(lo + chunk, n_users) + 1)
+                session.execute(insert(User), [
+                    {"id": i, "name": f"user_{i}", "income": float(rng.integers(3, 15) * 1000),
+                     "goals": json.dumps([{"name": "Goal", "target": float(rng.integers(1, 50) * 1000),
+                                           "deadline": deadlines[int(rng.integers(0, 36))]}] * int(rng.integers(0, 3))),
+                     "data_version": 1} for i in ids])
+                session.execute(insert(MonthlyCategoryTotal), [
+                    {"user_id": i, "month": month, "category": c, "total": round(float(rng.gamma(2.0, 150.0)), 2),
+                     "count": 1} for i in ids for c in categories])
+
+        def per_user():
+            goals.clear_cache()
+            with session_scope(factory) as session:
+                for user in session.query(User).filter(User.id <= per_user_sample):
+                    summary = ExpenseAgent(session, user).monthly_summary()
+                    ExpenseAgent(session, user).expense_report(summary)
+                    GoalAgent(session, user).progress(summary)
+
+        agents = _timeit(per_user, repeat=1) / per_user_sample * n_users
+        serial = batch_reports.generate(factory)
+        pooled = batch_reports.generate(factory, workers=workers)
+        unchanged = batch_reports.generate(factory, only_changed=True)
+
+    print(f"batch_reports users={n_users} per-user agents ~{agents:.1f}s (from {per_user_sample}) | "
+          f"batch {serial['seconds']:.2f}s ({serial['users_per_second']:,.0f} users/s) | "
+          f"{workers} workers {pooled['seconds']:.2f}s ({pooled['users_per_second']:,.0f} users/s) | "
+          f"unchanged rerun {unchanged['seconds']:.2f}s")
+    return {"per_user_estimate": agents, "batch": serial["seconds"], "batch_users_per_second": serial["users_per_second"],
+            "pooled": pooled["seconds"], "pooled_users_per_second": pooled["users_per_second"],
+            "unchanged_rerun": unchanged["seconds"]}
+
+
+def bench_stats_cache(n_universe=500, basket=50, n_requests=200, periods=("1y", "5y")):
+    """estimate_moments for overlapping user baskets: pct_change + cov per click vs the shared stats cache."""
+    import portfolio
+    import stats_cache
+
+    rng = np.random.default_rng(0)
+    dates = pd.bdate_range(end=datetime.date.today(), periods=1400)
+    prices = pd.DataFrame(np.exp(np.cumsum(rng.normal(0.0003, 0.01, (len(dates), n_universe)), axis=0)) * 100,
+                          index=dates, columns=[f"T{i:03d}" for i in range(n_universe)])
+    popular = prices.columns[:basket * 2]  # users mostly pick from the same large caps
+    baskets = [sorted(rng.choice(popular, basket, replace=False)) for _ in range(n_requests)]
+
+    def legacy(df, period):
+        returns = portfolio.trim_to_period(df, period).pct_change().dropna()
+        return returns.mean(), returns.cov()
+
+    results = {}
+    for period in periods:
+        frames = [prices[b] for b in baskets]
+        before = _timeit(lambda: [legacy(df, period) for df in frames], repeat=1)
+        enabled = portfolio.STATS_CACHE_ENABLED
+        portfolio.STATS_CACHE_ENABLED = False
+        direct = _timeit(lambda: [portfolio.estimate_moments(df, period) for df in frames], repeat=1)
+        portfolio.STATS_CACHE_ENABLED = enabled
+        stats_cache.clear_cache()
+        cached = _timeit(lambda: [portfolio.estimate_moments(df, period) for df in frames], repeat=1)
+        # the next bar arrives: every basket again on a span one day later
+        later = prices.iloc[:-1]
+        stats_cache.clear_cache()
+        [portfolio.estimate_moments(later[b], period) for b in baskets]
+        rolled = _timeit(lambda: [portfolio.estimate_moments(df, period) for df in frames], repeat=1)
+        info = stats_cache.cache_info()
+        full = _timeit(lambda: portfolio.estimate_moments(prices, period), repeat=1)
+        print(f"stats_cache period={period} {n_requests} baskets of {basket}/{len(popular)}: "
+              f"pct_change+cov {before:.3f}s numpy+cov {direct:.3f}s cached {cached:.3f}s "
+              f"after a new bar {rolled:.3f}s (rolled {info['rolled']}) | all {n_universe} warm {full * 1000:.1f}ms")
+        results[period] = {"pct_change_cov": before, "direct": direct, "cached": cached, "new_bar": rolled,
+                           "universe_warm": full}
+    return results
+
+
+def bench_categorize(n_descriptions=100_000, n_merchants=2000, n_user_keywords=500, n_user_regexes=20):
+    """
+    Descriptions categorized per ms: a rule-by-rule scan vs the compiled index on a first statement,
+    a second statement of the same merchants (new reference numbers) and an identical re-run.
+    """
+    import re
+    import categorize
+
+    rng = np.random.default_rng(0)
+    rules = categorize.default_rules()
+    rules += [categorize.Rule("Shopping", categorize.KEYWORD, f"store {i}x", None, None, (0, 0, 0, i))
+              for i in range(n_user_keywords)]
+    rules += [categorize.Rule("Transfers", categorize.REGEX, rf"neft\W+ref\W+\d+\W+{i}x", None, 50_000.0, (0, 1, 0, i))
+              for i in range(n_user_regexes)]
+    keywords = [r.pattern for r in rules if r.kind == categorize.KEYWORD]
+    merchants = [f"{keywords[i % len(keywords)]} {w}" if i % 3 else f"local merchant {w}"
+                 for i, w in enumerate(rng.integers(0, 10_000, n_merchants))]
+
+    def statement():
+        picks = rng.integers(0, n_merchants, n_descriptions)
+        return ([f"POS {rng.integers(10**5, 10**6)} {merchants[m].upper()} {rng.integers(1000, 9999)}"
+                 for m in picks], rng.uniform(10, 5000, n_descriptions).tolist())
+
+    descriptions, amounts = statement()
+    ranked = sorted(rules, key=lambda r: r.rank)
+    compiled = [(re.compile(r.pattern, re.IGNORECASE) if r.kind == categorize.REGEX else None, r) for r in ranked]
+
+    def scan(description, amount):
+        text, plain = categorize.merchant_key(description), categorize.plain_text(description)
+        for regex, r in compiled:
+            hit = regex.search(plain) if regex is not None else categorize.merchant_key(r.pattern) in text
+            if hit and categorize._fits(r, amount):
+                return r.category
+        return categorize.UNCATEGORIZED
+
+    sample = n_descriptions // 20
+    naive = _timeit(lambda: [scan(d, a) for d, a in zip(descriptions[:sample], amounts[:sample])], repeat=1)
+    build = _timeit(lambda: categorize.Categorizer(rules), repeat=3)
+    categorizer = categorize.Categorizer(rules)
+    cold = _timeit(lambda: categorizer.categorize_many(descriptions, amounts), repeat=1)
+    descriptions, amounts = statement()
+    merchants_known = _timeit(lambda: categorizer.categorize_many(descriptions, amounts), repeat=1)
+    rerun = descriptions[-min(n_descriptions, categorizer.cache_size):], amounts[-min(n_descriptions, categorizer.cache_size):]
+    identical = _timeit(lambda: categorizer.categorize_many(*rerun), repeat=3)
+    rates = {"naive_per_second": sample / naive, "first_pass_per_second": n_descriptions / cold,
+             "known_merchants_per_second": n_descriptions / merchants_known,
+             "identical_per_second": len(rerun[0]) / identical}
+    print(f"categorize {len(rules)} rules, {n_descriptions} descriptions of {n_merchants} merchants: "
+          f"compile {build * 1000:.1f}ms | per ms: rule-by-rule {rates['naive_per_second'] / 1000:.1f} "
+          f"compiled first pass {rates['first_pass_per_second'] / 1000:.1f} "
+          f"known merchants {rates['known_merchants_per_second'] / 1000:.1f} "
+          f"identical re-run {rates['identical_per_second'] / 1000:.1f}")
+    return dict(rates, compile=build)
+
+
+def bench_ledger(n_users=1000, positions_per_user=10, n_symbols=500, tick_symbols=50):
+    """Ledger: trades booked per second, positions revalued per second by a price tick vs a full revalue."""
+    import ledger
+    from memory import get_session_factory, session_scope
+
+    rng = np.random.default_rng(0)
+    symbols = [f"S{i:03d}" for i in range(n_symbols)]
+    base = dict(zip(symbols, rng.uniform(10, 500, n_symbols)))
+    day = datetime.datetime(2026, 1, 5, 16)
+    with tempfile.TemporaryDirectory() as tmp:
+        factory = get_session_factory("sqlite:///" + os.path.join(tmp, "ledger.db"))
+        with session_scope(factory) as session:
+            def buy_all():
+                for user_id in range(1, n_users + 1):
+                    for s in rng.choice(symbols, positions_per_user, replace=False):
+                        ledger.record_trade(session, user_id, s, int(rng.integers(1, 100)), base[s], 1.0, day)
+                session.commit()
+
+            trades = _timeit(buy_all, repeat=1)
+            n_positions = n_users * positions_per_user
+
+            def tick(names):
+                drift = rng.normal(1, 0.01, len(names))
+                count = ledger.apply_prices(session, {s: base[s] * d for s, d in zip(names, drift)}, day)
+                session.commit()
+                return count
+
+            counts = {}
+            full_tick = _timeit(lambda: counts.__setitem__("full", tick(symbols)))
+            partial = _timeit(lambda: counts.__setitem__("partial", tick(symbols[:tick_symbols])))
+            revalue = _timeit(lambda: ledger.revalue(session, timestamp=day))
+            book = _timeit(lambda: [ledger.book(session, u) for u in range(1, 101)])
+
+    print(f"ledger positions={n_positions} trades {n_positions / trades:,.0f}/s | tick all {n_symbols} symbols "
+          f"{full_tick:.3f}s ({counts['full'] / full_tick:,.0f} positions/s) | tick {tick_symbols} symbols "
+          f"{partial:.4f}s ({counts['partial']} positions) | full revalue {revalue:.3f}s "
+          f"({n_positions / revalue:,.0f} positions/s) | book x100 {book * 1000:.1f}ms")
+    return {"trades_per_second": n_positions / trades, "tick_all_seconds": full_tick,
+            "positions_per_second": counts["full"] / full_tick, "tick_partial_seconds": partial,
+            "full_revalue_seconds": revalue, "book_x100_seconds": book}
+
+
+def _load(port, requests, concurrency, headers=None):
+    """Send (method, path, body) requests from concurrency keep-alive clients; req/s, p50/p95 ms, status counts."""
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+
+    def client(share):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        out = []
+        for method, path, body in share:
+            started = time.perf_counter()
+            conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            out.append((time.perf_counter() - started, response.status))
+        conn.close()
+        return out
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        samples = [s for share in pool.map(client, [requests[i::concurrency] for i in range(concurrency)])
+                   for s in share]
+    elapsed = time.perf_counter() - started
+    latencies = np.array([s[0] for s in samples]) * 1000
+    statuses = {}
+    for _, status in samples:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {"rps": len(samples) / elapsed, "p50_ms": float(np.percentile(latencies, 50)),
+            "p95_ms": float(np.percentile(latencies, 95)), "statuses": statuses}
+
+
+def bench_api(processes=(1, 2), n_users=50, transactions_per_user=2000, n_requests=1000, concurrency=16):
+    """Load test of api.py on a local SQLite: report GETs, 304 revalidations, expense writes and batches."""
+    import http.client
+    import socket
+    import subprocess
+    from memory import get_session_factory, session_scope
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = "sqlite:///" + os.path.join(tmp, "api.db")
+        with session_scope(get_session_factory(db_url)) as session:
+            user_ids = fixtures.generate_users(session, n_users, transactions_per_user, months=3)
+        rng = np.random.default_rng(0)
+        for n in processes:
+            with socket.socket() as sock:
+                sock.bind(("127.0.0.1", 0))
+                port = sock.getsockname()[1]
+            env = dict(os.environ, DATABASE_URL=db_url, PRICE_CACHE_DB="", METRICS_PORT="0", API_TOKEN="",
+                       ANALYTICS_DIR=os.path.join(tmp, "analytics"))
+            server = subprocess.Popen([sys.executable, "api.py", "--port", str(port), "--processes", str(n)],
+                                      cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                for _ in range(300):
+                    try:
+                        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                        conn.request("GET", "/health")
+                        if conn.getresponse().status == 200:
+                            break
+                    except OSError:
+                        time.sleep(0.1)
+                reports = [("GET", f"/v1/users/{user_ids[i % n_users]}/reports/"
+                                   + ("expense_report", "progress", "flagged_transactions")[i % 3], None)
+                           for i in range(n_requests)]
+                warm = _load(port, reports, concurrency)
+                # revalidation: every client already holds the current ETag of one report
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                conn.request("GET", f"/v1/users/{user_ids[0]}/reports/expense_report")
+                response = conn.getresponse()
+                response.read()
+                etag = response.getheader("ETag")
+                not_modified = _load(port, [("GET", f"/v1/users/{user_ids[0]}/reports/expense_report", None)]
+                                     * n_requests, concurrency, headers={"If-None-Match": etag})
+                writes = _load(port, [("POST", f"/v1/users/{user_ids[i % n_users]}/tasks/add_transaction",
+                                       {"category": "Food", "amount": round(float(a), 2)})
+                                      for i, a in enumerate(rng.gamma(2.0, 20.0, n_requests // 2))], concurrency)
+                batch = {"requests": [{"action": "monthly_summary"}, {"action": "expense_report"},
+                                      {"action": "progress"}, {"action": "flagged_transactions", "limit": 5}]}
+                batches = _load(port, [("POST", f"/v1/users/{user_ids[i % n_users]}/batch", batch)
+                                       for i in range(n_requests // 4)], concurrency)
+            finally:
+                server.terminate()
+                server.wait(10)
+            for name, res in (("reports", warm), ("not_modified", not_modified), ("writes", writes),
+                              ("batch", batches)):
+                print(f"api processes={n} {name:<12} {res['rps']:7.0f} req/s p50={res['p50_ms']:.1f}ms "
+                      f"p95={res['p95_ms']:.1f}ms {res['statuses']}")
+            results[f"processes_{n}"] = {name: {k: v for k, v in res.items() if k != "statuses"}
+                                         for name, res in (("reports", warm), ("not_modified", not_modified),
+                                                           ("writes", writes), ("batch", batches))}
+    return results
+
+
+# cumulative import seconds (over a bare interpreter) allowed per entry point, and libraries that
+# must not be loaded by it; bench_imports fails the run when either is broken
+IMPORT_BUDGETS = {
+    "crew": ("import crew", 0.8),
+    "add_transaction": ("from memory import get_session_factory, session_scope, get_or_create_user\n"
+                        "from crew import Crew\n"
+                        "factory = get_session_factory('sqlite://')\n"
+                        "with session_scope(factory) as s: uid = get_or_create_user(s, 'cli').id\n"
+                        "res = Crew(user=uid, session_factory=factory).kickoff("
+                        "{'action': 'add_transaction', 'category': 'Food', 'amount': 5})\n"
+                        "assert 'error' not in res, res", 0.9),
+    "finance_tools": ("import finance_tools", 0.8),
+    "advisor": ("import advisor", 0.8),
+    "api": ("import api", 1.0),
+}
+HEAVY_MODULES = ("pandas", "numpy", "yfinance", "scipy", "pyarrow", "requests", "google.generativeai")
+budget_failures = []
+
+
+def _import_seconds(code, repeat=3):
+    """Best-of-repeat top-level import time of code (python -X importtime) and the heavy modules it loaded."""
+    import subprocess
+    probe = code + "\nimport sys, json\nprint(json.dumps([m for m in %r if m in sys.modules]))" % (HEAVY_MODULES,)
+    best, loaded = None, None
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             env=dict(os.environ, PRICE_CACHE_DB="", METRICS_PORT="0"))
+        if out.returncode != 0:
+            raise RuntimeError(out.stderr.strip().splitlines()[-1])
+        total = 0
+        for line in out.stderr.splitlines():
+            parts = line.split("|")
+            # top-level entries are indented by one space; nested ones are already in their cumulative
+            if len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            if parts[2].startswith(" ") and not parts[2].startswith("  "):
+                total += int(parts[1])
+        best = total if best is None else min(best, total)
+        loaded = json.loads(out.stdout.strip().splitlines()[-1])
+    return best / 1e6, loaded
+
+
+def bench_imports(budgets=None):
+    """Import time of each entry point against IMPORT_BUDGETS; heavy libraries must stay unloaded."""
+    baseline, _ = _import_seconds("pass")
+    results = {}
+    for name, (code, budget) in (budgets or IMPORT_BUDGETS).items():
+        seconds, loaded = _import_seconds(code)
+        seconds = max(seconds - baseline, 0.0)
+        problems = []
+        if seconds > budget:
+            problems.append(f"{seconds:.3f}s over its {budget:.1f}s budget")
+        if loaded:
+            problems.append("loads " + ", ".join(loaded))
+        print(f"imports {name:<16} {seconds:.3f}s (budget {budget:.1f}s)" + (" FAIL: " + "; ".join(problems)
+                                                                          if problems else ""))
+        if problems:
+            budget_failures.append(f"imports.{name}")
+        results[name] = seconds
+    return results
+
+
+BENCHMARKS = {
+    "price_fetch": bench_price_fetch,
+    "price_store": bench_price_store,
+    "expense_report": bench_expense_report,
+    "import": bench_import,
+    "frontier": bench_frontier,
+    "http": bench_http,
+    "workflow": bench_workflow,
+    "goals": bench_goals,
+    "risk": bench_risk,
+    "backtest": bench_backtest,
+    "migration": bench_migration,
+    "advice": bench_advice,
+    "analytics": bench_analytics,
+    "anomaly": bench_anomaly,
+    "metrics": bench_metrics,
+    "scenarios": bench_scenarios,
+    "scheduler": bench_scheduler,
+    "ledger": bench_ledger,
+    "batch_reports": bench_batch_reports,
+    "stats_cache": bench_stats_cache,
+    "categorize": bench_categorize,
+    "api": bench_api,
+    "imports": bench_imports,
+}
+
+# a timing this much slower than the baseline is reported as a regression
+REGRESSION_TOLERANCE = 0.2
+
+
+def _flatten(result, prefix=""):
+    if isinstance(result, dict):
+        out = {}
+        for key, value in result.items():
+            out.update(_flatten(value, f"{prefix}{key}."))
+        return out
+    if isinstance(result, (int, float)) and not isinstance(result, bool):
+        return {prefix[:-1]: float(result)}
+    return {}
+
+
+def save_results(path, results):
+    payload = {"created": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "machine": platform.platform(), "cpus": os.cpu_count(),
+               "results": results}
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=1, default=float)
+
+
+def compare_results(baseline_path, results, tolerance=REGRESSION_TOLERANCE):
+    """
+    Print every metric that moved more than tolerance against a saved run; returns the regressions.
+    Names containing "per_second" are throughputs (higher is better), everything else is a time.
+    """
+    with open(baseline_path) as f:
+        baseline = _flatten(json.load(f)["results"])
+    current = _flatten(json.loads(json.dumps(results, default=float)))
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        before, after = baseline[name], current[name]
+        if before <= 0:
+            continue
+        change = after / before - 1
+        if "per_second" in name:
+            change = -change
+        if abs(change) > tolerance:
+            label = "REGRESSION" if change > 0 else "improved"
+            print(f"{label:<10} {name}: {before:.6g} -> {after:.6g} ({change:+.0%} time)")
+            if change > 0:
+                regressions.append(name)
+    print(f"compared {len(set(baseline) & set(current))} metrics against {baseline_path}: "
+          f"{len(regressions)} regression(s)")
+    return regressions
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    options = {}
+    for flag in ("--fixtures", "--save", "--compare"):
+        if flag in args:
+            i = args.index(flag)
+            options[flag] = args[i + 1]
+            del args[i:i + 2]
+    names = args or list(BENCHMARKS)
+    results = {}
+    for name in names:
+        if name == "scenarios" and "--fixtures" in options:
+            results[name] = bench_scenarios(options["--fixtures"])
+        else:
+            results[name] = BENCHMARKS[name]()
+    if "--save" in options:
+        save_results(options["--save"], results)
+    failed = bool(budget_failures)
+    if budget_failures:
+        print("over budget:", ", ".join(budget_failures))
+    if "--compare" in options:
+        failed = bool(compare_results(options["--compare"], results)) or failed
+    sys.exit(1 if failed else 0)
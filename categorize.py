@@ -0,0 +1,344 @@
+# categorize.py
+"""
+Expense categories from free text.
+canonical() folds a typed category onto one spelling: an all-lower, all-upper or title-case
+name takes the spelling the user (or DEFAULT_RULES) already has for it, so "food ", "FOOD" and
+"Food" aggregate together; a new all-lower name gets capitalized words; anything else
+("McDonald's", "IKEA") is kept as typed. CATEGORY_ALIASES (synonyms of the default names)
+apply only with CATEGORY_ALIASES_ENABLED. backfill() folds categories already stored.
+Categorizer picks a category from a transaction's description and amount using a user's
+CategoryRule rows ahead of DEFAULT_RULES:
+- every keyword is compiled into one regex shaped like a trie of the keywords, so a
+  description is scanned once however many keywords there are; at a position the longest
+  keyword wins ("uber eats" over "uber");
+- regex rules are OR-ed into one prefilter and only tried one by one when it matches;
+- min_amount / max_amount narrow any rule, and a rule without a pattern matches on amount alone.
+Among matching rules the user's come first, then higher priority, then the longer pattern.
+Keywords are matched on the description lowercased with digit runs replaced by "#", so
+"UBER TRIP 4411" and "Uber trip 9032" are one merchant and its keyword matches are memoised;
+regex rules see the digits ("store #\d{4}") and are memoised per description only.
+for_user() keeps each user's compiled Categorizer until their rules change.
+"""
+
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from sqlalchemy import select, func, update
+from memory import CategoryRule, CategoryStats, Transaction, User, rebuild_month_rollup
+from anomaly import rebuild_category_stats
+import metrics
+from utils import CATEGORIZE_CACHE_SIZE, CATEGORIZE_MAX_USERS, CATEGORY_ALIASES_ENABLED
+
+UNCATEGORIZED = "Uncategorized"
+KEYWORD, REGEX = "keyword", "regex"
+
+DEFAULT_RULES = {
+    "Groceries": ["grocery", "groceries", "supermarket", "big bazaar", "dmart", "reliance fresh", "bigbasket",
+                  "blinkit", "zepto", "nature's basket", "whole foods", "walmart", "costco", "aldi", "tesco"],
+    "Dining": ["swiggy", "zomato", "uber eats", "restaurant", "cafe", "coffee", "starbucks", "mcdonald",
+               "domino", "pizza", "kfc", "burger", "bakery"],
+    "Transport": ["uber", "ola", "lyft", "rapido", "metro", "irctc", "railway", "petrol", "fuel", "shell",
+                  "indian oil", "bharat petroleum", "parking", "toll", "fastag"],
+    "Shopping": ["amazon", "flipkart", "myntra", "ajio", "nykaa", "ikea", "decathlon"],
+    "Utilities": ["electricity", "power bill", "water bill", "gas bill", "broadband", "internet", "airtel",
+                  "jio", "vodafone", "bsnl", "recharge"],
+    "Rent": ["rent", "landlord", "house owner"],
+    "Health": ["pharmacy", "chemist", "hospital", "clinic", "apollo", "medplus", "1mg", "diagnostic",
+               "dental"],
+    "Entertainment": ["netflix", "spotify", "prime video", "hotstar", "bookmyshow", "pvr", "inox", "cinema",
+                      "steam"],
+}
+
+DEFAULT_CATEGORIES = {name.casefold(): name for name in [*DEFAULT_RULES, UNCATEGORIZED]}
+
+CATEGORY_ALIASES = {
+    "grocery": "Groceries", "supermarket": "Groceries",
+    "eating out": "Dining", "restaurants": "Dining",
+    "transportation": "Transport",
+    "utility": "Utilities", "utility bills": "Utilities",
+    "healthcare": "Health",
+    "movies": "Entertainment",
+}
+
+Rule = namedtuple("Rule", "category kind pattern min_amount max_amount rank")
+
+_spaces = re.compile(r"\s+")
+_digits = re.compile(r"\d+")
+
+
+def canonical(raw, known=None):
+    """
+    One spelling per category. known maps casefolded names to the user's spellings
+    (known_categories); names with deliberate mixed case are never rewritten.
+    """
+    category = " ".join(str(raw or "").split())
+    if not category:
+        return UNCATEGORIZED
+    key = category.casefold()
+    if category.islower() or category.isupper() or category.istitle():
+        spelling = (known or {}).get(key) or DEFAULT_CATEGORIES.get(key)
+        if spelling is None and CATEGORY_ALIASES_ENABLED:
+            spelling = CATEGORY_ALIASES.get(key)
+        if spelling is not None:
+            return spelling
+    if category.islower():
+        return " ".join(word[:1].upper() + word[1:] for word in category.split(" "))
+    return category
+
+
+def known_categories(session, user_id):
+    """{casefolded name: spelling} of the categories the user already has."""
+    return {c.casefold(): c for (c,) in session.query(CategoryStats.category)
+            .filter(CategoryStats.user_id == user_id) if c}
+
+
+def plain_text(description):
+    """The text regex rules are matched against: lowercased, whitespace collapsed."""
+    return " ".join(str(description or "").lower().split())
+
+
+def merchant_key(description):
+    """The text keywords are matched against: plain_text with digit runs as "#"."""
+    return _digits.sub("#", plain_text(description))
+
+
+def _trie_pattern(words):
+    """A regex matching any of words, factored on shared prefixes; the longest word wins at a position."""
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node):
+        branches = [re.escape(ch) + emit(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+
+    return emit(trie)
+
+
+def _fits(rule, amount):
+    if rule.min_amount is None and rule.max_amount is None:
+        return True
+    if amount is None:
+        return False
+    return ((rule.min_amount is None or amount >= rule.min_amount)
+            and (rule.max_amount is None or amount <= rule.max_amount))
+
+
+class Categorizer:
+    """Rules compiled for matching; the matched rules of each merchant are memoised."""
+
+    def __init__(self, rules, cache_size=CATEGORIZE_CACHE_SIZE):
+        rules = sorted(rules, key=lambda r: r.rank)
+        self._keywords = {}  # merchant_key(keyword) -> rules, best first
+        self._regexes = []
+        self._amount_only = [r for r in rules if not r.pattern]
+        for r in rules:
+            if not r.pattern:
+                continue
+            if r.kind == REGEX:
+                self._regexes.append((re.compile(r.pattern, re.IGNORECASE), r))
+            else:
+                self._keywords.setdefault(merchant_key(r.pattern), []).append(r)
+        self._keyword_re = None
+        if self._keywords:
+            self._keyword_re = re.compile(r"(?<!\w)" + _trie_pattern(self._keywords) + r"(?!\w)")
+        self._regex_filter = None
+        if self._regexes:
+            try:
+                self._regex_filter = re.compile("|".join(f"(?:{p.pattern})" for p, _ in self._regexes),
+                                                re.IGNORECASE)
+            except re.error:
+                pass  # patterns that cannot be OR-ed (e.g. clashing group names) are tried one by one
+        self.cache_size = cache_size
+        self._by_text = {}  # description as given -> matched rules, skips normalizing repeats
+        self._by_merchant = {}  # merchant_key -> matched keyword rules
+
+    def matches(self, description):
+        """Rules whose pattern matches description, best first."""
+        found = self._by_text.get(description)
+        if found is not None:
+            return found
+        text = merchant_key(description)
+        found = self._by_merchant.get(text)
+        if found is None:
+            matched = []
+            if self._keyword_re is not None:
+                for m in self._keyword_re.finditer(text):
+                    matched.extend(self._keywords[m.group()])
+            found = tuple(sorted(set(matched), key=lambda r: r.rank))
+            if len(self._by_merchant) >= self.cache_size:
+                self._by_merchant.clear()
+            self._by_merchant[text] = found
+        if self._regexes:
+            # digits are kept for regexes, so their matches can differ between one merchant's descriptions
+            plain = plain_text(description)
+            if self._regex_filter is None or self._regex_filter.search(plain):
+                hits = [r for p, r in self._regexes if p.search(plain)]
+                if hits:
+                    found = tuple(sorted(set(found).union(hits), key=lambda r: r.rank))
+        if len(self._by_text) >= self.cache_size:
+            self._by_text.clear()
+        self._by_text[description] = found
+        return found
+
+    def categorize(self, description, amount=None):
+        for r in self.matches(description or ""):
+            if _fits(r, amount):
+                return r.category
+        for r in self._amount_only:
+            if _fits(r, amount):
+                return r.category
+        return UNCATEGORIZED
+
+    def categorize_many(self, descriptions, amounts=None):
+        if amounts is None:
+            amounts = [None] * len(descriptions)
+        by_text, categorize = self._by_text, self.categorize
+        out = []
+        for description, amount in zip(descriptions, amounts):
+            found = by_text.get(description)
+            # the common case: the best matching rule has no amount range
+            if found and found[0].min_amount is None and found[0].max_amount is None:
+                out.append(found[0].category)
+            else:
+                out.append(categorize(description, amount))
+        return out
+
+
+def default_rules():
+    seq = 0
+    rules = []
+    for category, keywords in DEFAULT_RULES.items():
+        for keyword in keywords:
+            rules.append(Rule(category, KEYWORD, keyword, None, None, (1, 0, -len(keyword), seq)))
+            seq += 1
+    return rules
+
+
+def _user_rule(row):
+    return Rule(row.category, row.kind or KEYWORD, row.pattern or "", row.min_amount, row.max_amount,
+                (0, -(row.priority or 0), -len(row.pattern or ""), row.id))
+
+
+_default = Categorizer(default_rules())
+_compiled = OrderedDict()  # user_id -> (rules version, Categorizer), least recently used first
+_lock = threading.Lock()
+
+
+def for_user(session, user_id):
+    """The user's compiled Categorizer, recompiled only when their rules changed."""
+    version = tuple(session.execute(select(func.count(CategoryRule.id), func.max(CategoryRule.id))
+                                    .where(CategoryRule.user_id == user_id)).one())
+    if not version[0]:
+        return _default
+    with _lock:
+        entry = _compiled.get(user_id)
+        if entry is not None and entry[0] == version:
+            _compiled.move_to_end(user_id)
+            return entry[1]
+    rows = session.query(CategoryRule).filter(CategoryRule.user_id == user_id).all()
+    categorizer = Categorizer([_user_rule(r) for r in rows] + default_rules())
+    metrics.inc("categorizer_compiles_total")
+    with _lock:
+        _compiled[user_id] = (version, categorizer)
+        while len(_compiled) > CATEGORIZE_MAX_USERS:
+            _compiled.popitem(last=False)
+    return categorizer
+
+
+def resolve(session, user_id, category, description=None, amount=None):
+    """The category to store: the typed one via canonical(), else the user's rules applied to the description."""
+    if category is not None and str(category).strip():
+        return canonical(category, known_categories(session, user_id))
+    if description is None or not str(description).strip():
+        return UNCATEGORIZED
+    metrics.inc("transactions_autocategorized_total")
+    return for_user(session, user_id).categorize(description, amount)
+
+
+# ---------------- rules ----------------
+def add_rule(session, user_id, category, pattern=None, kind=KEYWORD, min_amount=None, max_amount=None,
+             priority=0):
+    """
+    Store a rule for the user. Returns the CategoryRule. Raises ValueError on an unknown kind,
+    an invalid regex or a rule with neither a pattern nor an amount range. Does not commit.
+    """
+    pattern = (pattern or "").strip()
+    kind = (kind or KEYWORD).lower()
+    if kind not in (KEYWORD, REGEX):
+        raise ValueError(f"Unknown rule kind {kind}")
+    if not str(category or "").strip():
+        raise ValueError("Rule needs a category")
+    if not pattern and min_amount is None and max_amount is None:
+        raise ValueError("Rule needs a pattern or an amount range")
+    if kind == REGEX:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid regex {pattern!r}: {e}")
+    if min_amount is not None and max_amount is not None and float(min_amount) > float(max_amount):
+        raise ValueError("min_amount is above max_amount")
+    rule = CategoryRule(user_id=user_id, category=canonical(category, known_categories(session, user_id)),
+                        kind=kind, pattern=pattern,
+                        min_amount=None if min_amount is None else float(min_amount),
+                        max_amount=None if max_amount is None else float(max_amount),
+                        priority=int(priority or 0))
+    session.add(rule)
+    return rule
+
+
+def rules(session, user_id):
+    """The user's rules, highest priority first."""
+    return [{"id": r.id, "category": r.category, "kind": r.kind, "pattern": r.pattern,
+             "min_amount": r.min_amount, "max_amount": r.max_amount, "priority": r.priority}
+            for r in session.query(CategoryRule).filter(CategoryRule.user_id == user_id)
+            .order_by(CategoryRule.priority.desc(), CategoryRule.id)]
+
+
+def delete_rule(session, user_id, rule_id):
+    """Remove one of the user's rules; False when it does not exist. Does not commit."""
+    rule = session.query(CategoryRule).filter_by(user_id=user_id, id=rule_id).first()
+    if rule is None:
+        return False
+    session.delete(rule)
+    return True
+
+
+# ---------------- maintenance ----------------
+def backfill(session):
+    """
+    Fold the spellings of stored categories with canonical(), the most used spelling of each
+    name first, then rebuild the month rollup and category stats. Returns the number of
+    transactions renamed. Commits.
+    """
+    variants = {}
+    for user_id, category, n in (session.query(Transaction.user_id, Transaction.category, func.count(Transaction.id))
+                                 .group_by(Transaction.user_id, Transaction.category)):
+        variants.setdefault(user_id, []).append((n, category))
+    renamed, changed = 0, []
+    for user_id, spellings in variants.items():
+        known = {}
+        for _, category in sorted(spellings, key=lambda v: -v[0]):
+            spelling = canonical(category, known)
+            known.setdefault(spelling.casefold(), spelling)
+            if spelling == category:
+                continue
+            match = Transaction.category.is_(None) if category is None else Transaction.category == category
+            renamed += session.execute(update(Transaction).where(Transaction.user_id == user_id, match)
+                                       .values(category=spelling)).rowcount
+            if not changed or changed[-1] != user_id:
+                changed.append(user_id)
+    if changed:
+        session.execute(update(User).where(User.id.in_(changed))
+                        .values(data_version=func.coalesce(User.data_version, 0) + 1))
+        session.commit()
+        rebuild_month_rollup(session)
+        rebuild_category_stats(session)
+    metrics.inc("categories_backfilled_total", renamed)
+    return renamed
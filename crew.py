@@ -2,33 +2,130 @@
 """
 Simple local Crew runtime to orchestrate agents.
 It provides run_task(agent_name, task_name, payload) and kickoff convenience method.
+Each run_task opens its own session from the pooled session factory, so concurrent
+users never share a session; passing session= keeps the old shared-session behaviour.
+Agents are registered by import path and loaded the first time one of their tasks runs.
 """
 
-from agents import ExpenseAgent, MarketAgent, InvestmentAgent, GoalAgent
+import importlib
+import threading
+import time
+import metrics
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from memory import User, get_session_factory, session_scope
+import tasks
+
+# agent name -> "module:Class"
+AGENT_CLASSES = {
+    "expense": "agents:ExpenseAgent",
+    "market": "agents:MarketAgent",
+    "investment": "agents:InvestmentAgent",
+    "goal": "agents:GoalAgent",
+    "analytics": "agents:AnalyticsAgent",
+}
+_loaded_agents = {}
+_loaded_lock = threading.Lock()
+
+
+def register_agent(name, cls):
+    """Add or replace an agent; cls is a class or a "module:Class" path."""
+    with _loaded_lock:
+        AGENT_CLASSES[name] = cls
+        _loaded_agents.pop(name, None)
+
+
+def agent_class(name):
+    """The agent class for name, importing its module on first use. None if unknown."""
+    cls = _loaded_agents.get(name)
+    if cls is None:
+        path = AGENT_CLASSES.get(name)
+        if path is None:
+            return None
+        if isinstance(path, str):
+            module, attr = path.split(":")
+            cls = getattr(importlib.import_module(module), attr)
+        else:
+            cls = path
+        with _loaded_lock:
+            _loaded_agents[name] = cls
+    return cls
+
+ACTION_AGENTS = {
+    tasks.ADD_TRANSACTION: "expense",
+    tasks.IMPORT_TRANSACTIONS: "expense",
+    tasks.FLAGGED_TRANSACTIONS: "expense",
+    tasks.MONTHLY_SUMMARY: "expense",
+    tasks.EXPENSE_REPORT: "expense",
+    tasks.MONTHLY_SAVINGS: "expense",
+    tasks.ADD_CATEGORY_RULE: "expense",
+    tasks.CATEGORY_RULES: "expense",
+    tasks.CATEGORIZE: "expense",
+    tasks.GET_STOCK_PRICES: "market",
+    tasks.FETCH_PRICE_DF: "market",
+    tasks.GET_NEWS: "market",
+    tasks.GET_CRYPTO_PRICE: "market",
+    tasks.GET_CRYPTO_PRICES: "market",
+    tasks.SUGGEST_PORTFOLIO: "investment",
+    tasks.PORTFOLIO_RISK: "investment",
+    tasks.BACKTEST_PORTFOLIO: "investment",
+    tasks.RECORD_TRADE: "investment",
+    tasks.POSITIONS: "investment",
+    tasks.NAV_HISTORY: "investment",
+    tasks.ADD_GOAL: "goal",
+    tasks.GOAL_PROGRESS: "goal",
+    tasks.EXPORT_TRANSACTIONS: "analytics",
+    tasks.SPENDING_TRENDS: "analytics",
+}
+
+# results a workflow step hands to the steps that depend on it, as payload[key]
+SHARED_RESULTS = {tasks.MONTHLY_SUMMARY: "summary"}
+
+WORKFLOW_MAX_WORKERS = 4
 
 class Crew:
-    def __init__(self, session, user):
-        # create agent instances that share the same DB session and user
+    def __init__(self, session=None, user=None, session_factory=None):
+        # user may be a User or a user id; only the id is kept across units of work
         self.session = session
         self.user = user
-        self.agents = {
-            "expense": ExpenseAgent(session, user),
-            "market": MarketAgent(session, user),
-            "investment": InvestmentAgent(session, user),
-            "goal": GoalAgent(session, user),
-        }
+        self.user_id = getattr(user, "id", user)
+        self.session_factory = session_factory
+        # legacy mode (session given): long-lived agents sharing the caller's session, built on first use
+        self.agents = {}
 
-    def run_task(self, agent_name, task_name, payload=None):
-        payload = payload or {}
-        agent = self.agents.get(agent_name)
-        if not agent:
-            return {"error": f"Unknown agent {agent_name}"}
+    def _run(self, agent, agent_name, task_name, payload):
         try:
             result = agent.handle_task(task_name, payload)
             return {"agent": agent_name, "task": task_name, "result": result}
         except Exception as e:
+            if agent.session is not None:
+                agent.session.rollback()
+            metrics.inc("crew_task_errors_total", task=task_name)
             return {"agent": agent_name, "task": task_name, "error": str(e)}
 
+    def run_task(self, agent_name, task_name, payload=None):
+        payload = payload or {}
+        agent_cls = agent_class(agent_name)
+        if not agent_cls:
+            return {"error": f"Unknown agent {agent_name}"}
+        token = metrics.current_task.set(task_name)
+        try:
+            with metrics.timer("crew_task_seconds", task=task_name):
+                return self._run_task(agent_cls, agent_name, task_name, payload)
+        finally:
+            metrics.current_task.reset(token)
+
+    def _run_task(self, agent_cls, agent_name, task_name, payload):
+        if self.session is not None:
+            agent = self.agents.get(agent_name)
+            if agent is None:
+                agent = self.agents[agent_name] = agent_cls(self.session, self.user)
+            return self._run(agent, agent_name, task_name, payload)
+        with session_scope(self.session_factory or get_session_factory()) as session:
+            user = session.get(User, self.user_id) if self.user_id is not None else None
+            if self.user_id is not None and user is None:
+                return {"agent": agent_name, "task": task_name, "error": f"Unknown user {self.user_id}"}
+            return self._run(agent_cls(session, user), agent_name, task_name, payload)
+
     def kickoff(self, inputs):
         """
         Convenience method: interpret inputs and call appropriate tasks.
@@ -37,12 +134,90 @@ class Crew:
          { "action": "add_transaction", "category":"Food", "amount":100 }
         """
         action = inputs.get("action")
-        if action in ("add_transaction", "monthly_summary", "expense_report", "monthly_savings"):
-            return self.run_task("expense", action, inputs)
-        if action in ("get_stock_prices", "fetch_price_dataframe", "get_news", "get_crypto_price"):
-            return self.run_task("market", action, inputs)
-        if action == "suggest_portfolio":
-            return self.run_task("investment", "suggest_portfolio", inputs)
-        if action in ("add_goal", "progress"):
-            return self.run_task("goal", action, inputs)
-        return {"error": "Unknown action for kickoff", "action": action}
+        agent_name = ACTION_AGENTS.get(action)
+        if not agent_name:
+            return {"error": "Unknown action for kickoff", "action": action}
+        return self.run_task(agent_name, action, inputs)
+
+    def profile_kickoff(self, inputs, top=30, use_pyinstrument=None):
+        """kickoff(inputs) under a profiler; the report text is returned as res["profile"]."""
+        with metrics.profile(top, use_pyinstrument) as captured:
+            res = self.kickoff(inputs)
+        return dict(res, profile=captured["report"], profiler=captured["profiler"])
+
+    def run_workflow(self, steps, max_workers=WORKFLOW_MAX_WORKERS):
+        """
+        Run several kickoff steps, concurrently where their dependencies allow.
+        steps: list of kickoff inputs, each optionally with
+          "id"         (defaults to the action; must be unique)
+          "depends_on" list of step ids that must finish first
+        A monthly_summary result is passed to its dependents as payload["summary"],
+        so expense_report / monthly_savings / progress reuse it instead of re-querying.
+        Returns {"results", "errors", "timings", "elapsed"}; a step whose dependency
+        failed is not run and reports that as its error.
+        """
+        specs = {}
+        for step in steps:
+            step_id = step.get("id") or step.get("action")
+            if step_id in specs:
+                return {"error": f"Duplicate workflow step {step_id}"}
+            specs[step_id] = step
+        for step_id, step in specs.items():
+            missing = [d for d in step.get("depends_on", []) if d not in specs]
+            if missing:
+                return {"error": f"Step {step_id} depends on unknown step(s) {', '.join(missing)}"}
+
+        results, errors, timings = {}, {}, {}
+        pending = dict(specs)
+        running = {}
+        # a shared session is not thread-safe, so legacy crews run the steps one at a time
+        workers = 1 if self.session is not None else max_workers
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while pending or running:
+                changed = True
+                while changed:
+                    # repeat so a failure propagates down a chain within one pass
+                    changed = False
+                    for step_id, step in list(pending.items()):
+                        deps = step.get("depends_on", [])
+                        failed = [d for d in deps if d in errors]
+                        if failed:
+                            errors[step_id] = f"dependency {failed[0]} failed"
+                        elif all(d in results for d in deps):
+                            payload = {k: v for k, v in step.items() if k not in ("id", "depends_on")}
+                            for d in deps:
+                                key = SHARED_RESULTS.get(specs[d].get("action"))
+                                if key and key not in payload:
+                                    payload[key] = results[d]
+                            running[pool.submit(self._timed_kickoff, payload)] = step_id
+                        else:
+                            continue
+                        del pending[step_id]
+                        changed = True
+                if not running:
+                    # nothing runnable and nothing in flight: the rest is a dependency cycle
+                    for step_id in pending:
+                        errors[step_id] = "dependency cycle"
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step_id = running.pop(future)
+                    try:
+                        res, timings[step_id] = future.result()
+                    except Exception as e:
+                        # raised outside _run's own handling (session setup, commit); its dependents are skipped
+                        metrics.inc("crew_task_errors_total", task=specs[step_id].get("action"))
+                        errors[step_id] = str(e) or type(e).__name__
+                        continue
+                    if "result" in res:
+                        results[step_id] = res["result"]
+                    else:
+                        errors[step_id] = res.get("error", "Unknown error")
+        return {"results": results, "errors": errors, "timings": timings,
+                "elapsed": time.perf_counter() - started}
+
+    def _timed_kickoff(self, payload):
+        t0 = time.perf_counter()
+        res = self.kickoff(payload)
+        return res, time.perf_counter() - t0
@@ -1,48 +1,163 @@
 # data_fetchers.py
-import yfinance as yf
-import requests
-import time
-from utils import ALPHA_VANTAGE_KEY, NEWSAPI_KEY
+# yfinance and the pandas-backed price store are imported on first use: crypto and news
+# callers (finance_tools, advisor) should not pay for them
+from concurrent.futures import ThreadPoolExecutor
+from http_client import get_http_client
+from utils import NEWSAPI_KEY, COINGECKO_API_URL, NEWSAPI_URL
+import metrics
 
-def fetch_stock_history(ticker, period="1y", interval="1d"):
+MAX_FETCH_WORKERS = 8
+CRYPTO_BATCH_SIZE = 100
+
+
+class YFinanceSource:
+    """Default price source. Any object with the same two methods can replace it."""
+
+    def history(self, ticker, period="1y", interval="1d", start=None):
+        import yfinance as yf
+        if start is not None:
+            return yf.Ticker(ticker).history(start=start, interval=interval)
+        return yf.Ticker(ticker).history(period=period, interval=interval)
+
+    def bulk_history(self, tickers, period="1y", interval="1d", start=None):
+        # a single yf.download round trip for the whole basket
+        import yfinance as yf
+        span = {"start": start} if start is not None else {"period": period}
+        data = yf.download(list(tickers), interval=interval, group_by="ticker",
+                           auto_adjust=True, progress=False, threads=True, **span)
+        out = {}
+        if data is None or data.empty:
+            return out
+        available = set(data.columns.get_level_values(0))
+        for t in tickers:
+            if t in available:
+                hist = data[t].dropna(how="all")
+                if not hist.empty:
+                    out[t] = hist
+        return out
+
+
+_source = YFinanceSource()
+
+def set_price_source(source):
+    """Swap the price source (e.g. for an offline stand-in). Returns the previous one."""
+    global _source
+    previous, _source = _source, source
+    return previous
+
+def get_price_source():
+    return _source
+
+def _download_one(ticker, period="1y", interval="1d", start=None):
     # yfinance is simple and doesn't need API key
+    metrics.inc("external_calls_total", service="yfinance", kind="history")
     try:
-        t = yf.Ticker(ticker)
-        hist = t.history(period=period, interval=interval)
-        return hist  # pandas DataFrame
+        with metrics.timer("external_call_seconds", service="yfinance", kind="history"):
+            return _source.history(ticker, period=period, interval=interval, start=start)
     except Exception as e:
+        metrics.inc("external_errors_total", service="yfinance")
         print("yfinance error", e)
         return None
 
-def fetch_current_price(ticker):
+def _download(tickers, period="1y", interval="1d", start=None, max_workers=MAX_FETCH_WORKERS):
+    """
+    Uncached fetch of many tickers: {ticker: DataFrame}.
+    Tries one bulk request first, then fetches whatever is still missing on a bounded
+    thread pool. A failing ticker is left out instead of failing the whole batch.
+    """
+    histories = {}
+    if len(tickers) > 1 and hasattr(_source, "bulk_history"):
+        metrics.inc("external_calls_total", service="yfinance", kind="bulk")
+        try:
+            with metrics.timer("external_call_seconds", service="yfinance", kind="bulk"):
+                histories = _source.bulk_history(tickers, period=period, interval=interval, start=start) or {}
+        except Exception as e:
+            metrics.inc("external_errors_total", service="yfinance")
+            print("yfinance bulk error", e)
+            histories = {}
+
+    missing = [t for t in tickers if t not in histories]
+    if missing:
+        workers = max(1, min(max_workers, len(missing)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            fetched = pool.map(lambda t: _download_one(t, period=period, interval=interval, start=start), missing)
+            for t, hist in zip(missing, fetched):
+                if hist is not None and not hist.empty:
+                    histories[t] = hist
+
+    out = {t: histories[t] for t in tickers if t in histories}
+    metrics.inc("bars_fetched_total", sum(len(h) for h in out.values()), service="yfinance")
+    metrics.inc("bytes_fetched_total", sum(int(h.memory_usage(deep=True).sum()) for h in out.values()),
+                service="yfinance")
+    return out
+
+@metrics.timed("fetch_stock_histories_seconds")
+def fetch_stock_histories(tickers, period="1y", interval="1d", max_workers=MAX_FETCH_WORKERS, max_age=None):
+    """
+    Fetch history for many tickers at once: {ticker: DataFrame}.
+    Goes through the local price store when one is configured, so only bars newer
+    than the cached ones are downloaded. max_age (seconds) overrides the store's ttl.
+    """
+    tickers = list(dict.fromkeys(tickers))
+    if not tickers:
+        return {}
+
+    def download(batch, period=period, interval=interval, start=None):
+        return _download(batch, period=period, interval=interval, start=start, max_workers=max_workers)
+
+    from price_store import get_price_store
+    store = get_price_store()
+    if store is None:
+        return download(tickers)
     try:
-        t = yf.Ticker(ticker)
-        data = t.history(period="1d")
-        if not data.empty:
-            return float(data["Close"].iloc[-1])
-        return None
+        return store.histories(tickers, period, interval, download, max_age=max_age)
     except Exception as e:
-        print("yfinance error", e)
-        return None
+        print("price store error", e)
+        return download(tickers)
+
+def fetch_stock_history(ticker, period="1y", interval="1d"):
+    return fetch_stock_histories([ticker], period=period, interval=interval).get(ticker)
+
+def latest_prices(histories):
+    """Spot prices taken from the last close of already downloaded histories."""
+    prices = {}
+    for t, hist in histories.items():
+        if hist is not None and not hist.empty:
+            prices[t] = float(hist["Close"].iloc[-1])
+    return prices
+
+def fetch_current_price(ticker):
+    data = fetch_stock_history(ticker, period="1d")
+    if data is not None and not data.empty:
+        return float(data["Close"].iloc[-1])
+    return None
+
+def fetch_current_prices(tickers, max_workers=MAX_FETCH_WORKERS):
+    return latest_prices(fetch_stock_histories(tickers, period="1d", max_workers=max_workers))
+
+def fetch_crypto_prices(coin_ids, vs_currency="usd"):
+    """Spot prices for many coins: {coin_id: price}. CoinGecko takes a list of ids per call."""
+    coin_ids = list(dict.fromkeys(coin_ids))
+    prices = {}
+    for i in range(0, len(coin_ids), CRYPTO_BATCH_SIZE):
+        batch = coin_ids[i:i + CRYPTO_BATCH_SIZE]
+        data = get_http_client().get_json(f"{COINGECKO_API_URL}/simple/price",
+                                          params={"ids": ",".join(batch), "vs_currencies": vs_currency},
+                                          default={})
+        for coin in batch:
+            price = data.get(coin, {}).get(vs_currency)
+            if price is not None:
+                prices[coin] = price
+    return prices
 
 def fetch_crypto_price(coin_id="bitcoin"):
     # uses coingecko public api (no key needed)
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies=usd"
-    r = requests.get(url)
-    if r.status_code == 200:
-        return r.json().get(coin_id, {}).get("usd")
-    return None
+    return fetch_crypto_prices([coin_id]).get(coin_id)
 
 def fetch_news(query, page_size=5):
     # optional: requires NEWSAPI_KEY
     if not NEWSAPI_KEY:
         return []
-    url = "https://newsapi.org/v2/everything"
     params = {"q": query, "pageSize": page_size, "apiKey": NEWSAPI_KEY, "language": "en"}
-    r = requests.get(url, params=params, timeout=10)
-    if r.status_code == 200:
-        data = r.json()
-        return data.get("articles", [])
-    else:
-        print("NewsAPI error", r.status_code, r.text)
-        return []
+    data = get_http_client().get_json(f"{NEWSAPI_URL}/everything", params=params, default={})
+    return data.get("articles", [])
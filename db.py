@@ -1,35 +1,19 @@
-import sqlite3
+import os
+from memory import get_session_factory
+from repository import migrate_legacy, LEGACY_DB
 
-DB_NAME = "finance.db"
+DB_NAME = LEGACY_DB  # old raw-sqlite store, read once by the migration
 
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+    # Unified schema (memory.py): transactions, investments, rollups, indexes
+    get_session_factory()
 
-    # Expenses Table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS expenses (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category TEXT NOT NULL,
-        amount REAL NOT NULL,
-        description TEXT,
-        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
+    # Copy any rows still sitting in the legacy finance.db
+    if os.path.exists(DB_NAME):
+        report = migrate_legacy(DB_NAME)
+        print(f"Migrated {report['expenses']} expenses and {report['investments']} investments "
+              f"from {DB_NAME} ({report['skipped']} already present)")
 
-    # Investments Table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS investments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        type TEXT NOT NULL,        -- stock/crypto/mutual fund
-        symbol TEXT NOT NULL,
-        amount REAL NOT NULL,
-        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    conn.commit()
-    conn.close()
     print("✅ Database initialized!")
 
 # Run this once for first setup
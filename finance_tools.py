@@ -1,58 +1,59 @@
-import sqlite3
-import requests
-import yfinance as yf
-from utils import ALPHA_VANTAGE_KEY, NEWSAPI_KEY
-
-DB_NAME = "finance.db"
+import threading
+from data_fetchers import fetch_crypto_price, fetch_current_price
+from http_client import get_http_client
+from memory import get_session_factory, session_scope, get_or_create_user
+import repository
+from utils import NEWSAPI_KEY, NEWSAPI_URL, DATABASE_URL
+
+# expenses and investments live in the unified store (see repository.py); finance.db is only
+# read by repository.migrate_legacy
+DB_URI = DATABASE_URL
+_user_ids = {}
+_user_lock = threading.Lock()
+
+def _scope():
+    return session_scope(get_session_factory(DB_URI))
+
+def _user_id(session):
+    # these helpers predate users; everything is filed under the legacy local user
+    if DB_URI not in _user_ids:
+        with _user_lock:
+            _user_ids[DB_URI] = get_or_create_user(session, name=repository.LEGACY_USER).id
+    return _user_ids[DB_URI]
 
 # ---------------- EXPENSE FUNCTIONS ----------------
 def add_expense(category, amount, description=""):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO expenses (category, amount, description) VALUES (?, ?, ?)", 
-                   (category, amount, description))
-    conn.commit()
-    conn.close()
-
-def get_expenses():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM expenses ORDER BY date DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    """
+    Store an expense; a blank category is picked from the description by the categorization rules.
+    Returns the anomaly verdict ({"flagged", "score", "reasons", ...}).
+    """
+    with _scope() as session:
+        _, verdict = repository.add_transaction(session, _user_id(session), category, float(amount), description)
+        return verdict
+
+def get_expenses(limit=None):
+    """Expenses newest first as (id, category, amount, description, date); limit bounds the query."""
+    with _scope() as session:
+        return repository.recent_expenses(session, _user_id(session), limit)
 
 # ---------------- INVESTMENT FUNCTIONS ----------------
 def add_investment(type, symbol, amount):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("INSERT INTO investments (type, symbol, amount) VALUES (?, ?, ?)", 
-                   (type, symbol, amount))
-    conn.commit()
-    conn.close()
-
-def get_investments():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM investments ORDER BY date DESC")
-    rows = cursor.fetchall()
-    conn.close()
-    return rows
+    with _scope() as session:
+        repository.add_investment(session, _user_id(session), type, symbol, float(amount))
+
+def get_investments(limit=None):
+    with _scope() as session:
+        return repository.recent_investments(session, _user_id(session), limit)
 
 # ---------------- MARKET DATA ----------------
 def get_stock_price(symbol):
-    stock = yf.Ticker(symbol)
-    data = stock.history(period="1d")
-    if not data.empty:
-        return data["Close"].iloc[-1]
-    return None
+    # through data_fetchers, so the price store, metrics and fixtures apply here too
+    return fetch_current_price(symbol)
 
 def get_crypto_price(symbol="bitcoin"):
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={symbol}&vs_currencies=usd"
-    response = requests.get(url).json()
-    return response[symbol]["usd"]
+    return fetch_crypto_price(symbol)
 
 def get_finance_news():
-    url = f"https://newsapi.org/v2/top-headlines?category=business&apiKey={NEWSAPI_KEY}"
-    response = requests.get(url).json()
-    return [article["title"] for article in response["articles"][:5]]
+    params = {"category": "business", "apiKey": NEWSAPI_KEY}
+    response = get_http_client().get_json(f"{NEWSAPI_URL}/top-headlines", params=params, default={})
+    return [article["title"] for article in response.get("articles", [])[:5]]
@@ -0,0 +1,367 @@
+# fixtures.py
+"""
+Offline market data for benchmarks and reproducible runs.
+
+record(directory) wraps the live price source and HTTP client so every history and
+JSON response the app fetches is also written to a fixture directory; replay(directory)
+serves them back with no network. A fixture directory holds:
+  prices/<ticker>__<interval>.parquet   OHLCV frames (the longest span requested)
+  http.json                              JSON responses keyed by URL + parameters (API keys stripped)
+
+The synthetic side generates the same shapes at any scale: price histories, CoinGecko /
+NewsAPI style responses, and users with transaction histories written straight to the DB.
+Run: python fixtures.py record DIR   (live)   |   python fixtures.py synthetic DIR
+"""
+
+import datetime
+import json
+import os
+import time
+import zlib
+from contextlib import contextmanager
+from urllib.parse import quote, unquote, urlencode, urlsplit
+import numpy as np
+import pandas as pd
+import data_fetchers
+import finance_tools
+import http_client
+import metrics
+import price_store
+from utils import period_to_days
+
+SECRET_PARAMS = {"apikey", "api_key", "key", "token"}
+
+# what exercise_fetchers() (and so a recorded fixture) covers; the scenario benchmarks use the same
+SCENARIO_TICKERS = ["AAPL", "MSFT", "GOOG", "AMZN", "NVDA", "JPM", "XOM", "JNJ", "PG", "KO"]
+SCENARIO_COINS = ["bitcoin", "ethereum", "solana"]
+SCENARIO_NEWS_QUERIES = ["finance", "stock market"]
+SCENARIO_PERIOD = "5y"
+
+
+def _price_file(directory, ticker, interval):
+    return os.path.join(directory, "prices", f"{quote(ticker, safe='')}__{interval}.parquet")
+
+
+def request_key(url, params=None):
+    """URL plus sorted parameters, without credentials, so recordings hold no secrets."""
+    params = sorted((k, str(v)) for k, v in (params or {}).items()
+                    if v is not None and k.lower() not in SECRET_PARAMS)
+    return f"{url}?{urlencode(params)}" if params else url
+
+
+def _slice(frame, period="1y", start=None):
+    if frame is None or frame.empty:
+        return frame
+    if start is not None:
+        start = pd.Timestamp(start)
+        if frame.index.tz is not None and start.tz is None:
+            start = start.tz_localize(frame.index.tz)
+        return frame[frame.index >= start]
+    days = period_to_days(period)
+    if days is None:
+        return frame
+    return frame[frame.index > frame.index[-1] - pd.Timedelta(days=days)]
+
+
+# ---------------- record ----------------
+class RecordingPriceSource:
+    """Passes calls to inner and keeps the union of every frame it returned, per (ticker, interval)."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.frames = {}
+
+    def _keep(self, ticker, interval, frame):
+        if frame is None or frame.empty:
+            return
+        previous = self.frames.get((ticker, interval))
+        if previous is not None:
+            frame = pd.concat([previous, frame])
+            frame = frame[~frame.index.duplicated(keep="last")].sort_index()
+        self.frames[(ticker, interval)] = frame
+
+    def history(self, ticker, period="1y", interval="1d", start=None):
+        frame = self.inner.history(ticker, period=period, interval=interval, start=start)
+        self._keep(ticker, interval, frame)
+        return frame
+
+    def bulk_history(self, tickers, period="1y", interval="1d", start=None):
+        if not hasattr(self.inner, "bulk_history"):
+            return {}
+        out = self.inner.bulk_history(tickers, period=period, interval=interval, start=start) or {}
+        for ticker, frame in out.items():
+            self._keep(ticker, interval, frame)
+        return out
+
+    def save(self, directory):
+        os.makedirs(os.path.join(directory, "prices"), exist_ok=True)
+        for (ticker, interval), frame in self.frames.items():
+            frame.to_parquet(_price_file(directory, ticker, interval))
+
+
+class RecordingHttpClient:
+    def __init__(self, inner):
+        self.inner = inner
+        self.responses = {}
+
+    def get_json(self, url, params=None, default=None, timeout=None):
+        data = self.inner.get_json(url, params=params, default=None, timeout=timeout)
+        if data is None:
+            return default
+        self.responses[request_key(url, params)] = data
+        return data
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "http.json")
+        recorded = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                recorded = json.load(f).get("responses", {})
+        recorded.update(self.responses)
+        with open(path, "w") as f:
+            json.dump({"recorded_at": datetime.datetime.utcnow().isoformat(timespec="seconds"),
+                       "responses": recorded}, f, indent=1, sort_keys=True)
+
+
+@contextmanager
+def _swapped(source, client):
+    # the price store is bypassed so every history call reaches the (recording / replaying) source
+    previous_source = data_fetchers.set_price_source(source)
+    previous_client = http_client.set_http_client(client)
+    previous_store = price_store.set_price_store(None)
+    try:
+        yield
+    finally:
+        data_fetchers.set_price_source(previous_source)
+        http_client.set_http_client(previous_client)
+        price_store.set_price_store(previous_store)
+
+
+@contextmanager
+def record(directory, price_source=None, client=None):
+    """Record everything fetched inside the block (from the live sources unless others are given)."""
+    source = RecordingPriceSource(price_source or data_fetchers.get_price_source())
+    recorder = RecordingHttpClient(client or http_client.get_http_client())
+    with _swapped(source, recorder):
+        yield source, recorder
+    source.save(directory)
+    recorder.save(directory)
+
+
+# ---------------- replay ----------------
+class ReplayPriceSource:
+    """Serves recorded frames, cut to the requested period or start; unknown tickers return nothing."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.frames = {}
+        self.misses = []
+
+    def _frame(self, ticker, interval):
+        key = (ticker, interval)
+        if key not in self.frames:
+            path = _price_file(self.directory, ticker, interval)
+            self.frames[key] = pd.read_parquet(path) if os.path.exists(path) else None
+            if self.frames[key] is None:
+                self.misses.append(key)
+        return self.frames[key]
+
+    def history(self, ticker, period="1y", interval="1d", start=None):
+        frame = _slice(self._frame(ticker, interval), period, start)
+        return frame.copy() if frame is not None else pd.DataFrame()
+
+    def bulk_history(self, tickers, period="1y", interval="1d", start=None):
+        out = {}
+        for ticker in tickers:
+            frame = self.history(ticker, period, interval, start)
+            if not frame.empty:
+                out[ticker] = frame
+        return out
+
+    def tickers(self, interval="1d"):
+        suffix = f"__{interval}.parquet"
+        names = os.listdir(os.path.join(self.directory, "prices")) if os.path.isdir(
+            os.path.join(self.directory, "prices")) else []
+        return sorted(unquote(n[:-len(suffix)]) for n in names if n.endswith(suffix))
+
+
+class ReplayHttpClient:
+    """get_json from http.json; an unrecorded request is recorded in misses and returns default, like a failed call."""
+
+    def __init__(self, directory):
+        path = os.path.join(directory, "http.json")
+        self.responses = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.responses = json.load(f).get("responses", {})
+        self.misses = []
+
+    def get_json(self, url, params=None, default=None, timeout=None):
+        key = request_key(url, params)
+        if key not in self.responses:
+            self.misses.append(key)
+            metrics.inc("fixture_misses_total")
+            return default
+        return json.loads(json.dumps(self.responses[key]))  # a fresh copy per call, like a real response
+
+
+@contextmanager
+def replay(directory):
+    """Serve market data and HTTP JSON from a fixture directory inside the block."""
+    source, client = ReplayPriceSource(directory), ReplayHttpClient(directory)
+    with _swapped(source, client):
+        yield source, client
+
+
+# ---------------- synthetic data ----------------
+class SyntheticPriceSource:
+    """Local stand-in for YFinanceSource that fakes a network round trip with a sleep."""
+
+    def __init__(self, latency=0.05, days=520, seed=0):
+        self.latency = latency
+        self.days = days
+        self.seed = seed
+        self.calls = 0
+        self.bars = 0
+
+    def _frame(self, ticker):
+        rng = np.random.default_rng([zlib.crc32(ticker.encode()), self.seed])
+        index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=self.days)
+        close = 100 * np.exp(np.cumsum(rng.normal(0.0004, 0.015, self.days)))
+        return pd.DataFrame({
+            "Open": close, "High": close * 1.01, "Low": close * 0.99,
+            "Close": close, "Volume": rng.integers(1e5, 1e6, self.days)
+        }, index=index)
+
+    def _span(self, ticker, period="1y", start=None):
+        frame = _slice(self._frame(ticker), period or "max", start)
+        self.bars += len(frame)
+        return frame
+
+    def history(self, ticker, period="1y", interval="1d", start=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return self._span(ticker, period, start)
+
+    def bulk_history(self, tickers, period="1y", interval="1d", start=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {t: self._span(t, period, start) for t in tickers}
+
+
+def synthetic_response(path, query):
+    """CoinGecko / NewsAPI shaped JSON for a request path and its query parameters (None if unknown)."""
+    if path.endswith("/simple/price"):
+        currency = query.get("vs_currencies", "usd")
+        return {coin: {currency: float(zlib.crc32(coin.encode()) % 100000) / 10}
+                for coin in query.get("ids", "").split(",") if coin}
+    if path.endswith("/everything") or path.endswith("/top-headlines"):
+        size = int(query.get("pageSize", 5))
+        return {"status": "ok", "articles": [
+            {"title": f"{query.get('q', 'Business')} headline {i}", "url": f"http://stub/{i}"}
+            for i in range(size)]}
+    return None
+
+
+class SyntheticHttpClient:
+    """get_json answered by synthetic_response, no sockets."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests_made = 0
+
+    def get_json(self, url, params=None, default=None, timeout=None):
+        self.requests_made += 1
+        time.sleep(self.latency)
+        body = synthetic_response(urlsplit(url).path, {k: str(v) for k, v in (params or {}).items()})
+        return default if body is None else body
+
+
+def synthetic_prices(n_assets, n_days=504, seed=0):
+    """Factor-model price paths: a few shared drivers so covariances look like equities."""
+    rng = np.random.default_rng(seed)
+    factors = rng.normal(0, 0.01, (n_days, 3))
+    loadings = rng.normal(0.5, 0.3, (3, n_assets))
+    returns = factors @ loadings + rng.normal(0.0003, 0.012, (n_days, n_assets))
+    index = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_days)
+    return pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=index,
+                        columns=[f"A{i:03d}" for i in range(n_assets)])
+
+
+CATEGORIES = ["Groceries", "Rent", "Transport", "Dining", "Utilities", "Shopping", "Health", "Entertainment"]
+# (gamma shape, scale) of amounts per category, so reports and anomaly stats look plausible
+CATEGORY_AMOUNTS = {"Rent": (50.0, 400.0), "Utilities": (8.0, 15.0), "Groceries": (3.0, 25.0)}
+
+
+def generate_users(session, n_users=1, transactions_per_user=10_000, months=12, seed=0, chunk_size=50_000):
+    """
+    Bulk insert n_users users with transactions_per_user expenses spread over the last
+    months months, then rebuild the month rollup and category stats. Returns the user ids.
+    """
+    from anomaly import rebuild_category_stats
+    from memory import User, Transaction, rebuild_month_rollup
+
+    rng = np.random.default_rng(seed)
+    users = [User(name=f"synthetic_user_{i}", income=float(rng.integers(3, 15) * 1000),
+                  risk_tolerance=("low", "medium", "high")[i % 3], goals="[]") for i in range(n_users)]
+    session.add_all(users)
+    session.commit()
+    end = datetime.datetime.utcnow()
+    span = months * 30 * 86400
+    for user in users:
+        for lo in range(0, transactions_per_user, chunk_size):
+            n = min(chunk_size, transactions_per_user - lo)
+            cats = rng.integers(0, len(CATEGORIES), n)
+            offsets = np.sort(rng.integers(0, span, n))[::-1]
+            rows = []
+            for c, offset in zip(cats, offsets):
+                category = CATEGORIES[c]
+                shape, scale = CATEGORY_AMOUNTS.get(category, (2.0, 20.0))
+                rows.append({"user_id": user.id, "category": category, "amount": round(float(rng.gamma(shape, scale)), 2),
+                             "timestamp": end - datetime.timedelta(seconds=int(offset)),
+                             "description": f"{category.lower()} #{lo + len(rows)}"})
+            session.connection().execute(Transaction.__table__.insert(), rows)
+        session.commit()
+    rebuild_month_rollup(session)
+    rebuild_category_stats(session)
+    return [u.id for u in users]
+
+
+# ---------------- scenario ----------------
+def exercise_fetchers(tickers=SCENARIO_TICKERS, coins=SCENARIO_COINS, queries=SCENARIO_NEWS_QUERIES,
+                      period=SCENARIO_PERIOD):
+    """Call every data_fetchers / finance_tools fetcher once with the scenario inputs (what record captures)."""
+    data_fetchers.fetch_stock_histories(tickers, period=period)
+    data_fetchers.fetch_stock_history(tickers[0], period=period)
+    data_fetchers.fetch_current_prices(tickers)
+    data_fetchers.fetch_current_price(tickers[0])
+    data_fetchers.fetch_crypto_prices(coins)
+    for coin in coins:
+        data_fetchers.fetch_crypto_price(coin)
+        finance_tools.get_crypto_price(coin)
+    for query in queries:
+        data_fetchers.fetch_news(query)
+    finance_tools.get_stock_price(tickers[0])
+    finance_tools.get_finance_news()
+
+
+def write_synthetic_fixtures(directory, days=1260, seed=0):
+    """A fixture directory for the scenario inputs, recorded from the synthetic sources."""
+    with record(directory, SyntheticPriceSource(latency=0, days=days, seed=seed), SyntheticHttpClient()):
+        exercise_fetchers()
+    return directory
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3 or sys.argv[1] not in ("record", "synthetic"):
+        print("usage: python fixtures.py record|synthetic DIR")
+        sys.exit(1)
+    if sys.argv[1] == "record":
+        with record(sys.argv[2]):
+            exercise_fetchers()
+    else:
+        write_synthetic_fixtures(sys.argv[2])
+    print(f"fixtures written to {sys.argv[2]}")
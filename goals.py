@@ -0,0 +1,198 @@
+# goals.py
+"""
+Goal projection engine used by GoalAgent.progress.
+All of a user's goals are projected at once with NumPy: the month's savings are
+deposited at each month end and compound at an optional annual return.
+project_many does the same for many users in one pass (batch_reports.py).
+Projections are memoised on (user, goals, this month's spending, income, return),
+so repeated dashboard renders skip the work until one of those changes.
+"""
+
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from utils import GOAL_ANNUAL_RETURN
+import metrics
+
+PROJECTION_CACHE_SIZE = 1024
+MAX_CUT_PER_CATEGORY = 0.2  # suggest cutting up to 20% of a category
+
+
+@lru_cache(maxsize=4096)
+def deadline_month(deadline):
+    """(year, month) of a deadline string, parsed once per distinct value. None if invalid."""
+    try:
+        d = datetime.date.fromisoformat(str(deadline)[:10])
+        return d.year, d.month
+    except ValueError:
+        pass
+    try:
+        ts = pd.to_datetime(deadline)
+    except Exception:
+        return None
+    if pd.isna(ts):
+        return None
+    return ts.year, ts.month
+
+
+def months_until(deadline, today=None):
+    today = today or datetime.datetime.utcnow()
+    ym = deadline_month(deadline)
+    if ym is None:
+        return 0
+    return max((ym[0] - today.year) * 12 + (ym[1] - today.month), 0)
+
+
+def monthly_rate(annual_return):
+    return (1 + annual_return) ** (1 / 12) - 1 if annual_return else 0.0
+
+
+def balance_after(savings, rate, months):
+    """Balance after `months` end-of-month deposits of `savings` compounding at `rate` per month."""
+    months = np.asarray(months, dtype=float)
+    if rate == 0:
+        return savings * months
+    return savings * np.expm1(months * np.log1p(rate)) / rate
+
+
+def months_to_reach(targets, savings, rate):
+    """Months of deposits needed to reach each target (fractional); inf where nothing is saved."""
+    targets = np.asarray(targets, dtype=float)
+    savings = np.broadcast_to(np.asarray(savings, dtype=float), targets.shape)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if rate == 0:
+            out = targets / savings
+        else:
+            out = np.log1p(targets * rate / savings) / np.log1p(rate)
+    return np.where(savings > 0, out, np.inf)
+
+
+def required_savings(targets, months, rate):
+    """Monthly deposit that reaches each target in the given months; inf where months is 0."""
+    targets = np.asarray(targets, dtype=float)
+    months = np.asarray(months, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if rate == 0:
+            out = targets / months
+        else:
+            out = targets * rate / np.expm1(months * np.log1p(rate))
+    return np.where(months > 0, out, np.inf)
+
+
+def _suggestions(extra_needed, expense_summary):
+    # cut from the biggest categories first
+    suggestions = []
+    for cat, amt in sorted(expense_summary.items(), key=lambda x: x[1], reverse=True):
+        if extra_needed <= 0:
+            break
+        cut = min(amt * MAX_CUT_PER_CATEGORY, extra_needed)
+        if cut > 0:
+            suggestions.append(f"Reduce {cat} expenses by ₹{cut:.2f}")
+            extra_needed -= cut
+    if extra_needed > 0:
+        suggestions.append(f"Still need extra savings of ₹{extra_needed:.2f} or extend the deadline.")
+    return suggestions
+
+
+def project_goals(goals, expense_summary, income, annual_return=0.0, today=None):
+    """
+    Project every goal against this month's savings (income minus spending).
+    Adds monthly_savings, months_to_goal, achievable, projected_at_deadline,
+    required_monthly_savings and, for goals that miss their deadline, suggestions.
+    """
+    savings = max(0, (income or 0) - sum(expense_summary.values()))
+    return project_many([goals], [savings], [expense_summary], annual_return, today)[0]
+
+
+def project_many(user_goals, savings, expense_summaries, annual_return=0.0, today=None):
+    """
+    project_goals for many users at once: user_goals[i] against savings[i], with suggestions
+    cut from expense_summaries[i]. Every goal of every user is projected in one NumPy pass.
+    """
+    rate = monthly_rate(annual_return)
+    owner = np.repeat(np.arange(len(user_goals)), [len(g or []) for g in user_goals])
+    flat = [g for goals in user_goals for g in goals or []]
+    out = [[] for _ in user_goals]
+    if not flat:
+        return out
+    targets = np.array([float(g.get("target", 0)) for g in flat])
+    months_left = np.array([months_until(g.get("deadline"), today) for g in flat])
+    goal_savings = np.asarray(savings, dtype=float)[owner]
+
+    needed = months_to_reach(targets, goal_savings, rate)
+    achievable = np.isfinite(needed) & (needed <= months_left)
+    projected = balance_after(goal_savings, rate, months_left)
+    required = required_savings(targets, months_left, rate)
+
+    for i, g in enumerate(flat):
+        u = owner[i]
+        g = dict(g)
+        g["monthly_savings"] = savings[u]
+        g["months_to_goal"] = round(float(needed[i]), 1) if np.isfinite(needed[i]) else None
+        g["achievable"] = bool(achievable[i])
+        g["annual_return"] = annual_return
+        g["projected_at_deadline"] = round(float(projected[i]), 2)
+        g["required_monthly_savings"] = round(float(required[i]), 2) if np.isfinite(required[i]) else None
+        if not g["achievable"]:
+            if months_left[i] > 0:
+                g["suggestions"] = _suggestions(required[i] - savings[u], expense_summaries[u])
+            else:
+                g["suggestions"] = ["Deadline already passed or invalid."]
+        out[u].append(g)
+    return out
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {"hits": 0, "misses": 0}
+
+
+def cached_projection(user_id, goals_json, expense_summary, income, annual_return=None, today=None):
+    """
+    project_goals memoised per user. goals_json is the raw User.goals value; it is only
+    parsed on a miss. Returns a copy so callers can mutate the result freely.
+    """
+    if annual_return is None:
+        annual_return = GOAL_ANNUAL_RETURN
+    today = today or datetime.datetime.utcnow()
+    if not isinstance(goals_json, str):
+        goals_json = json.dumps(goals_json or [])
+    key = (user_id, hashlib.sha1(goals_json.encode()).hexdigest(), tuple(sorted(expense_summary.items())),
+           float(income or 0), float(annual_return), (today.year, today.month))
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+            _cache_stats["hits"] += 1
+            metrics.cache_access("goal_projection", True)
+            return _copy(result)
+        _cache_stats["misses"] += 1
+    metrics.cache_access("goal_projection", False)
+
+    result = project_goals(json.loads(goals_json) if goals_json else [], expense_summary, income,
+                           annual_return, today)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > PROJECTION_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return _copy(result)
+
+
+def _copy(result):
+    return [dict(g, suggestions=list(g["suggestions"])) if "suggestions" in g else dict(g) for g in result]
+
+
+def cache_info():
+    with _cache_lock:
+        return dict(_cache_stats, size=len(_cache))
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+        _cache_stats.update(hits=0, misses=0)
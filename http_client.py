@@ -0,0 +1,116 @@
+# http_client.py
+"""
+Shared HTTP layer for the JSON APIs (CoinGecko, NewsAPI).
+One pooled keep-alive session per process, default timeouts, retries with
+bounded exponential backoff, and a per-host minimum spacing between requests so
+free-tier rate limits are not tripped. A 429 that outlasts the retries parks the
+host for its Retry-After, capped at MAX_RETRY_AFTER, instead of each retry sleeping it.
+requests is imported when the first client is built, not when this module is.
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+from utils import HTTP_TIMEOUT
+import metrics
+
+# minimum seconds between requests per host (CoinGecko's public API allows ~30/min)
+RATE_LIMITS = {"api.coingecko.com": 2.0}
+MAX_BACKOFF = 4.0  # seconds slept before any one retry
+MAX_RETRY_AFTER = 60.0  # longest a Retry-After keeps callers off a host
+
+
+class HttpClient:
+    def __init__(self, timeout=HTTP_TIMEOUT, retries=3, backoff=0.5, pool_size=10, rate_limits=None):
+        self.timeout = timeout
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        self.session = requests.Session()
+        # Retry-After is left to _back_off: urllib3 would sleep the full upstream value before every retry
+        retry = Retry(total=retries, backoff_factor=backoff, backoff_max=MAX_BACKOFF,
+                      status_forcelist=(429, 500, 502, 503, 504), allowed_methods=("GET",),
+                      respect_retry_after_header=False, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self._next_slot = {}   # host -> earliest time the next request may start
+        self.requests_made = 0
+
+    def _wait_turn(self, host):
+        interval = self.rate_limits.get(host)
+        if not interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = start + interval
+        if start > now:
+            time.sleep(start - now)
+
+    def _back_off(self, host, response):
+        # still rate limited after retries: keep every caller off this host for Retry-After seconds
+        try:
+            delay = float(response.headers.get("Retry-After", 0))
+        except ValueError:
+            delay = 0
+        delay = min(delay, MAX_RETRY_AFTER)
+        if delay > 0:
+            with self._lock:
+                self._next_slot[host] = max(self._next_slot.get(host, 0), time.monotonic() + delay)
+
+    def get(self, url, params=None, timeout=None):
+        host = urlsplit(url).hostname
+        self._wait_turn(host)
+        metrics.inc("external_calls_total", service=host, kind="http")
+        with metrics.timer("external_call_seconds", service=host, kind="http"):
+            response = self.session.get(url, params=params, timeout=timeout or self.timeout)
+        self.requests_made += 1
+        metrics.inc("bytes_fetched_total", len(response.content), service=host)
+        if response.status_code >= 400:
+            metrics.inc("external_errors_total", service=host)
+        if response.status_code == 429:
+            self._back_off(host, response)
+        return response
+
+    def get_json(self, url, params=None, default=None, timeout=None):
+        """GET and decode JSON; logs and returns default on any network or HTTP error."""
+        import requests
+        try:
+            r = self.get(url, params=params, timeout=timeout)
+        except requests.RequestException as e:
+            print("HTTP error", url, e)
+            return default
+        if r.status_code != 200:
+            print("HTTP error", r.status_code, url, r.text[:200])
+            return default
+        try:
+            return r.json()
+        except ValueError:
+            print("HTTP error: invalid JSON from", url)
+            return default
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = HttpClient()
+    return _client
+
+
+def set_http_client(client):
+    """Swap the process-wide client (e.g. one without rate limits for a stub server). Returns the previous one."""
+    global _client
+    previous, _client = _client, client
+    return previous
@@ -0,0 +1,269 @@
+# importer.py
+"""
+Streaming bank statement import (CSV, OFX, QIF) into memory.Transaction.
+Rows are read lazily, normalized, de-duplicated and written with one bulk insert
+per chunk, so memory stays flat regardless of file size.
+"""
+
+import csv
+import datetime
+import hashlib
+import io
+import re
+import time
+from itertools import islice
+from memory import Transaction, bump_month_rollups, bump_data_version, month_key
+import anomaly
+import categorize
+
+DEFAULT_CHUNK_SIZE = 5000
+MAX_ERRORS_PER_CHUNK = 20
+
+CSV_COLUMNS = {
+    "date": ("date", "transaction date", "posted date", "posting date", "timestamp"),
+    "amount": ("amount", "value", "debit", "withdrawal"),
+    "description": ("description", "memo", "payee", "narration", "details", "name"),
+    "category": ("category",),
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y", "%m/%d/%y", "%Y%m%d")
+
+_spaces = re.compile(r"\s+")
+_ofx_tag = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+
+def normalize_category(raw, category_map=None, known=None):
+    """
+    category_map applied by lowercase name, then categorize.canonical so "food ", "Food" and
+    "FOOD" aggregate together; known ({casefolded: spelling}) is updated with the result.
+    """
+    category = _spaces.sub(" ", (raw or "").strip())
+    if category_map:
+        category = category_map.get(category.lower(), category)
+    category = categorize.canonical(category, known)
+    if known is not None:
+        known.setdefault(category.casefold(), category)
+    return category
+
+
+def parse_amount(raw):
+    text = str(raw).strip()
+    negative = text.startswith("(") and text.endswith(")")
+    value = float(re.sub(r"[^\d.\-]", "", text))
+    return -value if negative else value
+
+
+def parse_date(raw, date_format=None):
+    text = str(raw).strip()
+    if date_format:
+        return datetime.datetime.strptime(text, date_format)
+    if re.fullmatch(r"\d{14}.*", text):  # OFX: 20240131120000[-5:EST]
+        return datetime.datetime.strptime(text[:14], "%Y%m%d%H%M%S")
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        pass
+    text = text.replace("'", "/")  # QIF: 1/31'24
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+    raise ValueError(f"unrecognised date {raw!r}")
+
+
+def fingerprint(date, amount, description):
+    desc = hashlib.sha1(_spaces.sub(" ", (description or "").strip().lower()).encode()).hexdigest()
+    return hashlib.sha1(f"{date.date().isoformat()}|{amount:.2f}|{desc}".encode()).hexdigest()[:24]
+
+
+# ---------------- readers: yield (line_no, raw dict) ----------------
+def read_csv(f):
+    reader = csv.DictReader(f)
+    header = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+    columns = {}
+    for key, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                columns[key] = header[alias]
+                break
+    missing = {"date", "amount"} - set(columns)
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(sorted(missing))}")
+    for row in reader:
+        yield reader.line_num, {key: row.get(name) for key, name in columns.items()}
+
+
+def read_ofx(f):
+    record, line_no = None, 0
+    for line_no, line in enumerate(f, 1):
+        for closing, tag, value in _ofx_tag.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if closing and record is not None:
+                    yield line_no, record
+                    record = None
+                elif not closing:
+                    record = {}
+            elif record is not None and not closing and value.strip():
+                if tag == "DTPOSTED":
+                    record["date"] = value
+                elif tag == "TRNAMT":
+                    record["amount"] = value
+                elif tag in ("NAME", "MEMO"):
+                    record["description"] = " ".join(filter(None, [record.get("description"), value.strip()]))
+
+
+def read_qif(f):
+    record = {}
+    for line_no, line in enumerate(f, 1):
+        line = line.rstrip("\r\n")
+        if not line or line.startswith("!"):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == "^":
+            if record:
+                yield line_no, record
+            record = {}
+        elif code == "D":
+            record["date"] = value
+        elif code in ("T", "U"):
+            record["amount"] = value
+        elif code in ("P", "M"):
+            record["description"] = " ".join(filter(None, [record.get("description"), value]))
+        elif code == "L":
+            record["category"] = value.split(":")[0]
+
+
+READERS = {"csv": read_csv, "ofx": read_ofx, "qfx": read_ofx, "qif": read_qif}
+# bank exports (OFX/QIF) sign debits negative; plain CSV expense lists usually don't
+DEBITS_NEGATIVE = {"csv": False, "ofx": True, "qfx": True, "qif": True}
+
+
+def _open(source):
+    if isinstance(source, str):
+        return open(source, newline="", encoding="utf-8-sig"), True
+    if isinstance(source, io.TextIOBase):
+        return source, False
+    # binary file-like (e.g. a Streamlit upload)
+    return io.TextIOWrapper(source, encoding="utf-8-sig", newline=""), False
+
+
+def _detect_format(source, fmt):
+    if fmt:
+        return fmt.lower()
+    name = source if isinstance(source, str) else getattr(source, "name", "")
+    ext = name.rsplit(".", 1)[-1].lower() if "." in name else "csv"
+    return ext if ext in READERS else "csv"
+
+
+# ---------------- import ----------------
+def write_rows(session, user_id, rows):
+    """
+    Insert the rows (Transaction column dicts with a fingerprint) not already stored for the
+    user, scoring them for anomalies, and update the month rollup and category stats in one
+    commit. Used by imports and the legacy migration. Returns the inserted count.
+    """
+    fps = {r["fingerprint"] for r in rows}
+    existing = {fp for (fp,) in session.query(Transaction.fingerprint).filter(
+        Transaction.user_id == user_id, Transaction.fingerprint.in_(fps))}
+    fresh = []
+    for r in rows:
+        if r["fingerprint"] not in existing:
+            existing.add(r["fingerprint"])
+            fresh.append(r)
+    if fresh:
+        bump_data_version(session, user_id)  # first write: holds the lock while stats are read and updated
+        anomaly.observe_many(session, user_id, fresh)
+        # plain executemany on the table, no ORM unit of work per row
+        session.connection().execute(Transaction.__table__.insert(), fresh)
+        totals = {}
+        for r in fresh:
+            key = (month_key(r["timestamp"]), r["category"])
+            total, count = totals.get(key, (0.0, 0))
+            totals[key] = (total + r["amount"], count + 1)
+        bump_month_rollups(session, user_id, totals)
+    session.commit()
+    return len(fresh)
+
+
+def import_transactions(session, user, source, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                        category_map=None, debits_negative=None, date_format=None):
+    """
+    Stream a statement file into the transactions table.
+    source is a path or a file object. Each chunk of chunk_size rows is normalized,
+    de-duplicated on (date, amount, description) and bulk inserted in its own commit,
+    so a bad chunk does not undo the ones before it.
+    Returns counts, per-chunk errors and throughput.
+    """
+    fmt = _detect_format(source, fmt)
+    if fmt not in READERS:
+        raise ValueError(f"Unsupported import format {fmt}")
+    if debits_negative is None:
+        debits_negative = DEBITS_NEGATIVE[fmt]
+    category_map = {k.lower(): v for k, v in (category_map or {}).items()}
+    categorizer = categorize.for_user(session, user.id)  # rows without a category are categorized by description
+    known = categorize.known_categories(session, user.id)
+
+    report = {"format": fmt, "rows_read": 0, "inserted": 0, "duplicates": 0, "skipped": 0, "flagged": 0,
+              "chunks": 0, "errors": []}
+    started = time.perf_counter()
+    f, owned = _open(source)
+    try:
+        records = READERS[fmt](f)
+        while True:
+            batch = list(islice(records, chunk_size))
+            if not batch:
+                break
+            chunk = report["chunks"]
+            report["chunks"] += 1
+            report["rows_read"] += len(batch)
+
+            rows, errors = [], 0
+            for line_no, raw in batch:
+                try:
+                    amount = parse_amount(raw.get("amount"))
+                    if debits_negative:
+                        amount = -amount
+                    if amount <= 0:
+                        # credits/deposits are not expenses
+                        report["skipped"] += 1
+                        continue
+                    ts = parse_date(raw.get("date"), date_format)
+                    description = (raw.get("description") or "").strip()
+                    category = (raw.get("category") or "").strip()
+                    rows.append({
+                        "user_id": user.id,
+                        "category": normalize_category(category, category_map, known) if category or not description
+                        else categorizer.categorize(description, amount),
+                        "amount": amount,
+                        "timestamp": ts,
+                        "description": description,
+                        "fingerprint": fingerprint(ts, amount, description),
+                    })
+                except Exception as e:
+                    errors += 1
+                    if errors <= MAX_ERRORS_PER_CHUNK:
+                        report["errors"].append({"chunk": chunk, "line": line_no, "error": str(e)})
+            if errors > MAX_ERRORS_PER_CHUNK:
+                report["errors"].append({"chunk": chunk, "line": None,
+                                         "error": f"{errors - MAX_ERRORS_PER_CHUNK} more row errors"})
+            if not rows:
+                continue
+            try:
+                inserted = write_rows(session, user.id, rows)
+            except Exception as e:
+                session.rollback()
+                report["errors"].append({"chunk": chunk, "line": None, "error": f"chunk not written: {e}"})
+                continue
+            report["inserted"] += inserted
+            report["duplicates"] += len(rows) - inserted
+            report["flagged"] += sum(1 for r in rows if r.get("anomaly_score") is not None)
+    finally:
+        if owned:
+            f.close()
+
+    elapsed = time.perf_counter() - started
+    report["seconds"] = round(elapsed, 3)
+    report["rows_per_second"] = round(report["rows_read"] / elapsed, 1) if elapsed > 0 else None
+    return report
@@ -0,0 +1,277 @@
+# ledger.py
+"""
+Holdings ledger: a trade log, one average-cost Position per (user, symbol) and a daily
+NavPoint per user.
+Nothing is revalued from scratch. A trade touches its own position; a price tick touches
+only the positions holding the ticked symbols, with one bulk UPDATE. Either way the user's
+NavPoint for the day moves by the resulting deltas, so the book's value, cost and P&L are
+read from one row. NAV is a unit value starting at NAV_BASE: cash put in buys units at the
+current NAV, so the series charts returns rather than deposits.
+Writers take the user-row write lock (memory.lock_users) before reading what they update,
+so concurrent trades and price ticks queue instead of overwriting each other.
+Holdings imported from the old Portfolio.holdings blob carry no cost; their first price is
+booked as money put in at that price. revalue() recomputes everything from the positions
+if the incremental totals ever need resetting.
+"""
+
+import datetime
+import json
+from sqlalchemy import select, update, func, and_, bindparam
+from memory import Position, Trade, NavPoint, Portfolio, lock_users
+import metrics
+
+NAV_BASE = 100.0
+QUANTITY_EPSILON = 1e-9
+
+
+def day_key(ts):
+    return ts.strftime("%Y-%m-%d")
+
+
+def _nav_rows(session, user_ids, day):
+    """{user_id: NavPoint for day}, new rows carrying forward each user's latest earlier point."""
+    rows = {r.user_id: r for r in session.query(NavPoint).populate_existing().filter(
+        NavPoint.user_id.in_(user_ids), NavPoint.day == day)}
+    missing = [u for u in user_ids if u not in rows]
+    if missing:
+        latest = (select(NavPoint.user_id, func.max(NavPoint.day).label("day"))
+                  .where(NavPoint.user_id.in_(missing), NavPoint.day < day)
+                  .group_by(NavPoint.user_id).subquery())
+        previous = {r.user_id: r for r in session.query(NavPoint).join(
+            latest, and_(NavPoint.user_id == latest.c.user_id, NavPoint.day == latest.c.day))}
+        for u in missing:
+            p = previous.get(u)
+            row = NavPoint(user_id=u, day=day, market_value=p.market_value if p else 0.0,
+                           cost_basis=p.cost_basis if p else 0.0, realized_pnl=p.realized_pnl if p else 0.0,
+                           net_flow=0.0, units=p.units if p else 0.0, nav=p.nav if p else NAV_BASE)
+            session.add(row)
+            rows[u] = row
+    return rows
+
+
+def _reprice(nav, delta):
+    """Market moves: value changes, units do not."""
+    nav.market_value += delta
+    if nav.units > QUANTITY_EPSILON:
+        nav.nav = nav.market_value / nav.units
+
+
+def _flow(nav, value, cash):
+    """cash put in (+) or taken out (-) buys or sells units at the current NAV; value is what it bought."""
+    price = nav.nav if nav.units > QUANTITY_EPSILON and nav.nav else NAV_BASE
+    nav.units = max(nav.units + cash / price, 0.0)
+    nav.net_flow += cash
+    nav.market_value += value
+    if nav.units > QUANTITY_EPSILON:
+        nav.nav = nav.market_value / nav.units
+
+
+# ---------------- writes ----------------
+def record_trade(session, user_id, symbol, quantity, price, fees=0.0, timestamp=None):
+    """
+    Book a trade (quantity < 0 sells) at price and update the position and the day's NAV point.
+    Returns the Trade. Raises ValueError on a zero quantity, a non-positive price or an oversell.
+    Does not commit.
+    """
+    symbol, quantity, price, fees = str(symbol).strip().upper(), float(quantity), float(price), float(fees or 0.0)
+    if not symbol or abs(quantity) < QUANTITY_EPSILON:
+        raise ValueError("Trade needs a symbol and a non-zero quantity")
+    if price <= 0:
+        raise ValueError(f"Invalid price {price} for {symbol}")
+    timestamp = timestamp or datetime.datetime.utcnow()
+    lock_users(session, [user_id])
+    with session.no_autoflush:
+        pos = session.query(Position).populate_existing().filter_by(user_id=user_id, symbol=symbol).first()
+    held = (pos.quantity or 0.0) if pos is not None else 0.0
+    if -quantity > held + QUANTITY_EPSILON:
+        raise ValueError(f"Cannot sell {-quantity:g} {symbol}: {held:g} held")
+    if pos is None:
+        pos = Position(user_id=user_id, symbol=symbol, quantity=0.0, cost_basis=0.0, realized_pnl=0.0,
+                       market_value=0.0)
+        session.add(pos)
+    nav = _nav_rows(session, [user_id], day_key(timestamp))[user_id]
+
+    booked_cost = pos.cost_basis or 0.0
+    if pos.last_price is None and held > QUANTITY_EPSILON:
+        # an imported holding seen for the first time: it enters the book at this price
+        _flow(nav, held * price, held * price)
+        pos.cost_basis, booked_cost = held * price, 0.0
+    else:
+        _reprice(nav, held * price - (pos.market_value or 0.0))
+    cost = pos.cost_basis or 0.0
+
+    realized = 0.0
+    if quantity > 0:
+        cost += quantity * price + fees
+    else:
+        average = cost / held if held else 0.0
+        realized = -quantity * (price - average) - fees
+        cost += quantity * average
+    remaining = held + quantity
+    if abs(remaining) < QUANTITY_EPSILON:
+        remaining, cost = 0.0, 0.0
+
+    _flow(nav, quantity * price, quantity * price + fees)
+    nav.cost_basis += cost - booked_cost
+    nav.realized_pnl += realized
+    pos.quantity, pos.cost_basis, pos.last_price = remaining, cost, price
+    pos.market_value = remaining * price
+    pos.realized_pnl = (pos.realized_pnl or 0.0) + realized
+    pos.updated_at = timestamp
+    trade = Trade(user_id=user_id, symbol=symbol, quantity=quantity, price=price, fees=fees,
+                  realized_pnl=realized, timestamp=timestamp)
+    session.add(trade)
+    metrics.inc("ledger_trades_total")
+    return trade
+
+
+def apply_prices(session, prices, timestamp=None):
+    """
+    Revalue the open positions in the ticked symbols ({symbol: price}) and move each holder's
+    NAV point by the change. Returns the number of positions revalued. Does not commit.
+    """
+    prices = {str(s).upper(): float(p) for s, p in prices.items() if p is not None and p > 0}
+    if not prices:
+        return 0
+    timestamp = timestamp or datetime.datetime.utcnow()
+    session.flush()
+    held = Position.symbol.in_(prices), Position.quantity != 0
+    lock_users(session, select(Position.user_id).where(*held))
+    rows = session.execute(
+        select(Position.id, Position.user_id, Position.symbol, Position.quantity, Position.last_price,
+               Position.market_value, Position.cost_basis)
+        .where(*held)).all()
+    changes, moves = [], {}
+    for pid, user_id, symbol, quantity, last_price, value, cost in rows:
+        price = prices[symbol]
+        if price == last_price:
+            continue
+        new_value = quantity * price
+        move = moves.setdefault(user_id, [0.0, 0.0])  # [market move, imported holdings entering the book]
+        if last_price is None:
+            move[1] += new_value
+        else:
+            move[0] += new_value - (value or 0.0)
+        changes.append({"b_id": pid, "b_price": price, "b_updated_at": timestamp})
+    if changes:
+        # values computed from the stored quantity, not the one read above
+        table = Position.__table__
+        session.execute(update(table).where(table.c.id == bindparam("b_id")).values(
+            last_price=bindparam("b_price"), market_value=table.c.quantity * bindparam("b_price"),
+            cost_basis=func.coalesce(table.c.cost_basis, table.c.quantity * bindparam("b_price")),
+            updated_at=bindparam("b_updated_at")), changes)
+        for user_id, nav in _nav_rows(session, list(moves), day_key(timestamp)).items():
+            market, opened = moves[user_id]
+            _reprice(nav, market)
+            if opened:
+                _flow(nav, opened, opened)
+                nav.cost_basis += opened
+    metrics.inc("ledger_positions_valued_total", len(changes))
+    return len(changes)
+
+
+def import_holdings(session):
+    """Create positions from Portfolio.holdings ({symbol: shares}) for users without any. Commits."""
+    have = {u for (u,) in session.query(Position.user_id).distinct()}
+    added = 0
+    for user_id, holdings in session.query(Portfolio.user_id, Portfolio.holdings):
+        if user_id in have:
+            continue
+        if isinstance(holdings, str):
+            try:
+                holdings = json.loads(holdings or "{}")
+            except ValueError:
+                holdings = {}
+        for symbol, shares in (holdings or {}).items():
+            try:
+                shares = float(shares)
+            except (TypeError, ValueError):
+                continue
+            if shares > QUANTITY_EPSILON and str(symbol).strip():
+                session.add(Position(user_id=user_id, symbol=str(symbol).strip().upper(), quantity=shares,
+                                     cost_basis=None, realized_pnl=0.0, market_value=0.0))
+                added += 1
+        have.add(user_id)
+    session.commit()
+    return added
+
+
+def revalue(session, user_id=None, timestamp=None):
+    """Recompute positions' values and the day's NAV totals from quantity x last price (all users, or one). Commits."""
+    timestamp = timestamp or datetime.datetime.utcnow()
+    query = session.query(Position).populate_existing()
+    if user_id is not None:
+        query = query.filter(Position.user_id == user_id)
+    lock_users(session, [user_id] if user_id is not None else select(Position.user_id).distinct())
+    totals = {}
+    for pos in query:
+        pos.market_value = (pos.quantity or 0.0) * (pos.last_price or 0.0)
+        total = totals.setdefault(pos.user_id, [0.0, 0.0, 0.0])
+        total[0] += pos.market_value
+        total[1] += pos.cost_basis or 0.0
+        total[2] += pos.realized_pnl or 0.0
+    for u, nav in _nav_rows(session, list(totals), day_key(timestamp)).items():
+        nav.market_value, nav.cost_basis, nav.realized_pnl = totals[u]
+        if nav.units > QUANTITY_EPSILON:
+            nav.nav = nav.market_value / nav.units
+    session.commit()
+
+
+# ---------------- reads ----------------
+def holdings(session, user_id):
+    """{symbol: quantity} of the open positions."""
+    return {s: q for s, q in session.query(Position.symbol, Position.quantity).filter(
+        Position.user_id == user_id, Position.quantity != 0)}
+
+
+def positions(session, user_id):
+    """Open positions with average cost, unrealized P&L and weight in the book, largest first."""
+    rows = session.query(Position).filter(Position.user_id == user_id, Position.quantity != 0).all()
+    total = sum(p.market_value or 0.0 for p in rows)
+    out = []
+    for p in sorted(rows, key=lambda p: p.market_value or 0.0, reverse=True):
+        cost = p.cost_basis
+        out.append({"symbol": p.symbol, "quantity": p.quantity,
+                    "average_cost": round(cost / p.quantity, 4) if cost is not None else None,
+                    "last_price": p.last_price, "market_value": round(p.market_value or 0.0, 2),
+                    "unrealized_pnl": round((p.market_value or 0.0) - cost, 2)
+                    if cost is not None and p.last_price is not None else None,
+                    "realized_pnl": round(p.realized_pnl or 0.0, 2),
+                    "weight": round((p.market_value or 0.0) / total, 4) if total else None})
+    return out
+
+
+def book(session, user_id):
+    """Latest book totals, read from the NAV point (no revaluation)."""
+    nav = session.query(NavPoint).filter(NavPoint.user_id == user_id).order_by(NavPoint.day.desc()).first()
+    if nav is None:
+        return {"market_value": 0.0, "cost_basis": 0.0, "unrealized_pnl": 0.0, "realized_pnl": 0.0,
+                "nav": NAV_BASE, "as_of": None}
+    return {"market_value": round(nav.market_value, 2), "cost_basis": round(nav.cost_basis, 2),
+            "unrealized_pnl": round(nav.market_value - nav.cost_basis, 2),
+            "realized_pnl": round(nav.realized_pnl, 2), "nav": round(nav.nav or NAV_BASE, 4), "as_of": nav.day}
+
+
+def nav_series(session, user_id, since=None):
+    """[{"day", "nav", "market_value", "net_flow"}] oldest first, for charting."""
+    query = session.query(NavPoint.day, NavPoint.nav, NavPoint.market_value, NavPoint.net_flow).filter(
+        NavPoint.user_id == user_id)
+    if since:
+        query = query.filter(NavPoint.day >= str(since)[:10])
+    return [{"day": d, "nav": round(n or NAV_BASE, 4), "market_value": round(v, 2), "net_flow": round(f, 2)}
+            for d, n, v, f in query.order_by(NavPoint.day)]
+
+
+def rebalance(session, user_id, target_weights, prices):
+    """
+    Shares to buy (+) or sell (-) per symbol to reach target_weights ({symbol: weight}), sized on
+    the user's quantities in those symbols at prices (the last booked price where none is given).
+    Read-only: repricing the book is the price tick's job (apply_prices).
+    """
+    prices, values = dict(prices), {}
+    for symbol, quantity, last_price in session.query(Position.symbol, Position.quantity, Position.last_price).filter(
+            Position.user_id == user_id, Position.symbol.in_(list(target_weights)), Position.quantity != 0):
+        price = prices.setdefault(symbol, last_price)
+        values[symbol] = quantity * price if price is not None else 0.0
+    total = sum(values.values())
+    return {s: (w * total - values.get(s, 0.0)) / (prices.get(s) or 1) for s, w in target_weights.items()}
@@ -1,9 +1,15 @@
 # memory.py
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, JSON
+from sqlalchemy import (create_engine, event, inspect, func, update, Column, Integer, String, Float, DateTime, JSON,
+                        Index, UniqueConstraint, text)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from contextlib import contextmanager
 import datetime
 import json
+import threading
+from utils import DATABASE_URL, DB_POOL_SIZE, DB_BUSY_TIMEOUT
+import metrics
 
 Base = declarative_base()
 
@@ -14,6 +20,8 @@ class User(Base):
     risk_tolerance = Column(String, default="medium")
     income = Column(Float, default=0.0)
     goals = Column(JSON, default="[]")  # list of dicts
+    watchlist = Column(JSON, default="[]")  # tickers the scheduler keeps fresh
+    data_version = Column(Integer, default=0)  # bumped by every expense write; keys report snapshots
 
 class Transaction(Base):
     __tablename__ = "transactions"
@@ -22,6 +30,69 @@ class Transaction(Base):
     category = Column(String)
     amount = Column(Float)
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    description = Column(String)
+    fingerprint = Column(String)  # hash of (date, amount, description) for de-duplicating imports
+    anomaly_score = Column(Float)  # set only when anomaly.py flagged the expense on insert
+
+    __table_args__ = (
+        Index("ix_transactions_user_timestamp", "user_id", "timestamp"),
+        Index("ix_transactions_user_fingerprint", "user_id", "fingerprint"),
+        # partial index over the few flagged rows, already in timestamp order for the "unusual" list
+        Index("ix_transactions_user_flagged", "user_id", "timestamp", sqlite_where=text("anomaly_score IS NOT NULL"),
+              postgresql_where=text("anomaly_score IS NOT NULL")),
+    )
+
+class MonthlyCategoryTotal(Base):
+    # rollup of transactions per user/month/category, updated in the same commit as each insert
+    __tablename__ = "monthly_category_totals"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    month = Column(String, nullable=False)  # "YYYY-MM"
+    category = Column(String)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+
+    __table_args__ = (UniqueConstraint("user_id", "month", "category", name="uq_rollup_user_month_category"),)
+
+class CategoryStats(Base):
+    # running amount statistics per user/category for anomaly.py, updated on every insert
+    __tablename__ = "category_stats"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    category = Column(String)
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    m2 = Column(Float, default=0.0)  # Welford sum of squared deviations
+    ewma = Column(Float, default=0.0)
+    ewm_var = Column(Float, default=0.0)
+    sketch = Column(JSON)  # P-square quantile markers {"h": heights, "n": positions}
+
+    __table_args__ = (UniqueConstraint("user_id", "category", name="uq_category_stats_user_category"),)
+
+class CategoryRule(Base):
+    # a user's auto-categorization rule for categorize.py, ranked ahead of its DEFAULT_RULES
+    __tablename__ = "category_rules"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    category = Column(String, nullable=False)
+    kind = Column(String, default="keyword")  # "keyword" or "regex"
+    pattern = Column(String)  # empty: the rule matches on the amount range alone
+    min_amount = Column(Float)
+    max_amount = Column(Float)
+    priority = Column(Integer, default=0)  # higher wins among the user's rules
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class ReportSnapshot(Base):
+    # a precomputed report (expense_report, goal_progress); valid while its inputs key still matches
+    __tablename__ = "report_snapshots"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    kind = Column(String, nullable=False)
+    inputs = Column(String)
+    payload = Column(JSON)
+    computed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint("user_id", "kind", name="uq_report_snapshot_user_kind"),)
 
 class Portfolio(Base):
     __tablename__ = "portfolios"
@@ -29,10 +100,208 @@ class Portfolio(Base):
     user_id = Column(Integer)
     holdings = Column(JSON, default="{}")  # {symbol: shares}
 
-def init_db(db_uri="sqlite:///smart_finance_coach.db"):
-    engine = create_engine(db_uri, connect_args={"check_same_thread": False})
-    Base.metadata.create_all(engine)
-    return sessionmaker(bind=engine)()
+class Position(Base):
+    # one row per (user, symbol), maintained by ledger.py on every trade and price tick;
+    # supersedes Portfolio.holdings, which is imported once when this table is created
+    __tablename__ = "positions"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    symbol = Column(String, nullable=False)
+    quantity = Column(Float, default=0.0)
+    cost_basis = Column(Float)  # average-cost basis of the open quantity; NULL until a first price is known
+    realized_pnl = Column(Float, default=0.0)
+    last_price = Column(Float)
+    market_value = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "symbol", name="uq_positions_user_symbol"),
+        Index("ix_positions_symbol", "symbol"),  # a price tick reprices every holder of the symbol
+    )
+
+class Trade(Base):
+    # the trade ledger; quantity is negative for sells
+    __tablename__ = "trades"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    symbol = Column(String, nullable=False)
+    quantity = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)
+    fees = Column(Float, default=0.0)
+    realized_pnl = Column(Float, default=0.0)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (Index("ix_trades_user_timestamp", "user_id", "timestamp"),)
+
+class NavPoint(Base):
+    # end-of-day (or latest intraday) book value per user, moved by deltas as trades and ticks arrive;
+    # nav is a unit value (starts at 100) so deposits and withdrawals do not show up as returns
+    __tablename__ = "nav_history"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    day = Column(String, nullable=False)  # "YYYY-MM-DD"
+    market_value = Column(Float, default=0.0)
+    cost_basis = Column(Float, default=0.0)
+    realized_pnl = Column(Float, default=0.0)  # cumulative
+    net_flow = Column(Float, default=0.0)  # cash put in (+) or taken out (-) that day
+    units = Column(Float, default=0.0)
+    nav = Column(Float)
+
+    __table_args__ = (UniqueConstraint("user_id", "day", name="uq_nav_history_user_day"),)
+
+class Investment(Base):
+    # investment log (formerly the `investments` table in finance.db)
+    __tablename__ = "investments"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer)
+    type = Column(String, nullable=False)  # stock/crypto/mutual fund
+    symbol = Column(String, nullable=False)
+    amount = Column(Float, nullable=False)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    legacy_id = Column(Integer)  # row id in finance.db, so re-running the migration is a no-op
+
+    __table_args__ = (
+        Index("ix_investments_user_timestamp", "user_id", "timestamp"),
+        Index("ix_investments_user_legacy", "user_id", "legacy_id"),
+    )
+
+_factories = {}
+_factories_lock = threading.Lock()
+
+def create_db_engine(db_uri=DATABASE_URL):
+    """
+    Pooled engine; SQLite files get WAL (readers don't block the writer) and a busy timeout.
+    Every statement is counted and timed by metrics.
+    """
+    if not db_uri.startswith("sqlite"):
+        return metrics.instrument_engine(create_engine(db_uri, pool_size=DB_POOL_SIZE, pool_pre_ping=True))
+    connect_args = {"check_same_thread": False, "timeout": DB_BUSY_TIMEOUT}
+    if db_uri in ("sqlite://", "sqlite:///:memory:"):
+        # an in-memory database exists per connection, so every session must share one
+        return metrics.instrument_engine(create_engine(db_uri, connect_args=connect_args, poolclass=StaticPool))
+    engine = create_engine(db_uri, connect_args=connect_args, pool_size=DB_POOL_SIZE, max_overflow=2 * DB_POOL_SIZE)
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(DB_BUSY_TIMEOUT * 1000)}")
+        cursor.close()
+
+    return metrics.instrument_engine(engine)
+
+def get_session_factory(db_uri=DATABASE_URL):
+    """Process-wide sessionmaker per database; the engine and schema are set up on first use."""
+    factory = _factories.get(db_uri)
+    if factory is not None:
+        return factory
+    with _factories_lock:
+        if db_uri not in _factories:
+            engine = create_db_engine(db_uri)
+            had_rollup = inspect(engine).has_table(MonthlyCategoryTotal.__tablename__)
+            had_stats = inspect(engine).has_table(CategoryStats.__tablename__)
+            had_positions = inspect(engine).has_table(Position.__tablename__)
+            had_rules = inspect(engine).has_table(CategoryRule.__tablename__)
+            Base.metadata.create_all(engine)
+            _upgrade_schema(engine)
+            factory = sessionmaker(bind=engine, expire_on_commit=False)
+            if not had_rollup:
+                with factory() as session:
+                    rebuild_month_rollup(session)
+            if not had_stats:
+                from anomaly import rebuild_category_stats  # anomaly imports this module
+                with factory() as session:
+                    rebuild_category_stats(session)
+            if not had_positions:
+                from ledger import import_holdings  # ledger imports this module
+                with factory() as session:
+                    import_holdings(session)
+            if not had_rules:
+                from categorize import backfill  # categorize imports this module
+                with factory() as session:
+                    backfill(session)
+            _factories[db_uri] = factory
+        return _factories[db_uri]
+
+@contextmanager
+def session_scope(factory=None):
+    """One unit of work: commit on success, roll back on error, always return the connection to the pool."""
+    session = (factory or get_session_factory())()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def init_db(db_uri=DATABASE_URL):
+    return get_session_factory(db_uri)()
+
+def _upgrade_schema(engine):
+    # create_all only creates missing tables; bring older databases up to date
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}")
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+def month_key(ts):
+    return ts.strftime("%Y-%m")
+
+def bump_month_rollup(session, user_id, month, category, amount, count=1):
+    """Add to the rollup row for (user, month, category). Does not commit."""
+    bump_month_rollups(session, user_id, {(month, category): (amount, count)})
+
+def bump_month_rollups(session, user_id, totals):
+    """Apply {(month, category): (amount, count)} to the rollup with one lookup query. Does not commit."""
+    if not totals:
+        return
+    months = {month for month, _ in totals}
+    with session.no_autoflush:
+        rows = {(r.month, r.category): r for r in session.query(MonthlyCategoryTotal).filter(
+            MonthlyCategoryTotal.user_id == user_id, MonthlyCategoryTotal.month.in_(months))}
+        for key, (amount, count) in totals.items():
+            row = rows.get(key)
+            if row is None:
+                row = MonthlyCategoryTotal(user_id=user_id, month=key[0], category=key[1], total=0.0, count=0)
+                session.add(row)
+            row.total += amount
+            row.count += count
+
+def rebuild_month_rollup(session, user_id=None):
+    """Recompute the rollup from transactions with one GROUP BY (all users, or one)."""
+    month = func.strftime("%Y-%m", Transaction.timestamp)
+    query = session.query(Transaction.user_id, month, Transaction.category,
+                          func.sum(Transaction.amount), func.count(Transaction.id))
+    rollup = session.query(MonthlyCategoryTotal)
+    if user_id is not None:
+        query = query.filter(Transaction.user_id == user_id)
+        rollup = rollup.filter(MonthlyCategoryTotal.user_id == user_id)
+    rollup.delete(synchronize_session=False)
+    session.add_all(MonthlyCategoryTotal(user_id=u, month=m, category=c, total=t, count=n)
+                    for u, m, c, t, n in query.group_by(Transaction.user_id, month, Transaction.category))
+    session.commit()
+
+def bump_data_version(session, user_id):
+    """Mark the user's expenses as changed (invalidates report snapshots). Does not commit."""
+    session.execute(update(User).where(User.id == user_id)
+                    .values(data_version=func.coalesce(User.data_version, 0) + 1))
+
+def lock_users(session, user_ids):
+    """
+    Take the write lock on the users' rows (on SQLite, the database) before reading state that is
+    about to be updated, so concurrent writers for a user queue instead of losing updates. Does not commit.
+    """
+    session.execute(update(User).where(User.id.in_(user_ids)).values(data_version=User.data_version))
 
 def get_or_create_user(session, name="local_user"):
     user = session.query(User).filter_by(name=name).first()
@@ -0,0 +1,232 @@
+# metrics.py
+"""
+In-process instrumentation for the hot paths: Crew tasks, market data and HTTP calls,
+SQL queries (via SQLAlchemy engine events), caches and the portfolio solver.
+Counters and timers are kept in one thread-safe registry and exported as JSON or
+Prometheus text (optionally served over HTTP on METRICS_PORT). profile() captures a
+cProfile (or pyinstrument, when installed) report for a single block, e.g. one kickoff.
+"""
+
+import contextvars
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from utils import METRICS_ENABLED
+
+enabled = METRICS_ENABLED
+
+_counters = {}
+_timers = {}  # key -> [count, total, max]
+_lock = threading.Lock()
+# the Crew task running in this thread, so SQL queries can be attributed to it
+current_task = contextvars.ContextVar("current_task", default=None)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        stats = _timers.get(key)
+        if stats is None:
+            _timers[key] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def cache_access(cache, result):
+    """result: True/"hit", False/"miss", or "partial" (e.g. a stale series topped up)."""
+    if result is True or result is False:
+        result = "hit" if result else "miss"
+    inc("cache_requests_total", cache=cache, result=result)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+# ---------------- SQLAlchemy ----------------
+def instrument_engine(engine):
+    """Count and time every statement on engine, labelled with the running Crew task."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        task = current_task.get() or "none"
+        inc("db_queries_total", task=task)
+        observe("db_query_seconds", time.perf_counter() - started, task=task)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+        inc("db_errors_total", task=current_task.get() or "none")
+
+    return engine
+
+
+# ---------------- export ----------------
+def snapshot():
+    """{"counters", "timers", "cache_hit_ratio"} as JSON-friendly data."""
+    with _lock:
+        counters = [{"name": n, "labels": dict(l), "value": v} for (n, l), v in sorted(_counters.items())]
+        timers = [{"name": n, "labels": dict(l), "count": c, "total": round(t, 6), "mean": round(t / c, 6),
+                   "max": round(m, 6)} for (n, l), (c, t, m) in sorted(_timers.items())]
+    caches = {}
+    for c in counters:
+        if c["name"] == "cache_requests_total":
+            hits, total = caches.get(c["labels"]["cache"], (0, 0))
+            caches[c["labels"]["cache"]] = (hits + (c["value"] if c["labels"]["result"] == "hit" else 0),
+                                            total + c["value"])
+    ratios = {cache: round(hits / total, 4) for cache, (hits, total) in caches.items() if total}
+    return {"counters": counters, "timers": timers, "cache_hit_ratio": ratios}
+
+
+def to_json():
+    return json.dumps(snapshot())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def to_prometheus():
+    """Prometheus text exposition: counters as-is, timers as summaries plus a _max gauge."""
+    with _lock:
+        counters = sorted(_counters.items())
+        timers = sorted(_timers.items())
+    lines, typed = [], set()
+    for (name, labels), value in counters:
+        if name not in typed:
+            lines.append(f"# TYPE {name} counter")
+            typed.add(name)
+        lines.append(f"{name}{_labels(labels)} {value}")
+    for (name, labels), (count, total, peak) in timers:
+        if name not in typed:
+            lines.append(f"# TYPE {name} summary")
+            typed.add(name)
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+        lines.append(f"{name}_max{_labels(labels)} {peak:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics (Prometheus) and /metrics.json from a daemon thread; once per process."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # only processes that serve pay for it
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, content_type = to_json().encode(), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, content_type = to_prometheus().encode(), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+# ---------------- profiling ----------------
+@contextmanager
+def profile(top=30, use_pyinstrument=None):
+    """
+    Profile the enclosed block; the report text is placed in the yielded dict under "report".
+    pyinstrument is used when installed (or when asked for), cProfile otherwise.
+    """
+    out = {"report": None, "profiler": None}
+    if use_pyinstrument is not False:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+            if use_pyinstrument:
+                print("pyinstrument not installed, using cProfile")
+        if Profiler is not None:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield out
+            finally:
+                profiler.stop()
+                out.update(report=profiler.output_text(), profiler="pyinstrument")
+            return
+    import cProfile
+    import io
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield out
+    finally:
+        profiler.disable()
+        buf = io.StringIO()
+        pstats.Stats(profiler, stream=buf).sort_stats("cumulative").print_stats(top)
+        out.update(report=buf.getvalue(), profiler="cProfile")
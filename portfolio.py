@@ -1,37 +1,340 @@
 # portfolio.py
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize
+from utils import period_to_days, STATS_CACHE_ENABLED, STATS_CACHE_MIN_TICKERS
+import stats_cache
+import metrics
+
+TRADING_DAYS = 252
+
+# where each risk tolerance sits on the efficient frontier, measured in volatility from the
+# max-Sharpe portfolio (0): -1 is minimum variance, +1 is maximum return
+RISK_PROFILES = {"low": -0.5, "medium": 0.0, "high": 0.5}
 
 def compute_returns(price_df):
-    returns = price_df.pct_change().dropna()
-    return returns
+    # pct_change() (gaps padded first) on the raw array; pandas' version loops column by column
+    prices = price_df.ffill().to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        returns = prices[1:] / prices[:-1] - 1
+    return pd.DataFrame(returns, index=price_df.index[1:], columns=price_df.columns).dropna()
+
+def trim_to_period(price_df, period):
+    """Keep only the trailing `period` ("6mo", "1y", ...) of a price frame."""
+    days = period_to_days(period)
+    if days is None or price_df.empty:
+        return price_df
+    if isinstance(price_df.index, pd.DatetimeIndex):
+        return price_df[price_df.index >= price_df.index[-1] - pd.Timedelta(days=days)]
+    return price_df.iloc[-int(days * TRADING_DAYS / 365) - 1:]
 
-def mean_variance_optimization(price_df, returns_period="1y", risk_free_rate=0.02):
+def ledoit_wolf(returns):
+    """
+    Ledoit-Wolf shrinkage of the sample covariance towards a scaled identity.
+    Returns (covariance ndarray, shrinkage intensity). Stays well conditioned when
+    there are many assets relative to observations.
+    """
+    X = np.asarray(returns, dtype=float)
+    X = X - X.mean(axis=0)
+    t, n = X.shape
+    S = X.T @ X / t
+    mu = np.trace(S) / n
+    d2 = ((S - mu * np.eye(n)) ** 2).sum() / n
+    # sum over t of ||x_t x_t' - S||_F^2 without materialising the outer products
+    row_sq = (X ** 2).sum(axis=1)
+    b2 = ((row_sq ** 2).sum() - t * (S ** 2).sum()) / (t ** 2) / n
+    shrinkage = 0.0 if d2 == 0 else min(max(b2 / d2, 0.0), 1.0)
+    return shrinkage * mu * np.eye(n) + (1 - shrinkage) * S, shrinkage
+
+@metrics.timed("portfolio_seconds", step="estimate_moments")
+def estimate_moments(price_df, returns_period=None, shrinkage=False):
+    """Annualised mean returns (Series) and covariance (DataFrame) from a price frame."""
+    if returns_period:
+        price_df = trim_to_period(price_df, returns_period)
     returns = compute_returns(price_df)
-    mean_returns = returns.mean() * 252
-    cov_matrix = returns.cov() * 252
-    num_assets = len(mean_returns)
-
-    def portfolio_performance(weights):
-        port_return = np.dot(weights, mean_returns)
-        port_vol = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-        return port_return, port_vol
-
-    def neg_sharpe(weights):
-        r, vol = portfolio_performance(weights)
-        return -(r - risk_free_rate) / vol
-
-    constraints = ({'type': 'eq', 'fun': lambda x: np.sum(x) - 1})
-    bounds = tuple((0, 1) for _ in range(num_assets))
-    init_guess = np.array(num_assets * [1. / num_assets])
-
-    result = minimize(neg_sharpe, init_guess, method='SLSQP', bounds=bounds, constraints=constraints)
-    if result.success:
-        weights = result.x
-        return pd.Series(weights, index=mean_returns.index)
-    else:
+    if shrinkage:
+        cov, _ = ledoit_wolf(returns.values)
+        return (returns.mean() * TRADING_DAYS,
+                pd.DataFrame(cov * TRADING_DAYS, index=returns.columns, columns=returns.columns))
+    if (STATS_CACHE_ENABLED and returns.shape[1] >= STATS_CACHE_MIN_TICKERS and len(returns) > 1
+            and np.isfinite(returns.values).all()):
+        # shared across users: overlapping baskets reuse each other's covariance blocks
+        mean_returns, cov_matrix = stats_cache.moments(returns, returns_period)
+        return mean_returns * TRADING_DAYS, cov_matrix * TRADING_DAYS
+    return returns.mean() * TRADING_DAYS, returns.cov() * TRADING_DAYS
+
+
+def _inverse(matrix):
+    try:
+        return np.linalg.inv(matrix)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(matrix)
+
+@metrics.timed("portfolio_seconds", step="critical_line")
+def critical_line(mean_returns, cov_matrix, lower=None, upper=None, tol=1e-10):
+    """
+    Markowitz's critical line algorithm for the bounded (default long-only) frontier.
+    Returns the turning points as an array (k, n), from maximum return down to minimum
+    variance. Every efficient portfolio is a convex combination of two adjacent points.
+    """
+    mu = np.asarray(mean_returns, dtype=float)
+    cov = np.asarray(cov_matrix, dtype=float)
+    n = len(mu)
+    lower = np.zeros(n) if lower is None else np.asarray(lower, dtype=float)
+    upper = np.ones(n) if upper is None else np.asarray(upper, dtype=float)
+
+    # start at the max-return corner: fill the best assets up to their bounds
+    w = lower.copy()
+    last = None
+    for i in np.argsort(mu)[::-1]:
+        room = 1 - w.sum()
+        if room <= 0:
+            break
+        w[i] = min(upper[i], lower[i] + room)
+        last = i
+    free = [int(last)]
+
+    all_assets = np.arange(n)
+    points, lam_prev = [w.copy()], None
+    for _ in range(4 * n + 10):
+        f = np.array(free)
+        b = np.setdiff1d(all_assets, f)
+        cov_f_inv = _inverse(cov[np.ix_(f, f)])
+        a = cov_f_inv.sum(axis=1)            # Σ_FF⁻¹·1
+        m = cov_f_inv @ mu[f]                # Σ_FF⁻¹·μ_F
+        c1, c3 = a.sum(), m.sum()
+        g = cov[np.ix_(f, b)] @ w[b]         # Σ_FB·w_B
+        l2 = cov_f_inv @ g
+        l1, l3 = w[b].sum(), l2.sum()
+
+        # candidate 1: a free weight moves to one of its bounds (all free assets at once)
+        l_in = i_in = bi_in = None
+        if len(f) > 1:
+            c = -c1 * m + c3 * a
+            bi = np.where(c > 0, upper[f], lower[f])
+            with np.errstate(divide="ignore", invalid="ignore"):
+                lam = np.where(c != 0, ((1 - l1 + l3) * a - c1 * (bi + l2)) / c, np.nan)
+            if np.isfinite(lam).any():
+                j = int(np.nanargmax(lam))
+                l_in, i_in, bi_in = lam[j], f[j], bi[j]
+
+        # candidate 2: a bounded weight becomes free. Each candidate's enlarged inverse
+        # comes from a Schur-complement update of Σ_FF⁻¹ instead of a fresh inversion.
+        l_out = i_out = None
+        if b.size:
+            s_fb = cov[np.ix_(f, b)]
+            u = cov_f_inv @ s_fb
+            d = np.diag(cov)[b] - (s_fb * u).sum(axis=0)
+            su = u.sum(axis=0)
+            um = mu[f] @ u
+            wb = w[b]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                c1_i = c1 + (su - 1) ** 2 / d
+                c4_i = (1 - su) / d
+                c3_i = c3 + (um - mu[b]) * (su - 1) / d
+                c2_i = (mu[b] - um) / d
+                z_f_u = u.T @ g - (np.diag(cov)[b] - d) * wb   # u'·z_F
+                z_i = cov[np.ix_(b, b)] @ wb - np.diag(cov)[b] * wb
+                l2_i = (z_i - z_f_u) / d
+                l3_i = (a @ g - su * wb) + (z_f_u - z_i) * (su - 1) / d
+                l1_i = l1 - wb
+                c = -c1_i * c2_i + c3_i * c4_i
+                lam = ((1 - l1_i + l3_i) * c4_i - c1_i * (wb + l2_i)) / c
+            ok = np.isfinite(lam) & (c != 0)
+            if lam_prev is not None:
+                # strictly below the last turning point, with slack so rounding cannot
+                # re-free the asset that was just bounded
+                ok &= lam < lam_prev - 1e-9 * max(1.0, abs(lam_prev))
+            if ok.any():
+                j = int(np.argmax(np.where(ok, lam, -np.inf)))
+                l_out, i_out = lam[j], b[j]
+
+        if (l_in is None or l_in < 0) and (l_out is None or l_out < 0):
+            # no more turning points: the minimum-variance portfolio
+            lam = 0.0
+        elif l_out is None or (l_in is not None and l_in > l_out):
+            lam = l_in
+            free.remove(int(i_in))
+            w[i_in] = bi_in
+        else:
+            lam = l_out
+            free.append(int(i_out))
+
+        f = np.array(free)
+        b = np.setdiff1d(all_assets, f)
+        cov_f_inv = _inverse(cov[np.ix_(f, f)])
+        ones_f = np.ones(len(f))
+        mean_f = mu[f] if lam else np.zeros(len(f))
+        g1, g2 = ones_f @ cov_f_inv @ mean_f, ones_f @ cov_f_inv @ ones_f
+        w1 = cov_f_inv @ (cov[np.ix_(f, b)] @ w[b]) if b.size else np.zeros(len(f))
+        gamma = -lam * g1 / g2 + (1 - w[b].sum() + w1.sum()) / g2
+        w[f] = -w1 + gamma * (cov_f_inv @ ones_f) + lam * (cov_f_inv @ mean_f)
+        points.append(w.copy())
+        lam_prev = lam
+        if lam == 0:
+            break
+
+    # drop numerically invalid points, then any point dominated by a later one
+    points = [p for p in points
+              if abs(p.sum() - 1) <= 1e-6 and (p - lower).min() >= -1e-6 and (upper - p).min() >= -1e-6]
+    if not points:
         raise Exception("Optimization failed")
+    kept = [points[-1]]
+    for p in reversed(points[:-1]):
+        if p @ mu > kept[-1] @ mu + tol:
+            kept.append(p)
+    return np.clip(np.vstack(kept[::-1]), lower, upper)
+
+
+class EfficientFrontier:
+    """
+    Mean-variance engine. Moments are computed once and the whole long-only frontier
+    is solved in one pass with the critical line algorithm; min-variance, max-Sharpe,
+    target-return and target-risk portfolios are then closed-form on its segments.
+    With long_only=False the unconstrained closed-form frontier is used instead.
+    """
+
+    def __init__(self, mean_returns, cov_matrix, risk_free_rate=0.02, long_only=True):
+        self.assets = list(mean_returns.index)
+        self.mu = np.asarray(mean_returns, dtype=float)
+        self.cov = np.asarray(cov_matrix, dtype=float)
+        self.risk_free_rate = risk_free_rate
+        self.long_only = long_only
+        self.n = len(self.mu)
+        self._ones = np.ones(self.n)
+        self._turning_points = None
+
+    @classmethod
+    def from_prices(cls, price_df, returns_period=None, risk_free_rate=0.02, shrinkage=False, long_only=True):
+        mean_returns, cov_matrix = estimate_moments(price_df, returns_period, shrinkage)
+        return cls(mean_returns, cov_matrix, risk_free_rate, long_only)
+
+    # ---------------- helpers ----------------
+    def performance(self, weights):
+        weights = np.asarray(weights)
+        ret = weights @ self.mu
+        vol = np.sqrt(weights @ self.cov @ weights)
+        return ret, vol
+
+    def _series(self, weights):
+        return pd.Series(np.asarray(weights, dtype=float), index=self.assets)
+
+    def _segments(self):
+        """Turning points (min variance first) with their returns and pairwise covariances."""
+        if self._turning_points is None:
+            if self.long_only:
+                points = critical_line(self.mu, self.cov)[::-1]
+            else:
+                inv_ones = np.linalg.solve(self.cov, self._ones)
+                inv_mu = np.linalg.solve(self.cov, self.mu)
+                # two funds span the unconstrained frontier; extend it to twice the top asset's return
+                w_min = inv_ones / inv_ones.sum()
+                r_top = w_min @ self.mu + 2 * (self.mu.max() - w_min @ self.mu)
+                points = np.vstack([w_min, self._closed_form(r_top, inv_ones, inv_mu)])
+            rets = points @ self.mu
+            cross = points @ self.cov @ points.T
+            if not np.all(np.isfinite(cross)):
+                raise Exception("Optimization failed")
+            self._turning_points = (points, rets, cross)
+        return self._turning_points
+
+    def _closed_form(self, target_return, inv_ones, inv_mu):
+        # unconstrained frontier: w = Σ⁻¹(λ·1 + γ·μ)
+        a, b, c = self._ones @ inv_ones, self._ones @ inv_mu, self.mu @ inv_mu
+        d = a * c - b * b
+        return ((c - b * target_return) / d) * inv_ones + ((a * target_return - b) / d) * inv_mu
+
+    def _on_segment(self, k, a):
+        # a = 0 at turning point k, a = 1 at k + 1
+        points = self._segments()[0]
+        return (1 - a) * points[k] + a * points[k + 1]
+
+    # ---------------- portfolios ----------------
+    def min_variance(self):
+        return self._series(self._segments()[0][0])
+
+    def max_sharpe(self):
+        points, rets, cross = self._segments()
+        if len(points) == 1:
+            return self._series(points[0])
+        # Sharpe along each segment is a ratio of scalars in a; golden-section search all segments at once
+        p, q = np.arange(len(points) - 1), np.arange(1, len(points))
+        v_pp, v_pq, v_qq = cross[p, p], cross[p, q], cross[q, q]
+
+        def sharpe(a):
+            ret = (1 - a) * rets[p] + a * rets[q]
+            var = (1 - a) ** 2 * v_pp + 2 * a * (1 - a) * v_pq + a ** 2 * v_qq
+            return (ret - self.risk_free_rate) / np.sqrt(np.maximum(var, 1e-18))
+
+        lo, hi = np.zeros(len(p)), np.ones(len(p))
+        ratio = (np.sqrt(5) - 1) / 2
+        for _ in range(60):
+            x1, x2 = hi - ratio * (hi - lo), lo + ratio * (hi - lo)
+            left = sharpe(x1) >= sharpe(x2)
+            hi = np.where(left, x2, hi)
+            lo = np.where(left, lo, x1)
+        best_a = (lo + hi) / 2
+        candidates = np.concatenate([sharpe(best_a), sharpe(np.zeros(len(p))), sharpe(np.ones(len(p)))])
+        k = int(np.nanargmax(candidates))
+        a = (best_a, np.zeros(len(p)), np.ones(len(p)))[k // len(p)][k % len(p)]
+        return self._series(self._on_segment(k % len(p), a))
+
+    def efficient_return(self, target_return):
+        """Minimum-variance portfolio with the given expected return (clipped to the frontier)."""
+        points, rets, _ = self._segments()
+        if target_return <= rets[0] or len(points) == 1:
+            return self._series(points[0])
+        if target_return >= rets[-1]:
+            return self._series(points[-1])
+        k = int(np.searchsorted(rets, target_return)) - 1
+        a = (target_return - rets[k]) / (rets[k + 1] - rets[k])
+        return self._series(self._on_segment(k, a))
+
+    def efficient_risk(self, target_volatility):
+        """Highest-return frontier portfolio whose volatility does not exceed the target."""
+        points, _, cross = self._segments()
+        vols = np.sqrt(np.diag(cross))
+        if target_volatility <= vols[0] or len(points) == 1:
+            return self._series(points[0])
+        if target_volatility >= vols[-1]:
+            return self._series(points[-1])
+        k = int(np.searchsorted(vols, target_volatility)) - 1
+        # solve var(a) = target² on the segment (a quadratic in a)
+        v_pp, v_pq, v_qq = cross[k, k], cross[k, k + 1], cross[k + 1, k + 1]
+        coeffs = [v_pp - 2 * v_pq + v_qq, 2 * (v_pq - v_pp), v_pp - target_volatility ** 2]
+        roots = [r.real for r in np.roots(coeffs) if abs(r.imag) < 1e-12 and -1e-9 <= r.real <= 1 + 1e-9]
+        a = min(max(max(roots), 0.0), 1.0) if roots else 0.0
+        return self._series(self._on_segment(k, a))
+
+    def frontier(self, n_points=50):
+        """
+        n_points efficient portfolios evenly spaced in return from minimum variance to
+        maximum return. DataFrame with one row per point: return, volatility, sharpe, weights.
+        """
+        _, rets, _ = self._segments()
+        weights = np.vstack([self.efficient_return(r).values for r in np.linspace(rets[0], rets[-1], n_points)])
+        port_rets = weights @ self.mu
+        vols = np.sqrt(np.einsum("ij,jk,ik->i", weights, self.cov, weights))
+        table = pd.DataFrame(weights, columns=self.assets)
+        table.insert(0, "sharpe", (port_rets - self.risk_free_rate) / vols)
+        table.insert(0, "volatility", vols)
+        table.insert(0, "return", port_rets)
+        return table
+
+    def for_risk_tolerance(self, risk_tolerance):
+        position = RISK_PROFILES.get((risk_tolerance or "medium").lower(), 0.0)
+        tangency = self.max_sharpe()
+        if position == 0:
+            return tangency
+        _, _, cross = self._segments()
+        vols = np.sqrt(np.diag(cross))
+        vol_sharpe = self.performance(tangency.values)[1]
+        edge = vols[0] if position < 0 else vols[-1]
+        return self.efficient_risk(vol_sharpe + abs(position) * (edge - vol_sharpe))
+
+
+def mean_variance_optimization(price_df, returns_period="1y", risk_free_rate=0.02, shrinkage=False):
+    """Max-Sharpe long-only weights over the trailing returns_period of price_df."""
+    return EfficientFrontier.from_prices(price_df, returns_period, risk_free_rate, shrinkage).max_sharpe()
 
 def simple_rebalance_suggestion(current_holdings, target_weights, current_prices):
     total_value = sum(current_holdings.get(sym, 0) * current_prices.get(sym, 0) for sym in target_weights.index)
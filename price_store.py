@@ -0,0 +1,227 @@
+# price_store.py
+"""
+Local OHLCV store used by data_fetchers.
+Bars live in SQLite keyed by (ticker, interval, ts). A stale series is topped up
+with only the bars newer than its last cached one; a fresh one is served from disk.
+Outside market hours a series listed in MARKET_TIMEZONE and refreshed after the last close
+counts as fresh whatever its age, since no new bars can appear until the next session; crypto
+and other exchanges' series keep the plain ttl.
+"""
+
+import sqlite3
+import threading
+import time
+import pandas as pd
+from utils import (PRICE_CACHE_DB, PRICE_CACHE_TTL, PRICE_CACHE_MAX_ROWS, MARKET_TIMEZONE, period_to_days,
+                   market_is_open, last_market_close)
+import metrics
+
+COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+# a cached series may start this many days after the requested start (weekends, holidays)
+COVERAGE_SLACK_DAYS = 7
+
+
+class PriceStore:
+    def __init__(self, path=PRICE_CACHE_DB, ttl=PRICE_CACHE_TTL, max_rows=PRICE_CACHE_MAX_ROWS, market_hours=True):
+        self.path = path
+        self.ttl = ttl
+        self.market_hours = market_hours
+        self.max_rows = max_rows
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+        CREATE TABLE IF NOT EXISTS bars (
+            ticker TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            ts INTEGER NOT NULL,          -- epoch seconds, UTC
+            open REAL, high REAL, low REAL, close REAL, volume REAL,
+            PRIMARY KEY (ticker, interval, ts)
+        ) WITHOUT ROWID;
+
+        CREATE TABLE IF NOT EXISTS series (
+            ticker TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            tz TEXT,
+            first_ts INTEGER,
+            last_ts INTEGER,
+            rows INTEGER DEFAULT 0,
+            fetched_at REAL,              -- last upstream refresh
+            accessed_at REAL,             -- last read, drives eviction
+            PRIMARY KEY (ticker, interval)
+        );
+        """)
+        self.conn.commit()
+
+    # ---------------- low level ----------------
+    def _series(self, ticker, interval):
+        row = self.conn.execute(
+            "SELECT tz, first_ts, last_ts, rows, fetched_at FROM series WHERE ticker = ? AND interval = ?",
+            (ticker, interval)).fetchone()
+        if not row:
+            return None
+        return {"tz": row[0], "first_ts": row[1], "last_ts": row[2], "rows": row[3], "fetched_at": row[4]}
+
+    def write(self, interval, histories):
+        """Upsert {ticker: DataFrame} bars in one transaction."""
+        now = time.time()
+        with self.lock:
+            for ticker, hist in histories.items():
+                if hist is None or hist.empty:
+                    continue
+                index = pd.DatetimeIndex(hist.index)
+                tz = str(index.tz) if index.tz is not None else None
+                if tz is None:
+                    index = index.tz_localize("UTC")
+                ts = index.tz_convert("UTC").as_unit("s").asi8
+                frame = hist.reindex(columns=COLUMNS)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO bars (ticker, interval, ts, open, high, low, close, volume) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(ticker, interval, int(t), *(None if pd.isna(v) else float(v) for v in values))
+                     for t, values in zip(ts, frame.itertuples(index=False, name=None))])
+                first, last, count = self.conn.execute(
+                    "SELECT MIN(ts), MAX(ts), COUNT(*) FROM bars WHERE ticker = ? AND interval = ?",
+                    (ticker, interval)).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO series "
+                    "(ticker, interval, tz, first_ts, last_ts, rows, fetched_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (ticker, interval, tz, first, last, count, now, now))
+            self.conn.commit()
+
+    def touch(self, interval, tickers):
+        """Mark series as refreshed without new bars (upstream had nothing newer)."""
+        with self.lock:
+            self.conn.executemany("UPDATE series SET fetched_at = ? WHERE ticker = ? AND interval = ?",
+                                  [(time.time(), t, interval) for t in tickers])
+            self.conn.commit()
+
+    def read(self, ticker, interval, start_ts=None):
+        with self.lock:
+            meta = self._series(ticker, interval)
+            if not meta:
+                return None
+            if start_ts and meta["last_ts"] is not None:
+                # always include the latest bar, e.g. a "1d" read over a weekend
+                start_ts = min(start_ts, meta["last_ts"])
+            rows = self.conn.execute(
+                "SELECT ts, open, high, low, close, volume FROM bars "
+                "WHERE ticker = ? AND interval = ? AND ts >= ? ORDER BY ts",
+                (ticker, interval, start_ts or 0)).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=COLUMNS)
+        df = pd.DataFrame.from_records(rows, columns=["ts"] + COLUMNS)
+        index = pd.to_datetime(df.pop("ts"), unit="s", utc=True)
+        if meta["tz"]:
+            index = index.dt.tz_convert(meta["tz"])
+        else:
+            index = index.dt.tz_localize(None)
+        df.index = pd.DatetimeIndex(index, name="Date")
+        return df
+
+    def evict(self):
+        """Drop least recently read series until the store is within max_rows."""
+        with self.lock:
+            total = self.conn.execute("SELECT COALESCE(SUM(rows), 0) FROM series").fetchone()[0]
+            if total <= self.max_rows:
+                return 0
+            evicted = 0
+            for ticker, interval, rows in self.conn.execute(
+                    "SELECT ticker, interval, rows FROM series ORDER BY accessed_at").fetchall():
+                if total <= self.max_rows:
+                    break
+                self.conn.execute("DELETE FROM bars WHERE ticker = ? AND interval = ?", (ticker, interval))
+                self.conn.execute("DELETE FROM series WHERE ticker = ? AND interval = ?", (ticker, interval))
+                total -= rows
+                evicted += 1
+            self.conn.commit()
+            return evicted
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM bars")
+            self.conn.execute("DELETE FROM series")
+            self.conn.commit()
+
+    # ---------------- cache policy ----------------
+    def histories(self, tickers, period, interval, fetch, max_age=None):
+        """
+        Return {ticker: DataFrame} for the requested period, going upstream only when needed.
+        fetch(tickers, period=..., interval=..., start=...) is the uncached downloader.
+        - fresh series covering the period: served from disk
+        - stale series covering the period: only bars from its last cached date are fetched
+        - missing or too short series: fetched in full for the period
+        max_age overrides the store's ttl, e.g. a scheduler refreshing sooner than readers need.
+        """
+        days = period_to_days(period)
+        if days is None:
+            return fetch(tickers, period=period, interval=interval)
+
+        now = time.time()
+        start_ts = int(now - days * 86400)
+        ttl = self.ttl if max_age is None else max_age
+        closed_since = None
+        if self.market_hours and not market_is_open():
+            closed_since = last_market_close().timestamp()
+        full, incremental = [], {}
+        with self.lock:
+            metas = {t: self._series(t, interval) for t in tickers}
+        for t, meta in metas.items():
+            if not meta or meta["first_ts"] is None or meta["first_ts"] > start_ts + COVERAGE_SLACK_DAYS * 86400:
+                full.append(t)
+                metrics.cache_access("price_store", False)
+            elif (now - (meta["fetched_at"] or 0) > ttl
+                  and not (closed_since is not None and meta["tz"] == MARKET_TIMEZONE
+                           and (meta["fetched_at"] or 0) >= closed_since)):
+                since = pd.Timestamp(meta["last_ts"], unit="s", tz="UTC")
+                if meta["tz"]:
+                    since = since.tz_convert(meta["tz"])
+                incremental.setdefault(since.strftime("%Y-%m-%d"), []).append(t)
+                metrics.cache_access("price_store", "partial")
+            else:
+                metrics.cache_access("price_store", True)
+
+        if full:
+            self.write(interval, fetch(full, period=period, interval=interval))
+        for since, group in incremental.items():
+            fetched = fetch(group, period=None, interval=interval, start=since)
+            self.write(interval, fetched)
+            self.touch(interval, [t for t in group if t not in fetched])
+        if full or incremental:
+            self.evict()
+
+        out = {}
+        for t in tickers:
+            hist = self.read(t, interval, start_ts=start_ts)
+            if hist is not None and not hist.empty:
+                out[t] = hist
+        with self.lock:
+            self.conn.executemany("UPDATE series SET accessed_at = ? WHERE ticker = ? AND interval = ?",
+                                  [(now, t, interval) for t in out])
+            self.conn.commit()
+        return out
+
+
+_store = None
+_store_configured = False
+_store_lock = threading.Lock()
+
+
+def get_price_store():
+    """Process-wide store, created on first use. None when PRICE_CACHE_DB is empty."""
+    global _store, _store_configured
+    if not _store_configured:
+        with _store_lock:
+            if not _store_configured:
+                _store = PriceStore(PRICE_CACHE_DB) if PRICE_CACHE_DB else None
+                _store_configured = True
+    return _store
+
+
+def set_price_store(store):
+    """Replace the process-wide store (None disables caching). Returns the previous one."""
+    global _store, _store_configured
+    previous = get_price_store()
+    _store, _store_configured = store, True
+    return previous
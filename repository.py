@@ -0,0 +1,200 @@
+# repository.py
+"""
+Single storage layer for expenses and investments, on the memory.py schema.
+finance_tools, advisor and ExpenseAgent all read and write through these functions,
+so every path shares the pooled engine and the (user_id, timestamp) indexes.
+Functions take a session and do not commit; callers own the unit of work.
+
+migrate_legacy() copies the old raw-sqlite finance.db (expenses / investments) into
+this store in chunks; re-running it skips rows that were already copied.
+"""
+
+import datetime
+import os
+import sqlite3
+import time
+from sqlalchemy import select, bindparam, func
+from memory import (Transaction, Investment, MonthlyCategoryTotal, bump_month_rollup, bump_data_version,
+                    month_key, get_or_create_user, get_session_factory, session_scope)
+from importer import fingerprint, parse_date, write_rows
+from utils import DATABASE_URL
+import anomaly
+import categorize
+
+LEGACY_DB = "finance.db"
+LEGACY_USER = "local_user"
+MIGRATION_CHUNK_SIZE = 5000
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"  # same text the legacy CURRENT_TIMESTAMP columns held
+
+# statements are built once; SQLAlchemy reuses their compiled form and the driver its prepared statement
+_EXPENSES = (select(Transaction.id, Transaction.category, Transaction.amount, Transaction.description,
+                    Transaction.timestamp)
+             .where(Transaction.user_id == bindparam("user_id"))
+             .order_by(Transaction.timestamp.desc(), Transaction.id.desc()))
+_EXPENSES_LIMIT = _EXPENSES.limit(bindparam("limit"))
+_INVESTMENTS = (select(Investment.id, Investment.type, Investment.symbol, Investment.amount, Investment.timestamp)
+                .where(Investment.user_id == bindparam("user_id"))
+                .order_by(Investment.timestamp.desc(), Investment.id.desc()))
+_INVESTMENTS_LIMIT = _INVESTMENTS.limit(bindparam("limit"))
+_FLAGGED = (select(Transaction.id, Transaction.category, Transaction.amount, Transaction.description,
+                   Transaction.timestamp, Transaction.anomaly_score)
+            .where(Transaction.user_id == bindparam("user_id"), Transaction.anomaly_score.is_not(None))
+            .order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+            .limit(bindparam("limit")))
+_ROLLUP_MONTH = (select(MonthlyCategoryTotal.category, MonthlyCategoryTotal.total)
+                 .where(MonthlyCategoryTotal.user_id == bindparam("user_id"),
+                        MonthlyCategoryTotal.month == bindparam("month")))
+_GROUP_BY_MONTH = (select(Transaction.category, func.sum(Transaction.amount))
+                   .where(Transaction.user_id == bindparam("user_id"),
+                          Transaction.timestamp >= bindparam("start"))
+                   .group_by(Transaction.category))
+
+
+def _rows(session, statement, limit_statement, limit, **params):
+    if limit is None:
+        return session.execute(statement, params).all()
+    return session.execute(limit_statement, dict(params, limit=int(limit))).all()
+
+
+def _format(ts):
+    return ts.strftime(TIMESTAMP_FORMAT) if ts else None
+
+
+# ---------------- expenses ----------------
+def add_transaction(session, user_id, category, amount, description=None, timestamp=None):
+    """
+    Insert an expense, bump the month rollup and score it against the category's running stats.
+    A blank category is picked from the description by the user's categorization rules.
+    Returns (transaction, anomaly verdict). Does not commit.
+    """
+    category = categorize.resolve(session, user_id, category, description, amount)
+    # the user row update comes first: it takes the write lock, so concurrent writers for this user
+    # read the category stats only after the previous one committed (no lost or duplicate stats rows)
+    bump_data_version(session, user_id)
+    verdict = anomaly.observe(session, user_id, category, amount)
+    t = Transaction(user_id=user_id, category=category, amount=amount, description=description,
+                    timestamp=timestamp or datetime.datetime.utcnow(),
+                    anomaly_score=verdict["score"] if verdict["flagged"] else None)
+    session.add(t)
+    bump_month_rollup(session, user_id, month_key(t.timestamp), category, amount)
+    return t, verdict
+
+
+def recent_expenses(session, user_id, limit=None):
+    """(id, category, amount, description, date) newest first, the legacy expenses row shape."""
+    return [(i, c, a, d, _format(ts)) for i, c, a, d, ts in
+            _rows(session, _EXPENSES, _EXPENSES_LIMIT, limit, user_id=user_id)]
+
+
+def flagged_expenses(session, user_id, limit=10):
+    """(id, category, amount, description, date, score) of the newest flagged expenses."""
+    return [(i, c, a, d, _format(ts), score) for i, c, a, d, ts, score in
+            session.execute(_FLAGGED, {"user_id": user_id, "limit": int(limit)})]
+
+
+def monthly_summary(session, user_id, now=None, use_rollup=True):
+    """{category: total} for the current month, from the rollup or one GROUP BY."""
+    now = now or datetime.datetime.utcnow()
+    if use_rollup:
+        rows = session.execute(_ROLLUP_MONTH, {"user_id": user_id, "month": month_key(now)})
+    else:
+        rows = session.execute(_GROUP_BY_MONTH, {"user_id": user_id,
+                                                 "start": datetime.datetime(now.year, now.month, 1)})
+    return {category: total for category, total in rows}
+
+
+# ---------------- investments ----------------
+def add_investment(session, user_id, type, symbol, amount, timestamp=None):
+    """Record an investment. Does not commit."""
+    inv = Investment(user_id=user_id, type=type, symbol=symbol, amount=amount,
+                     timestamp=timestamp or datetime.datetime.utcnow())
+    session.add(inv)
+    return inv
+
+
+def recent_investments(session, user_id, limit=None):
+    """(id, type, symbol, amount, date) newest first, the legacy investments row shape."""
+    return [(i, t, s, a, _format(ts)) for i, t, s, a, ts in
+            _rows(session, _INVESTMENTS, _INVESTMENTS_LIMIT, limit, user_id=user_id)]
+
+
+# ---------------- legacy migration ----------------
+def _legacy_timestamp(raw):
+    if not raw:
+        return datetime.datetime.utcnow()
+    try:
+        return datetime.datetime.fromisoformat(str(raw))
+    except ValueError:
+        return parse_date(raw)
+
+
+def _legacy_tables(conn):
+    return {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _migrate_expenses(conn, session, user, chunk_size, report):
+    cursor = conn.execute("SELECT id, category, amount, description, date FROM expenses ORDER BY id")
+    while True:
+        batch = cursor.fetchmany(chunk_size)
+        if not batch:
+            break
+        rows = []
+        for legacy_id, category, amount, description, date in batch:
+            ts = _legacy_timestamp(date)
+            rows.append({"user_id": user.id, "category": category, "amount": float(amount), "timestamp": ts,
+                         "description": description or "",
+                         # the legacy id keeps genuinely repeated expenses apart
+                         "fingerprint": fingerprint(ts, float(amount), f"finance.db#{legacy_id} {description or ''}")})
+        inserted = write_rows(session, user.id, rows)
+        report["expenses"] += inserted
+        report["skipped"] += len(rows) - inserted
+
+
+def _migrate_investments(conn, session, user, chunk_size, report):
+    cursor = conn.execute("SELECT id, type, symbol, amount, date FROM investments ORDER BY id")
+    while True:
+        batch = cursor.fetchmany(chunk_size)
+        if not batch:
+            break
+        ids = [row[0] for row in batch]
+        done = {i for (i,) in session.query(Investment.legacy_id).filter(
+            Investment.user_id == user.id, Investment.legacy_id.in_(ids))}
+        fresh = [{"user_id": user.id, "type": type, "symbol": symbol, "amount": float(amount),
+                  "timestamp": _legacy_timestamp(date), "legacy_id": legacy_id}
+                 for legacy_id, type, symbol, amount, date in batch if legacy_id not in done]
+        if fresh:
+            session.connection().execute(Investment.__table__.insert(), fresh)
+        session.commit()
+        report["investments"] += len(fresh)
+        report["skipped"] += len(batch) - len(fresh)
+
+
+def migrate_legacy(legacy_path=LEGACY_DB, db_uri=DATABASE_URL, user_name=LEGACY_USER,
+                   chunk_size=MIGRATION_CHUNK_SIZE):
+    """
+    Stream finance.db rows into the unified store under user_name, one commit per chunk.
+    Safe to re-run: already copied rows are skipped. Returns counts and timing.
+    """
+    report = {"expenses": 0, "investments": 0, "skipped": 0}
+    if not os.path.exists(legacy_path):
+        report["error"] = f"{legacy_path} not found"
+        return report
+    started = time.perf_counter()
+    conn = sqlite3.connect(legacy_path)
+    try:
+        tables = _legacy_tables(conn)
+        with session_scope(get_session_factory(db_uri)) as session:
+            user = get_or_create_user(session, name=user_name)
+            if "expenses" in tables:
+                _migrate_expenses(conn, session, user, chunk_size, report)
+            if "investments" in tables:
+                _migrate_investments(conn, session, user, chunk_size, report)
+    finally:
+        conn.close()
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    print(migrate_legacy(*sys.argv[1:2]))
@@ -0,0 +1,194 @@
+# risk.py
+"""
+Tail risk for an allocation: Monte Carlo (normal) and historical bootstrap simulation
+of a constant-mix portfolio, reporting VaR, CVaR, max drawdown and goal-hit probability.
+
+Weights are fixed (rebalanced daily), so each path only needs the portfolio's daily
+return, not every asset's. Paths are simulated once to the longest horizon in chunks of
+chunk_size rows; a chunk keeps only each path's return and max drawdown at the requested
+horizons, so memory is bounded by chunk_size x horizon whatever the path count.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from portfolio import compute_returns
+from utils import RISK_SIM_WORKERS
+
+HORIZONS = {"1w": 5, "1m": 21, "3m": 63, "1y": 252}  # trading days
+CONFIDENCE_LEVELS = (0.95, 0.99)
+DEFAULT_PATHS = 100_000
+CHUNK_PATHS = 10_000
+METHODS = ("montecarlo", "bootstrap")
+SIMULATION_CACHE_SIZE = 8
+
+
+def portfolio_returns(price_df, weights):
+    """Daily simple returns of the constant-mix portfolio (weights renormalised over the frame's columns)."""
+    weights = pd.Series(weights, dtype=float).reindex(price_df.columns).fillna(0.0)
+    if weights.sum() <= 0:
+        raise ValueError("Weights must be positive for at least one priced ticker")
+    weights = weights / weights.sum()
+    return compute_returns(price_df).values @ weights.values
+
+
+def _chunk_returns(rng, method, history, n_paths, horizon, block_size):
+    """(n_paths, horizon) daily log returns, float32 (ample for summed daily returns, half the memory)."""
+    if method == "montecarlo":
+        out = rng.standard_normal(size=(n_paths, horizon), dtype=np.float32)
+        out *= history.std(ddof=1)
+        out += history.mean()
+        return out
+    if block_size <= 1:
+        return history[rng.integers(0, len(history), size=(n_paths, horizon))]
+    # moving-block bootstrap keeps short-range autocorrelation (volatility clustering)
+    n_blocks = -(-horizon // block_size)
+    starts = rng.integers(0, len(history) - block_size + 1, size=(n_paths, n_blocks, 1))
+    idx = (starts + np.arange(block_size)).reshape(n_paths, -1)[:, :horizon]
+    return history[idx]
+
+
+def _simulate_chunk(args):
+    """Simulate one chunk; returns (returns, max drawdowns), each (n_paths, len(steps))."""
+    method, history, n_paths, steps, block_size, seed = args
+    rng = np.random.default_rng(seed)
+    horizon = steps[-1]
+    log_wealth = _chunk_returns(rng, method, history, n_paths, horizon, block_size)
+    np.cumsum(log_wealth, axis=1, out=log_wealth)
+    # drawdown in log space: running peak (starting at 0 = initial value) minus current
+    drawdown = np.maximum(log_wealth, 0.0)
+    np.maximum.accumulate(drawdown, axis=1, out=drawdown)
+    np.subtract(drawdown, log_wealth, out=drawdown)
+    np.maximum.accumulate(drawdown, axis=1, out=drawdown)
+    cols = np.asarray(steps) - 1
+    return np.expm1(log_wealth[:, cols]), -np.expm1(-drawdown[:, cols])
+
+
+class Simulation:
+    """Per-horizon path outcomes from one simulate() run; metrics are computed on demand."""
+
+    def __init__(self, horizons, returns, drawdowns, method, seconds):
+        self.horizons = horizons          # {name: trading days}
+        self.returns = returns            # (n_paths, n_horizons) simple return over each horizon
+        self.drawdowns = drawdowns        # (n_paths, n_horizons) max drawdown within each horizon
+        self.method = method
+        self.seconds = seconds
+
+    @property
+    def n_paths(self):
+        return len(self.returns)
+
+    def _col(self, horizon):
+        return list(self.horizons).index(horizon)
+
+    def var(self, horizon, confidence=0.95):
+        """Value at risk as a positive fraction of the starting value."""
+        return float(-np.quantile(self.returns[:, self._col(horizon)], 1 - confidence))
+
+    def cvar(self, horizon, confidence=0.95):
+        """Expected loss in the worst (1 - confidence) tail, as a positive fraction."""
+        r = self.returns[:, self._col(horizon)]
+        tail = r[r <= np.quantile(r, 1 - confidence)]
+        return float(-tail.mean())
+
+    def goal_probability(self, horizon, initial_value, goal_value):
+        """Share of paths ending at or above goal_value."""
+        needed = goal_value / initial_value - 1
+        return float((self.returns[:, self._col(horizon)] >= needed).mean())
+
+    def report(self, initial_value=None, goal_value=None, confidence_levels=CONFIDENCE_LEVELS):
+        out = {}
+        for name, days in self.horizons.items():
+            col = self._col(name)
+            r, dd = self.returns[:, col], self.drawdowns[:, col]
+            row = {"days": days, "expected_return": float(r.mean()), "median_return": float(np.median(r)),
+                   "prob_loss": float((r < 0).mean()),
+                   "max_drawdown": {"median": float(np.median(dd)), "p95": float(np.quantile(dd, 0.95)),
+                                    "worst": float(dd.max())}}
+            for c in confidence_levels:
+                key = int(round(c * 100))
+                row[f"var_{key}"] = self.var(name, c)
+                row[f"cvar_{key}"] = self.cvar(name, c)
+                if initial_value:
+                    row[f"var_{key}_amount"] = round(row[f"var_{key}"] * initial_value, 2)
+                    row[f"cvar_{key}_amount"] = round(row[f"cvar_{key}"] * initial_value, 2)
+            if initial_value and goal_value:
+                row["goal_probability"] = self.goal_probability(name, initial_value, goal_value)
+            out[name] = row
+        return out
+
+
+def simulate(daily_returns, horizons=None, n_paths=DEFAULT_PATHS, method="montecarlo",
+             chunk_size=CHUNK_PATHS, workers=None, seed=0, block_size=1):
+    """
+    Simulate n_paths portfolio paths to the longest horizon, once, and keep the outcome
+    at every horizon. daily_returns are the portfolio's historical simple returns.
+    workers > 1 spreads chunks over a process pool; results do not depend on it because
+    every chunk has its own seed.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown simulation method {method}")
+    history = np.log1p(np.asarray(daily_returns, dtype=float))
+    history = history[np.isfinite(history)].astype(np.float32)
+    if len(history) < 2:
+        raise ValueError("Need at least two daily returns to simulate")
+    horizons = dict(sorted((horizons or HORIZONS).items(), key=lambda kv: kv[1]))
+    steps = list(horizons.values())
+    block_size = max(1, min(int(block_size), len(history)))
+    workers = RISK_SIM_WORKERS if workers is None else workers
+
+    sizes = [min(chunk_size, n_paths - start) for start in range(0, n_paths, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(method, history, n, steps, block_size, s) for n, s in zip(sizes, seeds)]
+
+    started = time.perf_counter()
+    if workers and workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(_simulate_chunk, jobs))
+    else:
+        parts = [_simulate_chunk(job) for job in jobs]
+    returns = np.concatenate([p[0] for p in parts])
+    drawdowns = np.concatenate([p[1] for p in parts])
+    return Simulation(horizons, returns, drawdowns, method, time.perf_counter() - started)
+
+
+_simulations = OrderedDict()
+_simulations_lock = threading.Lock()
+
+
+def cached_simulate(daily_returns, horizons=None, n_paths=DEFAULT_PATHS, method="montecarlo",
+                    seed=0, block_size=1, workers=None):
+    """simulate() memoised on its inputs, so changing only the goal or capital does not re-simulate."""
+    data = np.ascontiguousarray(daily_returns, dtype=float)
+    key = (hashlib.sha1(data.tobytes()).hexdigest(), tuple(sorted((horizons or HORIZONS).items())),
+           n_paths, method, seed, block_size)
+    with _simulations_lock:
+        sim = _simulations.get(key)
+        if sim is not None:
+            _simulations.move_to_end(key)
+            return sim
+    sim = simulate(data, horizons, n_paths, method, workers=workers, seed=seed, block_size=block_size)
+    with _simulations_lock:
+        _simulations[key] = sim
+        while len(_simulations) > SIMULATION_CACHE_SIZE:
+            _simulations.popitem(last=False)
+    return sim
+
+
+def risk_report(price_df, weights, initial_value=None, goal_value=None, horizons=None,
+                n_paths=DEFAULT_PATHS, method="montecarlo", seed=0, block_size=1, workers=None):
+    """Simulate the allocation on price_df's history and summarise its risk per horizon."""
+    daily = portfolio_returns(price_df, weights)
+    sim = cached_simulate(daily, horizons, n_paths, method, seed, block_size, workers)
+    return {
+        "method": sim.method,
+        "n_paths": sim.n_paths,
+        "history_days": len(daily),
+        "seconds": round(sim.seconds, 3),
+        "paths_per_second": round(sim.n_paths / sim.seconds) if sim.seconds > 0 else None,
+        "horizons": sim.report(initial_value, goal_value),
+    }
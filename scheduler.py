@@ -0,0 +1,214 @@
+# scheduler.py
+"""
+Background refresh, so interactive requests read warm data instead of waiting on it.
+- prices: the tickers held in any position or Portfolio or on any User.watchlist are topped
+  up in the price store for PREWARM_PERIOD (which covers every shorter period the app asks
+  for), every PREWARM_PRICE_INTERVAL seconds while the market is open and once after the
+  close; the latest closes then reprice the ledger's positions and today's NAV points.
+- reports: every night at REPORT_PREWARM_HOUR (market timezone) each user's expense report
+  and goal progress are stored as snapshots by batch_reports.py; users whose inputs did not
+  change since the last run are skipped.
+Every run is delayed by up to SCHEDULER_JITTER of its interval so workers do not fire in
+step; a failing job retries with exponential backoff capped at SCHEDULER_MAX_BACKOFF.
+
+Runs as a daemon thread (Scheduler.start(), used by the Streamlit app when
+SCHEDULER_ENABLED=1) or as a standalone worker: python scheduler.py [--once]
+"""
+
+import datetime
+import json
+import random
+import sys
+import threading
+import time
+from memory import User, Portfolio, Position, session_scope
+from data_fetchers import fetch_stock_histories, latest_prices
+import ledger
+import metrics
+from utils import (PREWARM_PRICE_INTERVAL, PREWARM_PERIOD, REPORT_PREWARM_HOUR, SCHEDULER_JITTER,
+                   SCHEDULER_MAX_BACKOFF, MARKET_TIMEZONE, BATCH_REPORT_CHUNK_SIZE, market_is_open,
+                   last_market_close, next_market_open)
+
+BASE_BACKOFF = 30  # seconds before the first retry of a failed run
+MAX_SLEEP = 60  # the worker thread wakes at least this often to notice stop() and new jobs
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _json_value(value, default):
+    if isinstance(value, str):
+        try:
+            return json.loads(value or "null") or default
+        except ValueError:
+            return default
+    return value or default
+
+
+# ---------------- jobs ----------------
+def watched_tickers(session):
+    """Sorted tickers held in any position or portfolio or on any watchlist."""
+    tickers = {s for (s,) in session.query(Position.symbol).filter(Position.quantity != 0).distinct()}
+    for (holdings,) in session.query(Portfolio.holdings):
+        tickers.update(_json_value(holdings, {}))
+    for (watchlist,) in session.query(User.watchlist):
+        tickers.update(_json_value(watchlist, []))
+    return sorted({str(t).strip().upper() for t in tickers if str(t).strip()})
+
+
+def prewarm_prices(factory=None, period=PREWARM_PERIOD, max_age=None):
+    """Top up every watched ticker in the price store and reprice the ledger. Returns the number of tickers."""
+    with session_scope(factory) as session:
+        tickers = watched_tickers(session)
+    if tickers:
+        if max_age is None:
+            # after the close, anything fetched before it still lacks the closing bar
+            max_age = PREWARM_PRICE_INTERVAL if market_is_open() else 0
+        prices = latest_prices(fetch_stock_histories(tickers, period=period, max_age=max_age))
+        with session_scope(factory) as session:
+            ledger.apply_prices(session, prices)
+    metrics.inc("prewarmed_tickers_total", len(tickers))
+    return len(tickers)
+
+
+def prewarm_reports(factory=None, chunk_size=BATCH_REPORT_CHUNK_SIZE, annual_return=None):
+    """Store each user's expense report and goal progress snapshots. Returns the number refreshed."""
+    import batch_reports  # pandas/NumPy, only in the process that runs the job
+    refreshed = batch_reports.generate(factory, chunk_size=chunk_size, annual_return=annual_return,
+                                       only_changed=True)["written"]
+    metrics.inc("prewarmed_reports_total", refreshed)
+    return refreshed
+
+
+# ---------------- schedules: seconds until the next run ----------------
+def price_delay(now, last_run):
+    if market_is_open(now):
+        return PREWARM_PRICE_INTERVAL
+    if last_run is None or last_run < last_market_close(now):
+        return 0  # one refresh after the close picks up the closing bars
+    return (next_market_open(now) - now).total_seconds()
+
+
+def report_delay(now, last_run):
+    from zoneinfo import ZoneInfo
+    local = now.astimezone(ZoneInfo(MARKET_TIMEZONE))
+    due = local.replace(hour=REPORT_PREWARM_HOUR, minute=0, second=0, microsecond=0)
+    if due <= local:
+        due += datetime.timedelta(days=1)
+    return (due - local).total_seconds()
+
+
+class Job:
+    def __init__(self, name, fn, delay, jitter=SCHEDULER_JITTER, max_backoff=SCHEDULER_MAX_BACKOFF):
+        self.name = name
+        self.fn = fn
+        self.delay = delay  # delay(now, last_run) -> seconds
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.due = None
+        self.last_run = None
+        self.last_error = None
+        self.last_seconds = None
+        self.runs = 0
+        self.failures = 0  # consecutive
+
+    def schedule(self, now):
+        delay = max(self.delay(now, self.last_run), 0)
+        self.due = now + datetime.timedelta(seconds=delay + random.uniform(0, self.jitter * delay))
+
+    def run(self, now):
+        started = time.perf_counter()
+        try:
+            with metrics.timer("scheduler_job_seconds", job=self.name):
+                self.fn()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            metrics.inc("scheduler_job_errors_total", job=self.name)
+            print(f"scheduler job {self.name} failed ({self.failures} in a row):", e)
+            backoff = min(BASE_BACKOFF * 2 ** (self.failures - 1), self.max_backoff)
+            self.due = now + datetime.timedelta(seconds=backoff * (1 + random.uniform(0, self.jitter)))
+        else:
+            self.runs += 1
+            self.failures = 0
+            self.last_error = None
+            self.last_run = now
+            self.schedule(now + datetime.timedelta(seconds=time.perf_counter() - started))
+        finally:
+            self.last_seconds = time.perf_counter() - started
+
+    def status(self):
+        return {"job": self.name, "due": self.due.isoformat() if self.due else None,
+                "last_run": self.last_run.isoformat() if self.last_run else None,
+                "last_seconds": self.last_seconds, "runs": self.runs, "failures": self.failures,
+                "last_error": self.last_error}
+
+
+def default_jobs(factory=None):
+    return [Job("prices", lambda: prewarm_prices(factory), price_delay),
+            Job("reports", lambda: prewarm_reports(factory), report_delay)]
+
+
+class Scheduler:
+    def __init__(self, jobs=None, factory=None):
+        self.jobs = jobs if jobs is not None else default_jobs(factory)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_pending(self, now=None):
+        """Run every job that is due; returns their names."""
+        now = now or _utcnow()
+        ran = []
+        for job in self.jobs:
+            if job.due is None:
+                job.schedule(now)
+            if job.due <= now:
+                job.run(now)
+                ran.append(job.name)
+        return ran
+
+    def run_all(self):
+        """Run every job once now, whatever its schedule (e.g. from cron or at deploy)."""
+        for job in self.jobs:
+            job.run(_utcnow())
+
+    def _sleep_seconds(self):
+        now = _utcnow()
+        dues = [(job.due - now).total_seconds() for job in self.jobs if job.due is not None]
+        return min([MAX_SLEEP] + [max(d, 0) for d in dues])
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            self.run_pending()
+            self._stop.wait(self._sleep_seconds())
+
+    def start(self):
+        """Run in a daemon thread; once per Scheduler."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def status(self):
+        return [job.status() for job in self.jobs]
+
+
+if __name__ == "__main__":
+    scheduler = Scheduler()
+    if "--once" in sys.argv[1:]:
+        scheduler.run_all()
+        print(json.dumps(scheduler.status(), indent=2))
+    else:
+        print("scheduler running; Ctrl+C to stop")
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
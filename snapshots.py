@@ -0,0 +1,72 @@
+# snapshots.py
+"""
+Precomputed reports (ReportSnapshot rows), written by the scheduler's nightly job and read
+by ExpenseAgent.expense_report and GoalAgent.progress before computing anything.
+Each snapshot stores the key of the inputs it was computed from: the month, the user's
+data_version (bumped by every expense write), income and, for goals, a hash of the goals
+and the assumed return. A snapshot whose key no longer matches is a miss, never a stale hit.
+"""
+
+import datetime
+import hashlib
+import json
+from sqlalchemy import delete
+from memory import ReportSnapshot
+import metrics
+
+EXPENSE_REPORT = "expense_report"
+GOAL_PROGRESS = "goal_progress"
+
+
+def inputs_key(user, kind, annual_return=None, now=None):
+    now = now or datetime.datetime.utcnow()
+    parts = [kind, now.strftime("%Y-%m"), str(user.data_version or 0), repr(float(user.income or 0))]
+    if kind == GOAL_PROGRESS:
+        goals = user.goals if isinstance(user.goals, str) else json.dumps(user.goals or [])
+        parts += [hashlib.sha1((goals or "").encode()).hexdigest(), repr(float(annual_return or 0))]
+    return "|".join(parts)
+
+
+def _row(session, user_id, kind):
+    return session.query(ReportSnapshot).filter_by(user_id=user_id, kind=kind).first()
+
+
+def keys(session, user_ids):
+    """{(user_id, kind): inputs key} of the stored snapshots, one query for many users."""
+    return {(u, kind): key for u, kind, key in session.query(
+        ReportSnapshot.user_id, ReportSnapshot.kind, ReportSnapshot.inputs).filter(
+        ReportSnapshot.user_id.in_(user_ids))}
+
+
+def load(session, user, kind, key):
+    """The stored payload when it was computed from the same inputs, else None."""
+    row = _row(session, user.id, kind)
+    hit = row is not None and row.inputs == key
+    metrics.cache_access("report_snapshot", hit)
+    return row.payload if hit else None
+
+
+def store(session, user, kind, key, payload):
+    """Insert or replace the user's snapshot of kind. Does not commit."""
+    row = _row(session, user.id, kind)
+    if row is None:
+        row = ReportSnapshot(user_id=user.id, kind=kind)
+        session.add(row)
+    row.inputs, row.payload, row.computed_at = key, payload, datetime.datetime.utcnow()
+    return row
+
+
+def store_many(session, rows):
+    """
+    Insert or replace snapshots from (user_id, kind, key, payload) rows with one DELETE and one
+    INSERT; every kind present is replaced for every user present. Does not commit.
+    """
+    if not rows:
+        return 0
+    now = datetime.datetime.utcnow()
+    session.execute(delete(ReportSnapshot).where(ReportSnapshot.user_id.in_({r[0] for r in rows}),
+                                                 ReportSnapshot.kind.in_({r[1] for r in rows})))
+    session.connection().execute(ReportSnapshot.__table__.insert(), [
+        {"user_id": u, "kind": kind, "inputs": key, "payload": payload, "computed_at": now}
+        for u, kind, key, payload in rows])
+    return len(rows)
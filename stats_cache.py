@@ -0,0 +1,193 @@
+# stats_cache.py
+"""
+Return statistics shared across users and requests, so overlapping baskets do not
+recompute the same covariance on every click.
+Statistics are cached per date span (the window label and the exact run of return dates):
+each ticker's return series, its sum, and the Gram matrix (sums of cross products) of
+every pair of tickers cached on the span. A request's mean vector and covariance matrix
+are sliced out of that block; only tickers the span has not seen yet cost a product, and
+only against the cached columns (O(k·m·T), not O(n²·T)).
+When a newer bar arrives, the previous span's block is rolled forward instead: the dropped
+oldest rows are subtracted and the new rows added (O(n²·(dropped + added))). After
+MAX_ROLLS rolls a span is recomputed from scratch so rounding cannot accumulate.
+A cached series is reused only when it equals the requested one exactly, so differences
+in how two baskets were aligned never leak between them. The last MAX_BASKETS results
+assembled on a span are kept too, so asking for the same basket again is one comparison.
+Spans are evicted least recently used beyond STATS_CACHE_MAX_BLOCKS; a span that grows
+past STATS_CACHE_MAX_TICKERS is restarted with just the requested tickers.
+"""
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import metrics
+from utils import STATS_CACHE_MAX_BLOCKS, STATS_CACHE_MAX_TICKERS
+
+MAX_ROLLS = 250  # about a year of daily bars
+MAX_BASKETS = 64  # assembled results kept per span, for repeat requests of the same basket
+
+
+class _Block:
+    """Returns (T x m), their column sums and Gram matrix for the tickers cached on one span."""
+
+    def __init__(self, dates, rolls=0):
+        self.dates = dates
+        self.rolls = rolls
+        self.tickers = []
+        self.pos = {}
+        self.X = np.empty((len(dates), 0))
+        self.sums = np.empty(0)
+        self.gram = np.empty((0, 0))
+        self.baskets = OrderedDict()  # tuple(tickers) -> (positions, mean, covariance) last assembled
+
+    def add(self, tickers, X):
+        """Append the columns X (T x k) of tickers."""
+        m, k = len(self.tickers), len(tickers)
+        cross = X.T @ self.X
+        gram = np.empty((m + k, m + k))
+        gram[:m, :m] = self.gram
+        gram[m:, :m] = cross
+        gram[:m, m:] = cross.T
+        gram[m:, m:] = X.T @ X
+        self.gram = gram
+        self.X = np.hstack([self.X, X])
+        self.sums = np.concatenate([self.sums, X.sum(axis=0)])
+        for t in tickers:
+            self.pos[t] = len(self.tickers)
+            self.tickers.append(t)
+
+    def replace(self, columns, X):
+        """Overwrite the cached columns (positions) with X (T x k) and their Gram rows."""
+        self.baskets.clear()
+        self.X[:, columns] = X
+        self.sums[columns] = X.sum(axis=0)
+        rows = self.X.T @ X
+        self.gram[:, columns] = rows
+        self.gram[columns, :] = rows.T
+
+    def rolled(self, dates, tickers, X):
+        """
+        A block for the later span dates, carried forward from this one for the requested
+        tickers whose overlapping returns are unchanged; None when recomputing is as cheap.
+        """
+        drop = int(self.dates.searchsorted(dates[0]))
+        kept = len(self.dates) - drop
+        added = len(dates) - kept
+        if (kept <= 0 or added < 0 or drop + added >= len(dates) or self.rolls >= MAX_ROLLS
+                or not self.dates[drop:].equals(dates[:kept])):
+            return None
+        same = [(i, self.pos[t]) for i, t in enumerate(tickers)
+                if t in self.pos and np.array_equal(self.X[drop:, self.pos[t]], X[:kept, i])]
+        if not same:
+            return None
+        cols, old = [i for i, _ in same], [j for _, j in same]
+        dropped, new = self.X[:drop, old], X[kept:, cols]
+        block = _Block(dates, self.rolls + 1)
+        block.tickers = [tickers[i] for i in cols]
+        block.pos = {t: n for n, t in enumerate(block.tickers)}
+        block.X = X[:, cols].copy()
+        block.sums = self.sums[old] - dropped.sum(axis=0) + new.sum(axis=0)
+        block.gram = self.gram[np.ix_(old, old)] - dropped.T @ dropped + new.T @ new
+        return block
+
+
+class StatsCache:
+    def __init__(self, max_blocks=STATS_CACHE_MAX_BLOCKS, max_tickers=STATS_CACHE_MAX_TICKERS):
+        self.max_blocks = max_blocks
+        self.max_tickers = max_tickers
+        self._blocks = OrderedDict()  # span key -> _Block, least recently used first
+        self._latest = {}  # window -> key of its most recent span, the base for rolling forward
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "rolled": 0, "computed_columns": 0}
+
+    def _block(self, key, window, dates, tickers, X):
+        block = self._blocks.get(key)
+        if block is not None and block.dates.equals(dates):
+            self._blocks.move_to_end(key)
+            return block
+        block = None
+        previous = self._blocks.get(self._latest.get(window))
+        if previous is not None and previous.dates[-1] < dates[-1]:
+            block = previous.rolled(dates, tickers, X)
+            if block is not None:
+                self.stats["rolled"] += 1
+                metrics.inc("stats_cache_rolls_total")
+        self._blocks[key] = block or _Block(dates)
+        latest = self._blocks.get(self._latest.get(window))
+        if latest is None or latest.dates[-1] <= dates[-1]:
+            self._latest[window] = key
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        return self._blocks[key]
+
+    def moments(self, returns, window=None):
+        """
+        Daily mean returns (Series) and sample covariance (DataFrame, ddof=1) of a returns
+        frame without missing values, assembled from the cache.
+        """
+        tickers = list(returns.columns)
+        X = returns.to_numpy(dtype=float)
+        dates = returns.index
+        T = len(dates)
+        stamps = np.asarray(dates)
+        key = (window, dates[-1], T, hash(stamps.tobytes() if stamps.dtype != object else tuple(stamps)))
+        with self._lock:
+            block = self._block(key, window, dates, tickers, X)
+            basket = block.baskets.get(tuple(tickers))
+            if basket is not None and (block.X[:, basket[0]] == X).all():
+                block.baskets.move_to_end(tuple(tickers))
+                self.stats["hits"] += 1
+                metrics.cache_access("stats_cache", True)
+                return basket[1].copy(), basket[2].copy()
+            new = [i for i, t in enumerate(tickers) if t not in block.pos]
+            cached = [i for i, t in enumerate(tickers) if t in block.pos]
+            columns = [block.pos[tickers[i]] for i in cached]
+            same = (block.X[:, columns] == X[:, cached]).all(axis=0)
+            changed = [i for i, ok in zip(cached, same) if not ok]
+            columns = [j for j, ok in zip(columns, same) if not ok]
+            if changed:
+                block.replace(columns, X[:, changed])
+            if new and len(block.tickers) + len(new) > self.max_tickers:
+                block = self._blocks[key] = _Block(dates)
+                new = list(range(len(tickers)))
+            if new:
+                block.add([tickers[i] for i in new], X[:, new])
+            hit = not new and not changed
+            self.stats["hits" if hit else "misses"] += 1
+            self.stats["computed_columns"] += len(new) + len(changed)
+            idx = np.array([block.pos[t] for t in tickers])
+            mean = block.sums[idx] / T
+            cov = (block.gram[np.ix_(idx, idx)] - T * np.outer(mean, mean)) / (T - 1)
+            mean, cov = pd.Series(mean, index=tickers), pd.DataFrame(cov, index=tickers, columns=tickers)
+            block.baskets[tuple(tickers)] = (idx, mean, cov)
+            while len(block.baskets) > MAX_BASKETS:
+                block.baskets.popitem(last=False)
+        metrics.cache_access("stats_cache", hit)
+        return mean.copy(), cov.copy()
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, blocks=len(self._blocks),
+                        tickers=sum(len(b.tickers) for b in self._blocks.values()))
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._latest.clear()
+            self.stats.update(hits=0, misses=0, rolled=0, computed_columns=0)
+
+
+_cache = StatsCache()
+
+
+def moments(returns, window=None):
+    return _cache.moments(returns, window)
+
+
+def cache_info():
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
@@ -1,13 +1,87 @@
 # streamlit_app.py
+import io
+import json
+import time
+import statistics
 import streamlit as st
-import pandas as pd
 import matplotlib.pyplot as plt
-from memory import init_db, get_or_create_user
+import pandas as pd
+from memory import User, get_session_factory, get_or_create_user, session_scope
 from crew import Crew
+import metrics
+import snapshots
 import tasks
+from utils import METRICS_PORT, SCHEDULER_ENABLED
+
+rerun_started = time.perf_counter()
+
+EXPENSES, GOALS, INVESTMENTS, TRENDS, PROFILE = ("💵 Expenses", "🎯 Goals", "📈 Investments", "📊 Trends",
+                                                 "👤 Profile")
+RERUN_HISTORY = 50
+
+
+# ----------------- Cached resources -----------------
+@st.cache_resource
+def session_factory():
+    # engine + create_all run once per process, not on every rerun
+    return get_session_factory()
+
+
+@st.cache_resource
+def metrics_server():
+    # /metrics and /metrics.json for scraping; started once per process
+    return metrics.serve(METRICS_PORT) if METRICS_PORT else None
+
+
+@st.cache_resource
+def background_scheduler():
+    # keeps watched prices and nightly report snapshots warm; one thread per process
+    if not SCHEDULER_ENABLED:
+        return None
+    from scheduler import Scheduler
+    return Scheduler(factory=session_factory()).start()
+
+
+def reload_user(user_id):
+    # a write in this rerun bumped User.data_version (or changed goals); the loaders below are keyed on them
+    with session_scope(session_factory()) as session:
+        return session.get(User, user_id)
+
+
+# the loaders are keyed on the user's DB-backed data_version (snapshots.inputs_key), so writes from
+# the API, the importer or another process invalidate them too
+@st.cache_data(max_entries=256)
+def load_expense_report(_crew, user_id, key):
+    return _crew.kickoff({"action": tasks.EXPENSE_REPORT}).get("result") or {}
+
+
+@st.cache_data(max_entries=256)
+def load_goal_progress(_crew, user_id, key):
+    return _crew.kickoff({"action": tasks.GOAL_PROGRESS}).get("result") or []
+
+
+@st.cache_data(max_entries=256)
+def load_flagged(_crew, user_id, version):
+    return _crew.kickoff({"action": tasks.FLAGGED_TRANSACTIONS}).get("result") or []
+
+
+@st.cache_data(max_entries=256)
+def load_spending_trends(_crew, user_id, window, version):
+    return _crew.kickoff({"action": tasks.SPENDING_TRENDS, "window": window}).get("result") or {}
+
+
+@st.cache_data(max_entries=256)
+def render_pie(categories):
+    fig, ax = plt.subplots(figsize=(3, 3))
+    ax.pie([amount for _, amount in categories], labels=[name for name, _ in categories],
+           autopct='%1.1f%%', startangle=90)
+    ax.set_title("Expenses Distribution", fontsize=10)
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", bbox_inches="tight", dpi=120)
+    plt.close(fig)
+    return buf.getvalue()
+
 
-# Initialize DB & session
-session = init_db()
 st.set_page_config(page_title="Smart Financial Coach (Crew)", layout="wide")
 st.title("💰 Smart Financial Coach — Crew Mode")
 
@@ -17,50 +91,98 @@ user_name = st.sidebar.text_input("Enter your name", "Local User")
 user_income = st.sidebar.number_input("Monthly Income (₹)", min_value=0.0, value=0.0)
 user_risk = st.sidebar.selectbox("Risk Tolerance", ["low", "medium", "high"])
 
-# Get or create user and persist basic profile
-user = get_or_create_user(session, name=user_name)
-user.income = float(user_income)
-user.risk_tolerance = user_risk
-session.commit()
+# Get or create user and persist basic profile (only when it changed)
+with session_scope(session_factory()) as session:
+    user = get_or_create_user(session, name=user_name)
+    if user.income != float(user_income) or user.risk_tolerance != user_risk:
+        user.income = float(user_income)
+        user.risk_tolerance = user_risk
 
-# create crew instance
-crew = Crew(session, user)
+# create crew instance; every task runs in its own pooled session
+crew = Crew(user=user, session_factory=session_factory())
 
-# Tabs
-tab1, tab2, tab3, tab4 = st.tabs(["💵 Expenses", "🎯 Goals", "📈 Investments", "👤 Profile"])
+# Only the selected view runs its queries and rendering (st.tabs would execute all four)
+view = st.radio("View", [EXPENSES, GOALS, INVESTMENTS, TRENDS, PROFILE], horizontal=True,
+                label_visibility="collapsed", key="view")
 
 # ----------------- Expenses Tab -----------------
-with tab1:
+if view == EXPENSES:
     st.header("Track Your Expenses (Crew)")
-    category = st.text_input("Expense Category", "")
+    category = st.text_input("Expense Category", "", help="Leave blank to categorize from the description")
+    description = st.text_input("Description / merchant", "")
     amount = st.number_input("Amount (₹)", min_value=0.0)
     if st.button("Add Expense"):
-        if category and amount > 0:
-            payload = {"action": tasks.ADD_TRANSACTION, "category": category, "amount": float(amount)}
+        if (category.strip() or description.strip()) and amount > 0:
+            payload = {"action": tasks.ADD_TRANSACTION, "category": category, "amount": float(amount),
+                       "description": description}
             res = crew.kickoff(payload)
             if res.get("result"):
+                user = reload_user(user.id)
+                category = res["result"]["added"]["category"]
                 st.success(f"Added ₹{amount} to {category}")
+                verdict = res["result"]["anomaly"]
+                if verdict["flagged"]:
+                    st.warning(f"Unusual for {category}: " + "; ".join(verdict["reasons"]))
             else:
                 st.error(res.get("error", "Unknown error"))
 
-    # Expense report via crew
-    report_res = crew.kickoff({"action": tasks.EXPENSE_REPORT})
-    report = report_res.get("result") or {}
+    with st.expander("Import bank statement (CSV / OFX / QIF)"):
+        statement = st.file_uploader("Statement file", type=["csv", "ofx", "qfx", "qif"])
+        if statement is not None and st.button("Import Statement"):
+            fmt = statement.name.rsplit(".", 1)[-1].lower()
+            res = crew.kickoff({"action": tasks.IMPORT_TRANSACTIONS, "file": statement, "format": fmt})
+            if res.get("result"):
+                summary = res["result"]
+                if summary["inserted"]:
+                    user = reload_user(user.id)
+                st.success(f"Imported {summary['inserted']} transactions "
+                           f"({summary['duplicates']} duplicates skipped, {summary['rows_per_second']} rows/s)")
+                if summary["flagged"]:
+                    st.warning(f"{summary['flagged']} imported transactions look unusual")
+                if summary["errors"]:
+                    st.warning(f"{len(summary['errors'])} rows could not be imported")
+                    st.json(summary["errors"])
+            else:
+                st.error(res.get("error", "Import failed"))
+
+    with st.expander("Categorization rules"):
+        with st.form("category_rule"):
+            rule_category = st.text_input("Category")
+            rule_pattern = st.text_input("Merchant keyword or regex")
+            rule_kind = st.selectbox("Match", ["keyword", "regex"])
+            rule_min = st.number_input("Min amount (0 = any)", min_value=0.0)
+            rule_max = st.number_input("Max amount (0 = any)", min_value=0.0)
+            if st.form_submit_button("Add rule"):
+                res = crew.kickoff({"action": tasks.ADD_CATEGORY_RULE, "category": rule_category,
+                                    "pattern": rule_pattern, "kind": rule_kind,
+                                    "min_amount": rule_min or None, "max_amount": rule_max or None})
+                if res.get("result"):
+                    st.success(f"Rule added for {res['result']['category']}")
+                else:
+                    st.error(res.get("error", "Rule not added"))
+        rules = crew.kickoff({"action": tasks.CATEGORY_RULES}).get("result")
+        if rules:
+            st.dataframe(pd.DataFrame(rules), hide_index=True)
+
+    # Expense report via crew (cached until this user's data changes)
+    report = load_expense_report(crew, user.id, snapshots.inputs_key(user, snapshots.EXPENSE_REPORT))
     if report.get("categories"):
         st.subheader("Monthly Expense Summary")
         st.write(f"**Total Expenses:** ₹{report['total_expense']:.2f}")
         st.write(f"**Estimated Monthly Savings:** ₹{report['monthly_savings']:.2f}")
 
         # Pie chart
-        fig, ax = plt.subplots(figsize=(3, 3))
-        ax.pie(report['categories'].values(), labels=report['categories'].keys(), autopct='%1.1f%%', startangle=90)
-        ax.set_title("Expenses Distribution", fontsize=10)
-        st.pyplot(fig, clear_figure=True)
+        st.image(render_pie(tuple(sorted(report['categories'].items()))))
     else:
         st.info("No expenses added yet.")
 
+    flagged = load_flagged(crew, user.id, user.data_version or 0)
+    if flagged:
+        with st.expander(f"⚠️ Unusual transactions ({len(flagged)})"):
+            st.dataframe(pd.DataFrame(flagged).drop(columns="id"))
+
 # ----------------- Goals Tab -----------------
-with tab2:
+elif view == GOALS:
     st.header("Set and Track Goals (Crew)")
     goal_name = st.text_input("Goal Name", key="gname")
     goal_amount = st.number_input("Target Amount (₹)", min_value=0.0, key="gamt")
@@ -76,13 +198,13 @@ with tab2:
             }
             res = crew.kickoff(payload)
             if res.get("result"):
+                user = reload_user(user.id)
                 st.success(f"Goal '{goal_name}' added!")
             else:
                 st.error(res.get("error", "Could not add goal"))
 
     # Show progress
-    progress_res = crew.kickoff({"action": tasks.GOAL_PROGRESS})
-    goals = progress_res.get("result") or []
+    goals = load_goal_progress(crew, user.id, snapshots.inputs_key(user, snapshots.GOAL_PROGRESS))
 
     if goals:
         st.subheader("Goal Progress")
@@ -104,7 +226,7 @@ with tab2:
 
 
 # ----------------- Investments Tab -----------------
-with tab3:
+elif view == INVESTMENTS:
     st.header("Investment Suggestions (Crew)")
     tickers = st.text_input("Enter stock tickers (comma separated)", "AAPL,GOOG,MSFT")
     tickers_list = [t.strip().upper() for t in tickers.split(",") if t.strip()]
@@ -126,8 +248,57 @@ with tab3:
         else:
             st.error(res.get("error", "Unknown error"))
 
+    st.subheader("Holdings")
+    with st.form("trade_form"):
+        symbol = st.text_input("Symbol", "AAPL")
+        quantity = st.number_input("Shares (negative to sell)", value=1.0, step=1.0)
+        price = st.number_input("Price (0 = latest close)", min_value=0.0, value=0.0)
+        fees = st.number_input("Fees", min_value=0.0, value=0.0)
+        if st.form_submit_button("Record Trade"):
+            res = crew.kickoff({"action": tasks.RECORD_TRADE, "symbol": symbol, "quantity": quantity,
+                                "price": price or None, "fees": fees})
+            result = res.get("result") or {}
+            if "error" in res or "error" in result:
+                st.error(res.get("error") or result.get("error"))
+            else:
+                st.success(f"Recorded {quantity:g} {symbol.upper()} at {result['trade']['price']:.2f}")
+    res = crew.kickoff({"action": tasks.POSITIONS}).get("result") or {}
+    if res.get("positions"):
+        book = res["book"]
+        cols = st.columns(3)
+        cols[0].metric("Market Value", f"${book['market_value']:,.2f}")
+        cols[1].metric("Unrealized P&L", f"${book['unrealized_pnl']:,.2f}")
+        cols[2].metric("Realized P&L", f"${book['realized_pnl']:,.2f}")
+        st.dataframe(pd.DataFrame(res["positions"]), hide_index=True)
+        nav = (crew.kickoff({"action": tasks.NAV_HISTORY}).get("result") or {}).get("nav")
+        if nav:
+            st.line_chart(pd.DataFrame(nav).set_index("day")["nav"])
+    else:
+        st.info("No positions yet.")
+
+# ----------------- Trends Tab -----------------
+elif view == TRENDS:
+    st.header("Spending Trends")
+    window = st.slider("Rolling average window (months)", 2, 12, 3)
+    trends = load_spending_trends(crew, user.id, window, user.data_version or 0)
+    if trends.get("months"):
+        st.subheader("Monthly Spending")
+        st.line_chart(pd.DataFrame({"Total": trends["monthly_totals"],
+                                    f"{window}-month average": trends["rolling_average"]}))
+
+        st.subheader("Month over Month")
+        st.dataframe(pd.DataFrame.from_dict(trends["month_over_month"], orient="index"))
+
+        st.subheader("Top Movers (vs. recent average)")
+        st.dataframe(pd.DataFrame.from_dict(trends["top_movers"], orient="index"))
+
+        st.subheader("Seasonality (1.0 = typical month)")
+        st.bar_chart(pd.Series(trends["seasonality"], name="Total"))
+    else:
+        st.info("No expenses added yet.")
+
 # ----------------- Profile Tab -----------------
-with tab4:
+elif view == PROFILE:
     st.header("Your Profile")
     st.write(f"**Name:** {user.name}")
     st.write(f"**Monthly Income:** ₹{user.income}")
@@ -137,3 +308,43 @@ with tab4:
         st.json(user.goals)
     else:
         st.info("No goals set yet.")
+
+    watchlist = user.watchlist if isinstance(user.watchlist, list) else json.loads(user.watchlist or "[]")
+    watch_input = st.text_input("Watchlist (comma separated, kept fresh in the background)", ", ".join(watchlist))
+    if st.button("Save watchlist"):
+        tickers = list(dict.fromkeys(t.strip().upper() for t in watch_input.split(",") if t.strip()))
+        with session_scope(session_factory()) as session:
+            session.get(User, user.id).watchlist = json.dumps(tickers)
+        st.success(f"Watching {len(tickers)} tickers.")
+
+# ----------------- Debug panel -----------------
+metrics_server()
+jobs = background_scheduler()
+with st.sidebar.expander("🛠 Debug metrics"):
+    snap = metrics.snapshot()
+    if snap["timers"]:
+        st.dataframe(pd.DataFrame([dict(t, labels=", ".join(f"{k}={v}" for k, v in t["labels"].items()))
+                                   for t in snap["timers"]]), hide_index=True)
+    if snap["counters"]:
+        st.dataframe(pd.DataFrame([dict(c, labels=", ".join(f"{k}={v}" for k, v in c["labels"].items()))
+                                   for c in snap["counters"]]), hide_index=True)
+    if snap["cache_hit_ratio"]:
+        st.write("**Cache hit ratio**", snap["cache_hit_ratio"])
+    if jobs is not None:
+        st.dataframe(pd.DataFrame(jobs.status()), hide_index=True)
+    profile_action = st.selectbox("Profile one kickoff", [tasks.EXPENSE_REPORT, tasks.GOAL_PROGRESS,
+                                                          tasks.SPENDING_TRENDS, tasks.GET_STOCK_PRICES])
+    if st.button("Run profiler"):
+        res = crew.profile_kickoff({"action": profile_action, "tickers": ["AAPL", "GOOG", "MSFT"]})
+        st.caption(f"{res['profiler']}" + (f" · error: {res['error']}" if "error" in res else ""))
+        st.code(res["profile"], language="text")
+    if st.button("Reset metrics"):
+        metrics.reset()
+
+# ----------------- Rerun latency -----------------
+elapsed_ms = (time.perf_counter() - rerun_started) * 1000
+history = st.session_state.setdefault("rerun_ms", [])
+history.append(elapsed_ms)
+del history[:-RERUN_HISTORY]
+st.sidebar.caption(f"Rerun: {elapsed_ms:.0f} ms · median of last {len(history)}: "
+                   f"{statistics.median(history):.0f} ms")
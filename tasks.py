@@ -5,16 +5,102 @@ Import these from streamlit_app to avoid typos.
 """
 
 ADD_TRANSACTION = "add_transaction"
+IMPORT_TRANSACTIONS = "import_transactions"
+FLAGGED_TRANSACTIONS = "flagged_transactions"
 MONTHLY_SUMMARY = "monthly_summary"
 EXPENSE_REPORT = "expense_report"
 MONTHLY_SAVINGS = "monthly_savings"
+ADD_CATEGORY_RULE = "add_category_rule"
+CATEGORY_RULES = "category_rules"
+CATEGORIZE = "categorize"
 
 GET_STOCK_PRICES = "get_stock_prices"
 FETCH_PRICE_DF = "fetch_price_dataframe"
 GET_CRYPTO_PRICE = "get_crypto_price"
+GET_CRYPTO_PRICES = "get_crypto_prices"
 GET_NEWS = "get_news"
 
 SUGGEST_PORTFOLIO = "suggest_portfolio"
+PORTFOLIO_RISK = "portfolio_risk"
+BACKTEST_PORTFOLIO = "backtest_portfolio"
+RECORD_TRADE = "record_trade"
+POSITIONS = "positions"
+NAV_HISTORY = "nav_history"
 
 ADD_GOAL = "add_goal"
 GOAL_PROGRESS = "progress"
+
+EXPORT_TRANSACTIONS = "export_transactions"
+SPENDING_TRENDS = "spending_trends"
+
+# Crew.run_workflow steps for the dashboard: the summary is queried once and shared
+DASHBOARD_WORKFLOW = [
+    {"action": MONTHLY_SUMMARY},
+    {"action": EXPENSE_REPORT, "depends_on": [MONTHLY_SUMMARY]},
+    {"action": GOAL_PROGRESS, "depends_on": [MONTHLY_SUMMARY]},
+    {"action": GET_STOCK_PRICES, "tickers": ["AAPL", "GOOG", "MSFT"]},
+    {"action": GET_NEWS, "query": "finance"},
+]
+
+# JSON schemas for each action's kickoff inputs (the "action" key itself is implied); api.py
+# validates request bodies against them and serves them at /v1/tasks
+_TICKERS = {"type": "array", "items": {"type": "string", "minLength": 1}, "maxItems": 500}
+_SUMMARY = {"type": "object", "additionalProperties": {"type": "number"}}
+_PERIOD = {"type": "string", "pattern": "^([0-9]+(d|wk|mo|y)|ytd|max)$"}
+# {name: trading days}; risk.simulate holds chunk x longest horizon in memory, so horizons stop at five years
+_HORIZONS = {"type": "object", "additionalProperties": {"type": "integer", "minimum": 1, "maximum": 1260},
+             "maxProperties": 8}
+
+
+def _schema(properties=None, required=()):
+    return {"type": "object", "properties": properties or {}, "required": list(required)}
+
+
+TASK_SCHEMAS = {
+    ADD_TRANSACTION: dict(_schema({"category": {"type": "string"}, "amount": {"type": "number"},
+                                   "description": {"type": "string"}}, ["amount"]),
+                          anyOf=[{"required": ["category"], "properties": {"category": {"minLength": 1}}},
+                                 {"required": ["description"], "properties": {"description": {"minLength": 1}}}]),
+    IMPORT_TRANSACTIONS: _schema({"file": {"type": "string"}, "path": {"type": "string"},
+                                  "format": {"type": "string"}, "chunk_size": {"type": "integer", "minimum": 1},
+                                  "category_map": {"type": "object"}, "debits_negative": {"type": "boolean"}}),
+    FLAGGED_TRANSACTIONS: _schema({"limit": {"type": "integer", "minimum": 1, "maximum": 1000}}),
+    MONTHLY_SUMMARY: _schema(),
+    EXPENSE_REPORT: _schema({"summary": _SUMMARY}),
+    MONTHLY_SAVINGS: _schema({"summary": _SUMMARY}),
+    ADD_CATEGORY_RULE: _schema({"category": {"type": "string", "minLength": 1}, "pattern": {"type": "string"},
+                                "kind": {"enum": ["keyword", "regex"]}, "min_amount": {"type": "number"},
+                                "max_amount": {"type": "number"}, "priority": {"type": "integer"}}, ["category"]),
+    CATEGORY_RULES: _schema(),
+    CATEGORIZE: _schema({"descriptions": {"type": "array", "items": {"type": "string"}, "maxItems": 10000},
+                         "amounts": {"type": "array", "items": {"type": ["number", "null"]}}}, ["descriptions"]),
+    GET_STOCK_PRICES: _schema({"tickers": _TICKERS}, ["tickers"]),
+    FETCH_PRICE_DF: _schema({"tickers": _TICKERS, "period": _PERIOD}, ["tickers"]),
+    GET_CRYPTO_PRICE: _schema({"coin_id": {"type": "string", "minLength": 1}}),
+    GET_CRYPTO_PRICES: _schema({"coin_ids": {"type": "array", "items": {"type": "string"}, "maxItems": 250}}),
+    GET_NEWS: _schema({"query": {"type": "string", "minLength": 1}}),
+    SUGGEST_PORTFOLIO: _schema({"tickers": dict(_TICKERS, minItems=1), "current_holdings": {"type": "object"}},
+                               ["tickers"]),
+    PORTFOLIO_RISK: _schema({"tickers": dict(_TICKERS, minItems=1), "weights": _SUMMARY, "period": _PERIOD,
+                             "horizons": _HORIZONS,
+                             "n_paths": {"type": "integer", "minimum": 1, "maximum": 1_000_000},
+                             "method": {"enum": ["montecarlo", "bootstrap"]},
+                             "initial_value": {"type": "number"}, "goal_value": {"type": "number"},
+                             "block_size": {"type": "integer", "minimum": 1}}, ["tickers"]),
+    BACKTEST_PORTFOLIO: _schema({"tickers": dict(_TICKERS, minItems=1), "strategy": {"type": "string"},
+                                 "period": _PERIOD, "window": {"type": "integer", "minimum": 2},
+                                 "rebalance_every": {"type": "integer", "minimum": 1},
+                                 "cost_bps": {"type": "number", "minimum": 0},
+                                 "initial_value": {"type": "number", "exclusiveMinimum": 0}}, ["tickers"]),
+    RECORD_TRADE: _schema({"symbol": {"type": "string", "minLength": 1}, "quantity": {"type": "number", "not": {"const": 0}},
+                           "price": {"type": "number", "exclusiveMinimum": 0}, "fees": {"type": "number", "minimum": 0}},
+                          ["symbol", "quantity"]),
+    POSITIONS: _schema(),
+    NAV_HISTORY: _schema({"since": {"type": "string", "pattern": "^[0-9]{4}-[0-9]{2}-[0-9]{2}"}}),
+    ADD_GOAL: _schema({"name": {"type": "string", "minLength": 1}, "target_amount": {"type": "number"},
+                       "deadline": {"type": "string"}}, ["name", "target_amount", "deadline"]),
+    GOAL_PROGRESS: _schema({"summary": _SUMMARY, "annual_return": {"type": "number"}}),
+    EXPORT_TRANSACTIONS: _schema({"fmt": {"enum": ["arrow", "parquet"]}, "force": {"type": "boolean"}}),
+    SPENDING_TRENDS: _schema({"window": {"type": "integer", "minimum": 1},
+                              "n_movers": {"type": "integer", "minimum": 0}}),
+}
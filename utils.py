@@ -1,9 +1,148 @@
 # utils.py
 import os
+import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
 ALPHA_VANTAGE_KEY = os.getenv("ALPHA_VANTAGE_KEY")
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
+# external HTTP APIs; base URLs can point at a local stub server
+COINGECKO_API_URL = os.getenv("COINGECKO_API_URL", "https://api.coingecko.com/api/v3")
+NEWSAPI_URL = os.getenv("NEWSAPI_URL", "https://newsapi.org/v2")
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))  # seconds
 APP_SECRET_KEY = os.getenv("APP_SECRET_KEY", "dev-secret")
+
+# application database (memory.py); one pooled engine per process
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///smart_finance_coach.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "30"))  # seconds a writer waits on a locked SQLite file
+
+# read monthly summaries from the per-month rollup table instead of a GROUP BY over transactions
+USE_MONTH_ROLLUP = os.getenv("USE_MONTH_ROLLUP", "1") == "1"
+
+# expected annual return applied to goal savings projections (0.07 = 7%); 0 means cash savings
+GOAL_ANNUAL_RETURN = float(os.getenv("GOAL_ANNUAL_RETURN", "0"))
+
+# processes used by risk.simulate for large path counts; 0 or 1 simulates in-process
+RISK_SIM_WORKERS = int(os.getenv("RISK_SIM_WORKERS", "0"))
+
+# stats_cache.py: covariance blocks shared across requests (portfolio.estimate_moments); baskets
+# smaller than STATS_CACHE_MIN_TICKERS are cheaper to compute directly
+STATS_CACHE_ENABLED = os.getenv("STATS_CACHE_ENABLED", "1") == "1"
+STATS_CACHE_MIN_TICKERS = int(os.getenv("STATS_CACHE_MIN_TICKERS", "2"))
+STATS_CACHE_MAX_BLOCKS = int(os.getenv("STATS_CACHE_MAX_BLOCKS", "32"))  # date spans kept, least recently used out
+STATS_CACHE_MAX_TICKERS = int(os.getenv("STATS_CACHE_MAX_TICKERS", "2000"))  # tickers per span
+
+# batch_reports.py: users per chunk and processes computing chunks; 0 or 1 computes in-process
+BATCH_REPORT_CHUNK_SIZE = int(os.getenv("BATCH_REPORT_CHUNK_SIZE", "5000"))
+BATCH_REPORT_WORKERS = int(os.getenv("BATCH_REPORT_WORKERS", "0"))
+
+# categorize.py: merchants whose matched rules are memoised per compiled rule set, and users whose
+# compiled rule sets are kept in memory
+CATEGORIZE_CACHE_SIZE = int(os.getenv("CATEGORIZE_CACHE_SIZE", "50000"))
+CATEGORIZE_MAX_USERS = int(os.getenv("CATEGORIZE_MAX_USERS", "1024"))
+# map synonyms such as "eating out" onto the default category names (off: typed names are kept)
+CATEGORY_ALIASES_ENABLED = os.getenv("CATEGORY_ALIASES_ENABLED", "0") == "1"
+
+# advisor.py: model backend ("gemini" or "fake" for offline/latency tests) and response cache
+ADVISOR_BACKEND = os.getenv("ADVISOR_BACKEND", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+ADVICE_CACHE_DB = os.getenv("ADVICE_CACHE_DB", "advice_cache.db")  # "" keeps the cache in memory only
+ADVICE_CACHE_TTL = int(os.getenv("ADVICE_CACHE_TTL", "21600"))  # seconds
+ADVICE_CACHE_MAX_ENTRIES = int(os.getenv("ADVICE_CACHE_MAX_ENTRIES", "500"))
+ADVICE_MAX_PROMPT_CHARS = int(os.getenv("ADVICE_MAX_PROMPT_CHARS", "4000"))
+ADVICE_NEWS_TTL = int(os.getenv("ADVICE_NEWS_TTL", "300"))  # seconds headlines are reused between prompts
+
+# anomaly.py: flag an expense when it is this many deviations above its category's running or recent
+# mean and above the category's running ANOMALY_QUANTILE; categories need ANOMALY_MIN_HISTORY expenses first
+ANOMALY_Z_THRESHOLD = float(os.getenv("ANOMALY_Z_THRESHOLD", "3"))
+ANOMALY_MIN_HISTORY = int(os.getenv("ANOMALY_MIN_HISTORY", "8"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1"))
+ANOMALY_QUANTILE = float(os.getenv("ANOMALY_QUANTILE", "0.95"))
+
+# metrics.py: in-process counters/timers; METRICS_PORT > 0 serves /metrics and /metrics.json
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# scheduler.py: background refresh of watched/held tickers and overnight report snapshots
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "0") == "1"  # run inside the Streamlit process
+PREWARM_PRICE_INTERVAL = int(os.getenv("PREWARM_PRICE_INTERVAL", "300"))  # seconds, while the market is open
+PREWARM_PERIOD = os.getenv("PREWARM_PERIOD", "5y")  # longest history the app asks for
+REPORT_PREWARM_HOUR = int(os.getenv("REPORT_PREWARM_HOUR", "2"))  # local hour of the nightly report run
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))  # fraction of the interval
+SCHEDULER_MAX_BACKOFF = int(os.getenv("SCHEDULER_MAX_BACKOFF", "1800"))  # seconds
+MARKET_TIMEZONE = os.getenv("MARKET_TIMEZONE", "America/New_York")
+MARKET_OPEN = os.getenv("MARKET_OPEN", "09:30")
+MARKET_CLOSE = os.getenv("MARKET_CLOSE", "16:00")
+
+# api.py: headless HTTP API over Crew; API_TOKEN, when set, is required as "Authorization: Bearer <token>"
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_PROCESSES = int(os.getenv("API_PROCESSES", "1"))  # forked worker processes sharing the socket; 0 = one per CPU
+API_THREADS = int(os.getenv("API_THREADS", "8"))  # agent calls running at once per process
+API_MAX_PENDING = int(os.getenv("API_MAX_PENDING", "64"))  # queued + running calls before answering 503
+API_MAX_BATCH = int(os.getenv("API_MAX_BATCH", "20"))
+API_TOKEN = os.getenv("API_TOKEN", "")
+
+# columnar transaction exports read by analytics.py
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+
+# local OHLCV cache used by data_fetchers; set PRICE_CACHE_DB="" to disable it
+PRICE_CACHE_DB = os.getenv("PRICE_CACHE_DB", "price_cache.db")
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", "900"))  # seconds
+PRICE_CACHE_MAX_ROWS = int(os.getenv("PRICE_CACHE_MAX_ROWS", "2000000"))
+
+_PERIOD_DAYS = {"d": 1, "wk": 7, "mo": 31, "y": 366}
+
+
+def _market_time(value):
+    hour, minute = value.split(":")
+    return datetime.time(int(hour), int(minute))
+
+
+def market_is_open(now=None):
+    """Regular session on a weekday (exchange holidays are not modelled)."""
+    from zoneinfo import ZoneInfo
+    local = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(ZoneInfo(MARKET_TIMEZONE))
+    return local.weekday() < 5 and _market_time(MARKET_OPEN) <= local.time() < _market_time(MARKET_CLOSE)
+
+
+def last_market_close(now=None):
+    """UTC datetime of the most recent weekday close at or before now."""
+    from zoneinfo import ZoneInfo
+    tz = ZoneInfo(MARKET_TIMEZONE)
+    local = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(tz)
+    day = local.date()
+    while True:
+        close = datetime.datetime.combine(day, _market_time(MARKET_CLOSE), tz)
+        if day.weekday() < 5 and close <= local:
+            return close.astimezone(datetime.timezone.utc)
+        day -= datetime.timedelta(days=1)
+
+
+def next_market_open(now=None):
+    """UTC datetime of the next weekday open after now."""
+    from zoneinfo import ZoneInfo
+    tz = ZoneInfo(MARKET_TIMEZONE)
+    local = (now or datetime.datetime.now(datetime.timezone.utc)).astimezone(tz)
+    day = local.date()
+    while True:
+        opening = datetime.datetime.combine(day, _market_time(MARKET_OPEN), tz)
+        if day.weekday() < 5 and opening > local:
+            return opening.astimezone(datetime.timezone.utc)
+        day += datetime.timedelta(days=1)
+
+
+def period_to_days(period):
+    """Calendar days covered by a yfinance-style period ("5d", "6mo", "1y", "ytd"). None for "max"."""
+    period = (period or "").strip().lower()
+    if period == "ytd":
+        today = datetime.date.today()
+        return (today - datetime.date(today.year, 1, 1)).days + 1
+    for suffix, days in _PERIOD_DAYS.items():
+        if period.endswith(suffix) and period[:-len(suffix)].isdigit():
+            return int(period[:-len(suffix)]) * days
+    return None